@@ -0,0 +1,88 @@
+"""
+Admission control for request handlers.
+
+At most ``max_concurrent`` requests run at once. Further requests wait in a
+queue of at most ``max_queue`` for up to ``queue_timeout_ms``; beyond that
+they are shed immediately instead of piling up on worker threads, so a stall
+in SQLite or the model tier turns into fast 503s (or a degraded answer)
+rather than every request timing out together.
+"""
+
+import threading
+
+ACCEPTED = 'accepted'
+QUEUED = 'queued'
+# Shed: the wait queue was full, or no slot freed up in time
+SHED_QUEUE_FULL = 'shed_queue_full'
+SHED_TIMEOUT = 'shed_timeout'
+# Served by the degraded fallback after being shed
+DEGRADED = 'degraded'
+
+
+class Overloaded(Exception):
+    """Raised when even the degraded path cannot take more work"""
+
+
+class AdmissionController:
+    """Concurrency limit with a bounded, time-limited wait queue"""
+
+    def __init__(self, max_concurrent, max_queue=64, queue_timeout_ms=1000):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout_ms / 1000
+        self.counts = {outcome: 0 for outcome in (ACCEPTED, QUEUED, SHED_QUEUE_FULL, SHED_TIMEOUT, DEGRADED)}
+        self.in_flight = 0
+        self.waiting = 0
+        self._slots = threading.Semaphore(max_concurrent)
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a slot, waiting if allowed; returns the outcome (ACCEPTED, QUEUED or a SHED_* value)"""
+        if self._slots.acquire(blocking=False):
+            return self._admitted(ACCEPTED)
+
+        with self._lock:
+            if self.waiting >= self.max_queue:
+                self.counts[SHED_QUEUE_FULL] += 1
+                return SHED_QUEUE_FULL
+            self.waiting += 1
+        try:
+            admitted = self._slots.acquire(timeout=self.queue_timeout)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        if not admitted:
+            with self._lock:
+                self.counts[SHED_TIMEOUT] += 1
+            return SHED_TIMEOUT
+        return self._admitted(QUEUED)
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def record_degraded(self):
+        with self._lock:
+            self.counts[DEGRADED] += 1
+
+    def stats(self):
+        """Limits, current occupancy and outcome counters"""
+        with self._lock:
+            counts = dict(self.counts)
+            in_flight, waiting = self.in_flight, self.waiting
+        return {
+            'max_concurrent': self.max_concurrent,
+            'max_queue': self.max_queue,
+            'queue_timeout_ms': self.queue_timeout * 1000,
+            'in_flight': in_flight,
+            'waiting': waiting,
+            'outcomes': counts,
+            'shed': counts[SHED_QUEUE_FULL] + counts[SHED_TIMEOUT]
+        }
+
+    def _admitted(self, outcome):
+        with self._lock:
+            self.in_flight += 1
+            self.counts[outcome] += 1
+        return outcome
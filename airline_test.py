@@ -2,157 +2,197 @@
 """
 Comprehensive test for airline industry intent classification
 Tests all 26 categories with realistic airline customer service scenarios
+
+    python airline_test.py                 # against a running server, cases in parallel
+    python airline_test.py --offline       # classifier only, no server needed
 """
 
-import requests
-import sqlite3
+import argparse
+import os
 import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import intent_engine
 
 # Configuration
-BASE_URL = "http://localhost:5000"
-DB_PATH = "chat.db"
+BASE_URL = os.environ.get('BASE_URL', "http://localhost:5000")
+WORKERS = 8
+
+# Airline customer service scenarios: (message, expected intent)
+TEST_CASES = [
+    # Core booking and cancellation
+    ("I want to book a flight to New York", "Booking"),
+    ("Please help me reserve a seat", "Booking"),
+    ("Cancel my flight booking", "Cancellation"),
+    ("I need to cancel my reservation", "Cancellation"),
+
+    # Inquiries and complaints
+    ("What time does my flight depart?", "Inquiry"),
+    ("I have a question about baggage", "Inquiry"),
+    ("I'm very unhappy with the service", "Complaint"),
+    ("There's a problem with my booking", "Complaint"),
+
+    # Feedback and support
+    ("I want to leave feedback about my experience", "Feedback"),
+    ("Here's my review of the flight", "Feedback"),
+    ("I need help with my booking", "Support"),
+    ("Can you assist me please?", "Support"),
+
+    # Refunds and changes
+    ("I want my money back", "Refund"),
+    ("Request a refund for my ticket", "Refund"),
+    ("I need to change my flight date", "Change"),
+    ("Can I modify my booking?", "Change"),
+
+    # Upgrades and rescheduling
+    ("I want to upgrade to business class", "Upgrade"),
+    ("Can I get a premium seat?", "Upgrade"),
+    ("I need to reschedule my flight", "Reschedule"),
+    ("Change my flight to a different time", "Reschedule"),
+
+    # Check-in and boarding
+    ("How do I check in online?", "Check-in"),
+    ("I need help with check-in", "Check-in"),
+    ("What gate is my flight boarding from?", "Boarding"),
+    ("When does boarding start?", "Boarding"),
+
+    # Seating and amenities
+    ("I want a window seat", "Seating"),
+    ("Can I select my seat?", "Seating"),
+    ("What amenities are available on the flight?", "Amenities"),
+    ("Do you have Wi-Fi on board?", "Amenities"),
+
+    # Meals and information
+    ("What meal options do you have?", "Meals"),
+    ("I have dietary restrictions", "Meals"),
+    ("Tell me about your flight schedules", "Information"),
+    ("I need information about baggage allowance", "Information"),
+
+    # Loyalty and rewards
+    ("How do I join your frequent flyer program?", "Loyalty Programs"),
+    ("What are the benefits of membership?", "Loyalty Programs"),
+    ("How can I redeem my miles?", "Rewards"),
+    ("What rewards can I earn?", "Rewards"),
+
+    # Promotions and offers
+    ("Do you have any special deals?", "Promotions"),
+    ("Are there any current promotions?", "Promotions"),
+    ("What offers are available?", "Offers"),
+    ("Show me your latest deals", "Offers"),
+
+    # Discounts and policies
+    ("Can I get a discount on my ticket?", "Discounts"),
+    ("Do you offer student discounts?", "Discounts"),
+    ("What is your cancellation policy?", "Policies"),
+    ("Tell me about your refund policy", "Policies"),
+
+    # Procedures and regulations
+    ("How do I change my booking?", "Procedures"),
+    ("What's the process for upgrades?", "Procedures"),
+    ("What are the travel requirements?", "Regulations"),
+    ("Do I need a visa for this destination?", "Regulations"),
+
+    # Security and safety
+    ("What items are prohibited in carry-on?", "Security"),
+    ("Tell me about security procedures", "Security"),
+    ("Is it safe to fly during the pandemic?", "Safety"),
+    ("What safety measures do you have?", "Safety"),
+]
+
+def run_offline(test_cases):
+    """Classify every case in-process with the rule engine; returns (intent, confidence, response) per case"""
+    messages = [message for message, _ in test_cases]
+    return intent_engine.classify_batch(messages)
+
+
+def run_case(base_url, message):
+    """Send one message through /api/message in a fresh session; returns (intent, confidence, response)"""
+    with requests.Session() as session:
+        response = session.post(f"{base_url}/api/message", json={'message': message}, timeout=30)
+        response.raise_for_status()
+        data = response.json()
+        return data['intent'], data['confidence'], data['response']
+
+
+def run_online(test_cases, base_url=BASE_URL, workers=WORKERS):
+    """Run every case against the server from a thread pool; failed requests come back as (None, None, error)"""
+    def attempt(message):
+        try:
+            return run_case(base_url, message)
+        except (requests.RequestException, ValueError, KeyError) as e:
+            return None, None, str(e)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(attempt, [message for message, _ in test_cases]))
+
+
+def confusion_matrix(expected, actual):
+    """{expected intent: {predicted intent: count}}"""
+    matrix = {}
+    for want, got in zip(expected, actual):
+        row = matrix.setdefault(want, {})
+        row[got] = row.get(got, 0) + 1
+    return matrix
+
 
-def test_airline_intents():
+def print_confusion_matrix(matrix):
+    """Per-intent counts with the expected intent as rows; columns are numbered to keep the table narrow"""
+    labels = list(matrix)
+    labels += sorted({got for row in matrix.values() for got in row if got not in matrix}, key=str)
+    width = max(len(str(label)) for label in labels)
+
+    print(f"{'expected / predicted':<{width + 5}}" + ''.join(f"{i:>4}" for i in range(len(labels))) + "  recall")
+    for i, label in enumerate(labels):
+        row = matrix.get(label)
+        if row is None:
+            continue
+        cells = ''.join(f"{row.get(got, 0) or '.':>4}" for got in labels)
+        recall = row.get(label, 0) / sum(row.values())
+        print(f"{i:>3}  {str(label):<{width}}{cells}  {recall:>5.0%}")
+    print("Columns: " + ", ".join(f"{i}={label}" for i, label in enumerate(labels)))
+
+
+def test_airline_intents(offline=False, base_url=BASE_URL, workers=WORKERS):
     """Test all airline industry intent categories"""
     
-    test_cases = [
-        # Core booking and cancellation
-        ("I want to book a flight to New York", "Booking"),
-        ("Please help me reserve a seat", "Booking"),
-        ("Cancel my flight booking", "Cancellation"),
-        ("I need to cancel my reservation", "Cancellation"),
-        
-        # Inquiries and complaints
-        ("What time does my flight depart?", "Inquiry"),
-        ("I have a question about baggage", "Inquiry"),
-        ("I'm very unhappy with the service", "Complaint"),
-        ("There's a problem with my booking", "Complaint"),
-        
-        # Feedback and support
-        ("I want to leave feedback about my experience", "Feedback"),
-        ("Here's my review of the flight", "Feedback"),
-        ("I need help with my booking", "Support"),
-        ("Can you assist me please?", "Support"),
-        
-        # Refunds and changes
-        ("I want my money back", "Refund"),
-        ("Request a refund for my ticket", "Refund"),
-        ("I need to change my flight date", "Change"),
-        ("Can I modify my booking?", "Change"),
-        
-        # Upgrades and rescheduling
-        ("I want to upgrade to business class", "Upgrade"),
-        ("Can I get a premium seat?", "Upgrade"),
-        ("I need to reschedule my flight", "Reschedule"),
-        ("Change my flight to a different time", "Reschedule"),
-        
-        # Check-in and boarding
-        ("How do I check in online?", "Check-in"),
-        ("I need help with check-in", "Check-in"),
-        ("What gate is my flight boarding from?", "Boarding"),
-        ("When does boarding start?", "Boarding"),
-        
-        # Seating and amenities
-        ("I want a window seat", "Seating"),
-        ("Can I select my seat?", "Seating"),
-        ("What amenities are available on the flight?", "Amenities"),
-        ("Do you have Wi-Fi on board?", "Amenities"),
-        
-        # Meals and information
-        ("What meal options do you have?", "Meals"),
-        ("I have dietary restrictions", "Meals"),
-        ("Tell me about your flight schedules", "Information"),
-        ("I need information about baggage allowance", "Information"),
-        
-        # Loyalty and rewards
-        ("How do I join your frequent flyer program?", "Loyalty Programs"),
-        ("What are the benefits of membership?", "Loyalty Programs"),
-        ("How can I redeem my miles?", "Rewards"),
-        ("What rewards can I earn?", "Rewards"),
-        
-        # Promotions and offers
-        ("Do you have any special deals?", "Promotions"),
-        ("Are there any current promotions?", "Promotions"),
-        ("What offers are available?", "Offers"),
-        ("Show me your latest deals", "Offers"),
-        
-        # Discounts and policies
-        ("Can I get a discount on my ticket?", "Discounts"),
-        ("Do you offer student discounts?", "Discounts"),
-        ("What is your cancellation policy?", "Policies"),
-        ("Tell me about your refund policy", "Policies"),
-        
-        # Procedures and regulations
-        ("How do I change my booking?", "Procedures"),
-        ("What's the process for upgrades?", "Procedures"),
-        ("What are the travel requirements?", "Regulations"),
-        ("Do I need a visa for this destination?", "Regulations"),
-        
-        # Security and safety
-        ("What items are prohibited in carry-on?", "Security"),
-        ("Tell me about security procedures", "Security"),
-        ("Is it safe to fly during the pandemic?", "Safety"),
-        ("What safety measures do you have?", "Safety"),
-    ]
+    test_cases = TEST_CASES
     
-    print("🛫 Testing Airline Industry Intent Classification")
+    mode = "offline (rule engine)" if offline else f"online ({base_url}, {workers} workers)"
+    print(f"🛫 Testing Airline Industry Intent Classification - {mode}")
     print("=" * 50)
     
+    started = time.perf_counter()
+    if offline:
+        results = run_offline(test_cases)
+    else:
+        results = run_online(test_cases, base_url, workers)
+    wall_time = time.perf_counter() - started
+    
     passed = 0
     failed = 0
     
-    for message, expected_intent in test_cases:
-        print(f"\nTesting: '{message}' -> Expected: {expected_intent}")
-        
-        # Create a fresh session for each test
-        session = requests.Session()
-        
-        # First, get the initial page to establish session
-        initial_response = session.get(BASE_URL)
-        session_id = session.cookies.get('session_id')
-        
-        # Send message (this will redirect)
-        response = session.post(BASE_URL, data={'message': message}, allow_redirects=True)
-        
-        # Check if session ID changed
-        final_session_id = session.cookies.get('session_id')
+    for (message, expected_intent), (actual_intent, confidence, bot_response) in zip(test_cases, results):
+        if actual_intent is None:
+            print(f"❌ FAIL '{message}' -> {bot_response}")
+            failed += 1
+            continue
         
-        if response.status_code == 200 and final_session_id:
-            # Give database a moment to process
-            time.sleep(0.1)
-            
-            # Check database for latest bot message
-            conn = sqlite3.connect(DB_PATH)
-            cur = conn.cursor()
-            
-            cur.execute("""
-                SELECT intent, confidence, content 
-                FROM messages 
-                WHERE session_id = ? AND role = 'bot' 
-                ORDER BY timestamp DESC 
-                LIMIT 1
-            """, (final_session_id,))
-            
-            result = cur.fetchone()
-            conn.close()
-            
-            if result:
-                actual_intent, confidence, bot_response = result
-                if actual_intent == expected_intent:
-                    status = "✅ PASS"
-                    passed += 1
-                else:
-                    status = "❌ FAIL"
-                    failed += 1
-                
-                print(f"{status} Got: {actual_intent} (Confidence: {confidence})")
-                print(f"   Bot Response: {bot_response[:80]}...")
-            else:
-                print("❌ FAIL No bot response found")
-                failed += 1
+        if actual_intent == expected_intent:
+            passed += 1
         else:
-            print(f"❌ FAIL HTTP {response.status_code}")
             failed += 1
+            print(f"❌ FAIL '{message}' -> Expected: {expected_intent}, Got: {actual_intent} (Confidence: {confidence})")
+            print(f"   Bot Response: {bot_response[:80]}...")
+    
+    print("\n" + "="*50)
+    print("🛫 CONFUSION MATRIX")
+    print("="*50)
+    print_confusion_matrix(confusion_matrix(
+        [expected for _, expected in test_cases],
+        [result[0] or 'ERROR' for result in results]
+    ))
     
     print("\n" + "="*50)
     print("🛫 AIRLINE INTENT TEST SUMMARY")
@@ -161,24 +201,40 @@ def test_airline_intents():
     print(f"Passed: {passed}")
     print(f"Failed: {failed}")
     print(f"Success Rate: {(passed/(passed+failed)*100):.1f}%")
+    print(f"Wall Time: {wall_time:.3f}s")
     
     return passed == (passed + failed)
 
+
+def wait_for_server(base_url, timeout=10):
+    """Poll the server until it answers or timeout seconds pass"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return requests.get(base_url, timeout=5).status_code == 200
+        except requests.RequestException:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.2)
+
+
 if __name__ == "__main__":
-    # Wait for server
-    print("⏳ Waiting for server...")
-    time.sleep(2)
+    parser = argparse.ArgumentParser(description="Airline intent classification test")
+    parser.add_argument("--offline", action="store_true", help="Call the classifier directly; no server needed")
+    parser.add_argument("--url", default=BASE_URL, help="Server base URL for the online mode")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Concurrent requests in the online mode")
+    args = parser.parse_args()
     
     try:
-        response = requests.get(BASE_URL, timeout=5)
-        if response.status_code == 200:
+        if not args.offline:
+            print("⏳ Waiting for server...")
+            if not wait_for_server(args.url):
+                raise SystemExit("❌ Server not responding")
             print("✅ Server is ready!")
-            success = test_airline_intents()
-            if success:
-                print("\n🎉 All airline intent tests passed!")
-            else:
-                print("\n⚠️ Some tests failed. Check output above.")
+        success = test_airline_intents(args.offline, args.url, args.workers)
+        if success:
+            print("\n🎉 All airline intent tests passed!")
         else:
-            print("❌ Server not responding")
-    except Exception as e:
+            print("\n⚠️ Some tests failed. Check output above.")
+    except requests.RequestException as e:
         print(f"❌ Error: {e}") 
\ No newline at end of file
@@ -0,0 +1,469 @@
+"""
+Asyncio (ASGI) entry point for the chat app.
+
+Serves the chat routes from a single event loop instead of one worker thread
+per in-flight request. Rule classification runs inline on the loop (it is
+pure CPU work measured in microseconds) and the optional model tier of the
+cascade is awaited without blocking it; everything that touches SQLite runs on a
+small bounded thread pool whose threads each keep one persistent connection.
+Idle clients such as open live-stats streams therefore cost a coroutine and a
+queue rather than a thread, so one process can hold thousands of them.
+
+Run with any ASGI server, e.g.::
+
+    uvicorn asgi_app:app --port 5000
+
+Routes served here: ``/``, ``/api/message``, ``/api/history``, ``/api/stats``,
+``/api/stats/stream``, ``/api/clear_session`` and ``/metrics`` (the WSGI app's
+registry; SQLite statements per request are only counted under WSGI). The WSGI
+app in ``enhanced_ui.py`` is unchanged and still serves every route.
+"""
+
+import asyncio
+import functools
+import json
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qsl
+
+import enhanced_ui as ui
+import intent_engine
+import metrics
+from message_writer import utc_timestamp
+from stats_stream import AsyncSubscriberQueue
+
+logger = logging.getLogger(__name__)
+
+# Thread pool for SQLite work; each thread keeps its own connection
+ASGI_DB_WORKERS = int(os.environ.get('ASGI_DB_WORKERS', str(ui.SQLITE_POOL_SIZE)))
+# Requests allowed to wait for a DB thread before new ones get 503
+ASGI_DB_MAX_PENDING = int(os.environ.get('ASGI_DB_MAX_PENDING', '1000'))
+ASGI_DB_QUEUE_TIMEOUT_MS = int(os.environ.get('ASGI_DB_QUEUE_TIMEOUT_MS', '5000'))
+ASGI_MAX_BODY_BYTES = int(os.environ.get('ASGI_MAX_BODY_BYTES', str(1024 * 1024)))
+
+SESSION_COOKIE_MAX_AGE = 30 * 24 * 60 * 60  # 30 days
+
+
+class ServiceUnavailable(Exception):
+    """The DB executor backlog is full"""
+
+
+class DBExecutor:
+    """Runs blocking SQLite calls on a fixed pool of threads with a bounded backlog"""
+
+    def __init__(self, workers, max_pending, queue_timeout_ms):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout_ms / 1000
+        self.submitted = 0
+        self.rejected = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='asgi-db')
+        self._slots = asyncio.Semaphore(workers + max_pending)
+
+    async def run(self, fn, *args, **kwargs):
+        """Run fn in the pool; raises ServiceUnavailable if no slot frees up in time"""
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise ServiceUnavailable(f"DB backlog full ({self.max_pending} waiting)")
+        try:
+            self.submitted += 1
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'max_pending': self.max_pending,
+            'submitted': self.submitted,
+            'rejected': self.rejected
+        }
+
+
+class Request:
+    """The parts of an ASGI HTTP scope the handlers need"""
+
+    def __init__(self, scope, body=b''):
+        self.scope = scope
+        self.method = scope['method']
+        self.path = scope['path']
+        self.args = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                        for name, value in scope.get('headers', [])}
+        self.body = body
+        cookie = SimpleCookie(self.headers.get('cookie', ''))
+        self.cookies = {key: morsel.value for key, morsel in cookie.items()}
+
+    @property
+    def remote_addr(self):
+        client = self.scope.get('client')
+        return client[0] if client else None
+
+    def form(self):
+        return dict(parse_qsl(self.body.decode('utf-8', 'replace')))
+
+    def json(self):
+        try:
+            return json.loads(self.body or b'null')
+        except ValueError:
+            return None
+
+
+class HTTPResponse:
+    """Buffered response sent in one ASGI body message"""
+
+    def __init__(self, body=b'', status=200, content_type='text/html; charset=utf-8', headers=None):
+        self.body = body.encode('utf-8') if isinstance(body, str) else body
+        self.status = status
+        self.headers = [('content-type', content_type)] + list(headers or [])
+
+    def set_cookie(self, value, max_age=SESSION_COOKIE_MAX_AGE):
+        if value:
+            cookie = f"session_id={value}; Max-Age={max_age}; Path=/"
+        else:
+            cookie = "session_id=; Expires=Thu, 01 Jan 1970 00:00:00 GMT; Max-Age=0; Path=/"
+        self.headers.append(('set-cookie', cookie))
+
+    async def send(self, send):
+        await send({
+            'type': 'http.response.start',
+            'status': self.status,
+            'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in self.headers]
+        })
+        await send({'type': 'http.response.body', 'body': self.body})
+
+
+def json_response(data, status=200):
+    return HTTPResponse(json.dumps(data), status, 'application/json')
+
+
+def redirect(location):
+    return HTTPResponse(b'', 302, headers=[('location', location)])
+
+
+def render(template, **context):
+    """Render one of the Flask app's templates (no request context needed)"""
+    return ui.app.jinja_env.get_template(template).render(**context)
+
+
+async def classify_message(user_message, session_id):
+    """Async counterpart of enhanced_ui.classify_message; waits for the model tier without blocking the loop"""
+    classifier = ui.get_cascade()
+    if classifier is None:
+        return ui.classify_message(user_message, session_id)
+    started = time.perf_counter()
+    intent, confidence, template, tier = await classifier.classify_async(user_message)
+    response = intent_engine.render_response(template, user_message, session_id)
+    ui.record_classification(intent, tier, time.perf_counter() - started)
+    return response, intent, confidence, tier
+
+
+def open_session(request):
+    """Return (session_id, is_new) from the cookie, minting a new id if absent"""
+    session_id = request.cookies.get('session_id')
+    if session_id:
+        return session_id, False
+    session_id = str(uuid.uuid4())
+    logger.info(f"New session created: {session_id}")
+    return session_id, True
+
+
+class ChatASGIApp:
+    """Dependency-free ASGI application exposing the chat routes"""
+
+    def __init__(self):
+        self.db = None
+        self.routes = {
+            '/': self.chat,
+            '/api/message': self.api_message,
+            '/api/history': self.api_history,
+            '/api/stats': self.api_stats,
+            '/api/clear_session': self.clear_session,
+            '/metrics': self.metrics_endpoint
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        self.startup()
+
+        if scope['path'] == '/api/stats/stream':
+            await self.api_stats_stream(Request(scope), receive, send)
+            return
+
+        started = time.perf_counter()
+        handler = self.routes.get(scope['path'])
+        if handler is None:
+            response = HTTPResponse(render('error.html', error="Page not found"), 404)
+        else:
+            body = await self.read_body(receive)
+            if body is None:
+                response = json_response({'error': 'Request body too large'}, 413)
+            else:
+                try:
+                    response = await handler(Request(scope, body))
+                except ServiceUnavailable as e:
+                    logger.warning(f"Rejecting {scope['path']}: {e}")
+                    response = json_response({'error': 'Server busy'}, 503)
+                    response.headers.append(('retry-after', '1'))
+                except Exception as e:
+                    logger.error(f"Internal server error: {e}")
+                    ui.ERRORS.labels('unhandled').inc()
+                    response = HTTPResponse(render('error.html', error="Internal server error"), 500)
+        route = scope['path'] if handler is not None else 'unmatched'
+        ui.REQUEST_SECONDS.labels(route, scope['method']).observe(time.perf_counter() - started)
+        ui.RESPONSES.labels(route, response.status).inc()
+        await response.send(send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.db is not None:
+                    self.db.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def startup(self):
+        """Create the DB executor on first use, inside the running loop"""
+        if self.db is None:
+            ui.init_database()
+            self.db = DBExecutor(ASGI_DB_WORKERS, ASGI_DB_MAX_PENDING, ASGI_DB_QUEUE_TIMEOUT_MS)
+            logger.info(f"ASGI app ready with {ASGI_DB_WORKERS} DB threads")
+
+    async def read_body(self, receive):
+        """Read the whole request body; None if it exceeds ASGI_MAX_BODY_BYTES"""
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > ASGI_MAX_BODY_BYTES:
+                return None
+            chunks.append(chunk)
+            if not message.get('more_body'):
+                break
+        return b''.join(chunks)
+
+    async def chat(self, request):
+        """Main chat interface"""
+        session_id, is_new = open_session(request)
+
+        if request.method == 'POST':
+            user_message = request.form().get('message', '').strip()
+            if not user_message:
+                logger.warning(f"Empty message received from session {session_id}")
+                await self.db.run(ui.track_session, session_id, is_new,
+                                  request.headers.get('user-agent', ''), request.remote_addr)
+            else:
+                try:
+                    await self.chat_turn(request, session_id, is_new, user_message)
+                except ServiceUnavailable:
+                    raise
+                except Exception as e:
+                    logger.error(f"Error processing message: {e}")
+                    ui.ERRORS.labels('chat_turn').inc()
+            response = redirect('/')
+            response.set_cookie(session_id)
+            return response
+
+        def load_page():
+            ui.track_session(session_id, is_new, request.headers.get('user-agent', ''), request.remote_addr)
+            message_list, session_stats = ui.load_chat_page(session_id)
+            return render('enhanced_chat.html', messages=message_list, stats=session_stats)
+
+        response = HTTPResponse(await self.db.run(load_page))
+        response.set_cookie(session_id)
+        return response
+
+    async def chat_turn(self, request, session_id, is_new, user_message, with_stats=False):
+        """Classify inline, then store the turn (and read the updated stats if asked) off the loop
+
+        Stats are None unless ``with_stats``; the form POST redirects and the
+        page load reads them anyway.
+        """
+        started = time.perf_counter()
+        bot_reply, intent, confidence, tier = await classify_message(user_message, session_id)
+
+        def store():
+            ui.track_session(session_id, is_new, request.headers.get('user-agent', ''), request.remote_addr)
+            ui.save_chat_turn(session_id, user_message, bot_reply, intent, confidence)
+            if not with_stats:
+                return None
+            # Read-your-writes so the counters include this turn
+            ui.wait_for_session_writes(session_id)
+            return ui.get_session_stats(session_id)
+
+        stats = await self.db.run(store)
+        ui.chat_turn_log.log(session_id, user_message, bot_reply, intent, confidence, tier,
+                             (time.perf_counter() - started) * 1000)
+        return bot_reply, intent, confidence, tier, stats
+
+    async def api_message(self, request):
+        """Send one chat message and get the reply and updated session stats in one round-trip"""
+        if request.method != 'POST':
+            return json_response({'error': 'Method not allowed'}, 405)
+        session_id, is_new = open_session(request)
+        payload = request.json()
+        user_message = payload.get('message', '') if isinstance(payload, dict) else None
+
+        if not isinstance(user_message, str):
+            return json_response({'error': "Body must be a JSON object with a string 'message'"}, 400)
+        user_message = user_message.strip()
+        if not user_message:
+            logger.warning(f"Empty message received from session {session_id}")
+            return json_response({'error': 'Message is empty'}, 400)
+
+        try:
+            bot_reply, intent, confidence, tier, stats = await self.chat_turn(
+                request, session_id, is_new, user_message, with_stats=True
+            )
+        except ServiceUnavailable:
+            raise
+        except Exception as e:
+            logger.error(f"Error processing message: {e}")
+            ui.ERRORS.labels('chat_turn').inc()
+            return json_response({'error': 'Failed to process message'}, 500)
+
+        timestamp = utc_timestamp()
+        response = json_response({
+            'response': bot_reply,
+            'intent': intent,
+            'confidence': confidence,
+            'tier': tier,
+            'messages': [
+                {'role': 'user', 'content': user_message, 'timestamp': timestamp, 'intent': None, 'confidence': None},
+                {'role': 'bot', 'content': bot_reply, 'timestamp': timestamp, 'intent': intent, 'confidence': confidence}
+            ],
+            'stats': stats
+        })
+        response.set_cookie(session_id)
+        return response
+
+    async def api_history(self, request):
+        """Older pages of the current session's messages"""
+        session_id, is_new = open_session(request)
+        try:
+            limit = min(int(request.args.get('limit', ui.HISTORY_PAGE_SIZE)), ui.HISTORY_MAX_PAGE_SIZE)
+            if limit < 1:
+                raise ValueError("limit must be positive")
+            before = request.args.get('before') or None
+            if before is not None:
+                ui.decode_cursor(before)
+        except ValueError as e:
+            return json_response({'error': str(e)}, 400)
+
+        def load():
+            ui.track_session(session_id, is_new, request.headers.get('user-agent', ''), request.remote_addr)
+            ui.wait_for_session_writes(session_id)
+            return ui.fetch_history(ui.get_session_conn(session_id), session_id, limit, before)
+
+        try:
+            messages, next_cursor = await self.db.run(load)
+        except ServiceUnavailable:
+            raise
+        except Exception as e:
+            logger.error(f"Error getting history: {e}")
+            ui.ERRORS.labels('history').inc()
+            return json_response({'error': 'Failed to retrieve history'}, 500)
+        return json_response({'messages': messages, 'next_cursor': next_cursor})
+
+    async def metrics_endpoint(self, request):
+        """Prometheus text-format metrics"""
+        return HTTPResponse(ui.METRICS_REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+    async def api_stats(self, request):
+        """Chat statistics, plus the ASGI executor counters"""
+        try:
+            result = await self.db.run(ui.collect_stats, request.args)
+        except ValueError as e:
+            return json_response({'error': str(e)}, 400)
+        except ServiceUnavailable:
+            raise
+        except Exception as e:
+            logger.error(f"Error getting stats: {e}")
+            ui.ERRORS.labels('stats').inc()
+            return json_response({'error': 'Failed to retrieve stats'}, 500)
+        result['db_executor'] = self.db.stats()
+        return json_response(result)
+
+    async def clear_session(self, request):
+        """Clear current session for testing"""
+        session_id, is_new = open_session(request)
+        await self.db.run(ui.delete_session_messages, session_id)
+        response = redirect('/')
+        response.set_cookie('')
+        return response
+
+    async def api_stats_stream(self, request, receive, send):
+        """Server-Sent Events stream of session and global stats; holds no thread while idle"""
+        session_id, is_new = open_session(request)
+        await self.db.run(ui.track_session, session_id, is_new,
+                          request.headers.get('user-agent', ''), request.remote_addr)
+        broadcaster = ui.get_stats_broadcaster()
+
+        events = AsyncSubscriberQueue(asyncio.get_running_loop(), broadcaster.subscriber_queue_size)
+        subscription = broadcaster.subscribe(session_id, events)
+        if subscription is None:
+            logger.warning(f"Stats stream refused for {session_id}: {broadcaster.max_subscribers} connections open")
+            response = json_response({'error': 'Too many live stats connections'}, 503)
+            response.headers.append(('retry-after', str(int(ui.SSE_HEARTBEAT_SECONDS))))
+            await response.send(send)
+            return
+
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+                (b'set-cookie', f"session_id={session_id}; Max-Age={SESSION_COOKIE_MAX_AGE}; Path=/".encode('latin-1'))
+            ]
+        })
+
+        async def pump():
+            async for chunk in broadcaster.stream_async(*subscription):
+                await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+
+        async def wait_for_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        # Stop streaming as soon as the client goes away
+        streaming = asyncio.ensure_future(pump())
+        disconnected = asyncio.ensure_future(wait_for_disconnect())
+        try:
+            await asyncio.wait({streaming, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            streaming.cancel()
+            disconnected.cancel()
+            broadcaster.unsubscribe(subscription[0])
+
+
+app = ChatASGIApp()
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=5000)
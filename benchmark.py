@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+In-process benchmark suite for the chat app and the intent engine.
+
+Drives ``enhanced_ui.app`` through Flask's test client against a throwaway
+SQLite database, so no server, network or sleeps are involved. For every
+history size the database is seeded with that many messages in the
+benchmarked session, then these are timed:
+
+- ``chat_cycle``: POST / with a message followed by GET / (the form flow)
+- ``api_message``: POST /api/message (the JSON flow the page uses)
+- ``api_stats``: GET /api/stats
+- ``clear_session``: GET /api/clear_session on a fresh 20-message session
+
+``simulate_bot_response`` is also microbenchmarked on a synthetic corpus with
+a cold and a warm result cache. Results are written as JSON; pass an earlier
+file to ``--compare`` to print the change per benchmark.
+
+    python benchmark.py --sizes 1000 100000 1000000 --output bench.json
+    python benchmark.py --sizes 1000 --compare bench.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from airline_test import TEST_CASES
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+CLEAR_SESSION_MESSAGES = 20
+SEED_CHUNK = 10000
+
+FILLER_WORDS = ("please", "today", "urgent", "again", "flight", "tomorrow", "ticket", "thanks",
+                "hello", "quick", "question", "my", "the", "for", "xyz", "abc")
+
+
+def summarize(samples, elapsed):
+    """Latency percentiles (ms) and throughput for a list of per-request durations (s)"""
+    ordered = sorted(samples)
+
+    def pick(fraction):
+        return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000, 3)
+
+    return {
+        'requests': len(ordered),
+        'p50_ms': pick(0.50),
+        'p95_ms': pick(0.95),
+        'p99_ms': pick(0.99),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+        'throughput_rps': round(len(ordered) / elapsed, 1) if elapsed else None
+    }
+
+
+def synthetic_corpus(size, seed=0):
+    """Messages built from the test scenarios with filler words, case changes and some gibberish"""
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(size):
+        roll = rng.random()
+        if roll < 0.15:
+            words = rng.choices(FILLER_WORDS, k=rng.randint(2, 8))
+            messages.append(' '.join(words))
+            continue
+        text = rng.choice(TEST_CASES)[0]
+        if roll < 0.5:
+            text = f"{rng.choice(FILLER_WORDS)} {text} {rng.choice(FILLER_WORDS)}"
+        if roll > 0.9:
+            text = text.upper()
+        messages.append(text)
+    return messages
+
+
+def seed_history(conn, session_id, size, seed=0):
+    """Insert ``size`` messages (alternating user/bot, one second apart, ending now) into one session"""
+    rng = random.Random(seed)
+    start = datetime.now(timezone.utc) - timedelta(seconds=size)
+    conn.execute("INSERT OR IGNORE INTO sessions (session_id) VALUES (?)", (session_id,))
+    for chunk_start in range(0, size, SEED_CHUNK):
+        rows = []
+        for i in range(chunk_start, min(size, chunk_start + SEED_CHUNK)):
+            timestamp = (start + timedelta(seconds=i)).strftime('%Y-%m-%d %H:%M:%S')
+            text, intent = rng.choice(TEST_CASES)
+            if i % 2 == 0:
+                rows.append((session_id, 'user', text, None, None, timestamp))
+            else:
+                rows.append((session_id, 'bot', f"Reply about {intent.lower()}", intent, 0.85, timestamp))
+        conn.executemany("""
+            INSERT INTO messages (session_id, role, content, intent, confidence, timestamp)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, rows)
+    conn.commit()
+
+
+def time_requests(count, request):
+    samples = []
+    started = time.perf_counter()
+    for i in range(count):
+        t0 = time.perf_counter()
+        request(i)
+        samples.append(time.perf_counter() - t0)
+    return summarize(samples, time.perf_counter() - started)
+
+
+def check(response, expected=(200,)):
+    if response.status_code not in expected:
+        raise RuntimeError(f"Unexpected HTTP {response.status_code}: {response.get_data(as_text=True)[:200]}")
+    return response
+
+
+def stop_workers(ui):
+    """Drain and stop the app's background writers; they stay bound to the database they were started on"""
+    for workers in (ui._message_writers, ui._session_trackers):
+        for worker in workers.values():
+            worker.stop()
+        workers.clear()
+    if ui._stats_broadcaster is not None:
+        ui._stats_broadcaster.stop()
+        ui._stats_broadcaster = None
+
+
+def bench_routes(ui, db_path, size, requests, corpus):
+    """Seed a fresh database with ``size`` messages and time each route against it"""
+    ui.DB_PATH = db_path
+    ui.init_database()
+    session_id = str(uuid.uuid4())
+
+    started = time.perf_counter()
+    seed_history(ui.get_session_conn(session_id), session_id, size)
+    seed_s = time.perf_counter() - started
+
+    client = ui.app.test_client()
+    client.set_cookie('session_id', session_id)
+    # One untimed pass so lazily created pools, threads and caches exist
+    check(client.get('/'))
+
+    def chat_cycle(i):
+        check(client.post('/', data={'message': corpus[i % len(corpus)]}), (302,))
+        check(client.get('/'))
+
+    def api_message(i):
+        check(client.post('/api/message', json={'message': corpus[i % len(corpus)]}))
+
+    def api_stats(i):
+        check(client.get('/api/stats'))
+
+    clear_sessions = [str(uuid.uuid4()) for _ in range(requests)]
+    for clear_session_id in clear_sessions:
+        seed_history(ui.get_session_conn(clear_session_id), clear_session_id, CLEAR_SESSION_MESSAGES)
+    clear_client = ui.app.test_client()
+
+    def clear_session(i):
+        clear_client.set_cookie('session_id', clear_sessions[i])
+        check(clear_client.get('/api/clear_session'), (302,))
+
+    results = {
+        'history_size': size,
+        'seed_s': round(seed_s, 3),
+        'chat_cycle': time_requests(requests, chat_cycle),
+        'api_message': time_requests(requests, api_message),
+        'api_stats': time_requests(requests, api_stats),
+        'clear_session': time_requests(requests, clear_session)
+    }
+    stop_workers(ui)
+    results['db_bytes'] = sum(os.path.getsize(path) for path in ui.db_paths())
+    return results
+
+
+def bench_engine(ui, corpus, iterations):
+    """Per-call cost of simulate_bot_response with every message a cache miss, then with a warm cache"""
+    engine = ui.intent_engine
+    passes = {
+        # A counter suffix makes every message unique, so each call runs the matcher
+        'cold_cache': [f"{corpus[i % len(corpus)]} {i}" for i in range(iterations)],
+        'warm_cache': [corpus[i % len(corpus)] for i in range(iterations)]
+    }
+    for message in corpus:
+        ui.simulate_bot_response(message, 'benchmark-session')
+
+    results = {'corpus_size': len(corpus), 'iterations': iterations}
+    for label, messages in passes.items():
+        started = time.perf_counter()
+        for message in messages:
+            ui.simulate_bot_response(message, 'benchmark-session')
+        elapsed = time.perf_counter() - started
+        results[label] = {
+            'us_per_call': round(elapsed / iterations * 1e6, 3),
+            'calls_per_s': round(iterations / elapsed, 1)
+        }
+        if label == 'cold_cache':
+            # The unique messages evicted the corpus; bring it back before the warm pass
+            for message in corpus:
+                ui.simulate_bot_response(message, 'benchmark-session')
+    results['cache'] = engine.cache_info()
+    return results
+
+
+def run_metadata(args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'timestamp': datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'sizes': args.sizes,
+        'requests': args.requests,
+        'micro_iterations': args.micro_iterations,
+        'app_logging': args.app_logging,
+        'db_shards': int(os.environ.get('DB_SHARDS', '1'))
+    }
+
+
+def flatten(results):
+    """{'size=1000 api_stats p95_ms': value, ...} for comparing two runs"""
+    flat = {}
+    for route_results in results.get('routes', []):
+        prefix = f"size={route_results['history_size']}"
+        for name, stats in route_results.items():
+            if isinstance(stats, dict):
+                for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps'):
+                    flat[f"{prefix} {name} {metric}"] = stats[metric]
+    engine = results.get('engine', {})
+    for label in ('cold_cache', 'warm_cache'):
+        if label in engine:
+            flat[f"engine {label} us_per_call"] = engine[label]['us_per_call']
+    return flat
+
+
+def compare(previous, current):
+    """Text table of metrics present in both runs with the relative change"""
+    before = flatten(previous)
+    after = flatten(current)
+    lines = [f"{'metric':<45} {'before':>12} {'after':>12} {'change':>8}"]
+    for key in sorted(before.keys() & after.keys()):
+        old, new = before[key], after[key]
+        change = f"{(new - old) / old * 100:+.1f}%" if old else 'n/a'
+        lines.append(f"{key:<45} {old:>12} {new:>12} {change:>8}")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process benchmarks for routes and the intent engine")
+    parser.add_argument("--sizes", type=int, nargs='+', default=[1000, 10000, 100000],
+                        help="History sizes (messages in the benchmarked session), e.g. 1000 ... 1000000")
+    parser.add_argument("--requests", type=int, default=200, help="Timed requests per route and size")
+    parser.add_argument("--corpus-size", type=int, default=5000, help="Synthetic messages for the engine benchmark")
+    parser.add_argument("--micro-iterations", type=int, default=100000, help="simulate_bot_response calls per pass")
+    parser.add_argument("--skip-routes", action="store_true", help="Only run the engine microbenchmark")
+    parser.add_argument("--app-logging", action="store_true", help="Keep the app's INFO logging on while timing")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", metavar="JSON", help="Print the change against an earlier results file")
+    args = parser.parse_args()
+    # Relative to where the benchmark was started, not the directories it switches to
+    if args.output:
+        args.output = os.path.abspath(args.output)
+    if args.compare:
+        args.compare = os.path.abspath(args.compare)
+
+    workdir = tempfile.mkdtemp(prefix='chat-bench-')
+    # enhanced_ui opens chat.db and chat_app.log in the working directory on import
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    import enhanced_ui as ui
+
+    if not args.app_logging:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    corpus = synthetic_corpus(args.corpus_size)
+    results = {'meta': run_metadata(args), 'routes': []}
+    try:
+        if not args.skip_routes:
+            for size in args.sizes:
+                db_path = os.path.join(workdir, f"bench_{size}.db")
+                route_results = bench_routes(ui, db_path, size, args.requests, corpus)
+                results['routes'].append(route_results)
+                print(f"history={size:>8}  " + "  ".join(
+                    f"{name} p50={route_results[name]['p50_ms']}ms p95={route_results[name]['p95_ms']}ms"
+                    for name in ('chat_cycle', 'api_message', 'api_stats', 'clear_session')
+                ), flush=True)
+
+        results['engine'] = bench_engine(ui, corpus, args.micro_iterations)
+        print(f"simulate_bot_response: cold {results['engine']['cold_cache']['us_per_call']} us/call, "
+              f"warm {results['engine']['warm_cache']['us_per_call']} us/call")
+    finally:
+        stop_workers(ui)
+        os.chdir(REPO_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            print(compare(json.load(f), results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Rule-first, model-fallback intent classification.
+
+The compiled rule engine answers in microseconds and is trusted whenever its
+confidence reaches ``threshold``. Below that (in practice the generic
+fallback) the message is also sent to the zero-shot model, whose candidate
+labels are the rule table's intents. The caller waits at most ``timeout_ms``
+for it; a model that is slow, overloaded or broken never blocks a reply, the
+rule answer is used instead. Every result says which tier produced it and the
+per-tier counters show how many model calls the fast path saved.
+"""
+
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+import intent_engine
+from metrics import WAIT_MS_BUCKETS, Histogram
+
+logger = logging.getLogger(__name__)
+
+TIER_RULES = 'rules'
+TIER_MODEL = 'model'
+# Rule answer used because the model did not answer in time or failed
+TIER_RULES_TIMEOUT = 'rules_timeout'
+TIER_RULES_ERROR = 'rules_error'
+
+
+def remote_model(url, workers=4, max_queue=16):
+    """Model tier backed by a running inference_server; returns submit(text, labels) -> Future
+
+    Calls that time out keep running until the server answers, so at most
+    ``workers + max_queue`` may be running or queued; beyond that submit
+    raises queue.Full, like MicroBatcher, and the rule answer is used at once.
+    """
+    import requests
+
+    session = requests.Session()
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='cascade-model')
+    slots = threading.BoundedSemaphore(workers + max_queue)
+    endpoint = url.rstrip('/') + '/classify'
+
+    def call(text, labels):
+        response = session.post(endpoint, json={'text': text, 'labels': labels}, timeout=30)
+        response.raise_for_status()
+        return response.json()
+
+    def submit(text, labels):
+        if not slots.acquire(blocking=False):
+            raise queue.Full
+        try:
+            future = executor.submit(call, text, labels)
+        except Exception:
+            slots.release()
+            raise
+        future.add_done_callback(lambda _: slots.release())
+        return future
+    return submit
+
+
+def local_model(model, max_batch_size=16, max_wait_ms=10):
+    """Model tier running the zero-shot pipeline in-process behind a MicroBatcher
+
+    The pipeline is loaded by the batcher thread on the first batch, so
+    requests made while it loads simply time out to the rule answer.
+    """
+    from inference_server import MicroBatcher, pipeline_predict
+    from zero_shot import load_pipeline
+
+    def predict(texts, labels):
+        return pipeline_predict(load_pipeline(model))(texts, labels)
+
+    batcher = MicroBatcher(predict, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms).start()
+    return batcher.submit
+
+
+def knn_model(path, k=5):
+    """Model tier backed by an example-based vector index (see vector_index.py)
+
+    A query is one encode plus a matrix product, so it is answered inline and
+    the returned Future is already resolved.
+    """
+    from vector_index import VectorIndex
+
+    index = VectorIndex(path)
+
+    def submit(text, labels):
+        future = Future()
+        try:
+            result = index.classify(text, k, neighbors=False)
+            ranked = [(label, score) for label, score in zip(result['labels'], result['scores']) if label in labels]
+            if not ranked:
+                raise ValueError("No neighbour carries a candidate label")
+            future.set_result({'labels': [label for label, _ in ranked], 'scores': [score for _, score in ranked]})
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    return submit
+
+
+class Cascade:
+    """Runs the rule engine first and the model only for low-confidence messages"""
+
+    def __init__(self, submit, threshold=0.7, timeout_ms=300):
+        self.submit = submit
+        self.threshold = threshold
+        self.timeout = timeout_ms / 1000
+        self.tiers = {tier: 0 for tier in (TIER_RULES, TIER_MODEL, TIER_RULES_TIMEOUT, TIER_RULES_ERROR)}
+        self.model_ms = Histogram(WAIT_MS_BUCKETS)
+        self._lock = threading.Lock()
+
+    def classify(self, user_message):
+        """Return (intent, confidence, response template, tier), waiting up to the timeout for the model"""
+        rule_result, future, started = self._start(user_message)
+        if future is None:
+            return rule_result
+        try:
+            model_result = future.result(self.timeout)
+        except FutureTimeoutError:
+            return self._fallback(rule_result, TIER_RULES_TIMEOUT, started)
+        except Exception as e:
+            logger.error(f"Model tier failed: {e}")
+            return self._fallback(rule_result, TIER_RULES_ERROR, started)
+        return self._model_answer(model_result, started)
+
+    async def classify_async(self, user_message):
+        """classify() for asyncio callers; never blocks the event loop"""
+        rule_result, future, started = self._start(user_message)
+        if future is None:
+            return rule_result
+        try:
+            model_result = await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            return self._fallback(rule_result, TIER_RULES_TIMEOUT, started)
+        except Exception as e:
+            logger.error(f"Model tier failed: {e}")
+            return self._fallback(rule_result, TIER_RULES_ERROR, started)
+        return self._model_answer(model_result, started)
+
+    def stats(self):
+        """Per-tier counts, the share answered by rules alone and model latency"""
+        with self._lock:
+            tiers = dict(self.tiers)
+        total = sum(tiers.values())
+        return {
+            'threshold': self.threshold,
+            'timeout_ms': self.timeout * 1000,
+            'tiers': tiers,
+            'model_calls': total - tiers[TIER_RULES],
+            'model_calls_saved': tiers[TIER_RULES],
+            'rules_share': round(tiers[TIER_RULES] / total, 4) if total else None,
+            'model_ms': self.model_ms.snapshot()
+        }
+
+    def _count(self, tier):
+        with self._lock:
+            self.tiers[tier] += 1
+
+    def _start(self, user_message):
+        intent, confidence, template = intent_engine.classify(user_message)
+        if confidence >= self.threshold:
+            self._count(TIER_RULES)
+            return (intent, confidence, template, TIER_RULES), None, None
+
+        rule_result = (intent, confidence, template)
+        labels = list(intent_engine.get_matcher().responses)
+        started = time.perf_counter()
+        try:
+            future = self.submit(user_message, labels)
+        except queue.Full:
+            return self._fallback(rule_result, TIER_RULES_ERROR, None), None, None
+        return rule_result, future, started
+
+    def _fallback(self, rule_result, tier, started):
+        self._count(tier)
+        if started is not None:
+            self.model_ms.observe((time.perf_counter() - started) * 1000)
+        return rule_result + (tier,)
+
+    def _model_answer(self, model_result, started):
+        self._count(TIER_MODEL)
+        self.model_ms.observe((time.perf_counter() - started) * 1000)
+        intent = model_result['labels'][0]
+        confidence = round(model_result['scores'][0], 2)
+        matcher = intent_engine.get_matcher()
+        template = matcher.responses.get(intent, matcher.fallback['response'])
+        return intent, confidence, template, TIER_MODEL
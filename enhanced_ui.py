@@ -1,21 +1,50 @@
-from flask import Flask, request, redirect, render_template, make_response, jsonify
+from flask import Flask, Response, request, redirect, render_template, make_response, jsonify, g, has_app_context
 import sqlite3
 import uuid
 import logging
 import os
-from datetime import datetime
+import atexit
+import queue
+import threading
+import time
+import heapq
+import itertools
+import operator
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 import json
+import csv
+import io
+import zlib
+import hmac
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('chat_app.log'),
-        logging.StreamHandler()
-    ]
-)
+import click
+
+import admission
+import cascade
+import intent_engine
+import metrics
+import retention
+import shards
+from model_config import MODEL_NAME
+from log_pipeline import ChatTurnLog, setup_logging
+from message_writer import MessageWriter, utc_timestamp
+from profiler import RequestProfiler
+from session_tracker import SessionTracker
+from stats_stream import StatsBroadcaster
+
+# Configure logging: handlers run on a background listener, the log file rotates by size
+LOG_FILE = os.environ.get('LOG_FILE', 'chat_app.log')
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT', '5'))
+# Share of chat turns logged at INFO, and whether their message/reply text is included
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', '1.0'))
+LOG_MESSAGE_BODIES = os.environ.get('LOG_MESSAGE_BODIES', '0') == '1'
+
+setup_logging(LOG_FILE, LOG_LEVEL, LOG_MAX_BYTES, LOG_BACKUP_COUNT)
 logger = logging.getLogger(__name__)
+chat_turn_log = ChatTurnLog(logger, LOG_SAMPLE_RATE, LOG_MESSAGE_BODIES)
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
@@ -23,62 +52,610 @@ app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-producti
 # Database configuration
 DB_PATH = "chat.db"
 
-def get_conn():
-    """Get database connection with error handling"""
+# Session-sharded storage: each session lives in one of DB_SHARDS files
+# (1 = DB_PATH itself; split an existing database with `flask split-shards`)
+DB_SHARDS = int(os.environ.get('DB_SHARDS', '1'))
+
+# Write-behind message persistence (off by default)
+WRITE_BEHIND = os.environ.get('WRITE_BEHIND', '0') == '1'
+WRITE_BEHIND_BATCH_ROWS = int(os.environ.get('WRITE_BEHIND_BATCH_ROWS', '200'))
+WRITE_BEHIND_FLUSH_MS = int(os.environ.get('WRITE_BEHIND_FLUSH_MS', '50'))
+WRITE_BEHIND_QUEUE_SIZE = int(os.environ.get('WRITE_BEHIND_QUEUE_SIZE', '10000'))
+WRITE_BEHIND_ENQUEUE_TIMEOUT_MS = int(os.environ.get('WRITE_BEHIND_ENQUEUE_TIMEOUT_MS', '1000'))
+WRITE_BEHIND_READ_TIMEOUT_MS = int(os.environ.get('WRITE_BEHIND_READ_TIMEOUT_MS', '2000'))
+
+# Session bookkeeping is buffered and flushed in bulk; 0 writes through per request
+SESSION_ACTIVITY_FLUSH_SECONDS = float(os.environ.get('SESSION_ACTIVITY_FLUSH_SECONDS', '5'))
+SESSION_KNOWN_TTL_SECONDS = float(os.environ.get('SESSION_KNOWN_TTL_SECONDS', '300'))
+
+# Chat history pagination
+HISTORY_PAGE_SIZE = int(os.environ.get('HISTORY_PAGE_SIZE', '50'))
+HISTORY_MAX_PAGE_SIZE = int(os.environ.get('HISTORY_MAX_PAGE_SIZE', '200'))
+
+# Intent rollups for time-range stats
+ROLLUP_BUCKET_FORMATS = {'minute': '%Y-%m-%d %H:%M:00', 'hour': '%Y-%m-%d %H:00:00'}
+ROLLUP_GRANULARITIES = {'minute': timedelta(minutes=1), 'hour': timedelta(hours=1), 'day': timedelta(days=1)}
+ROLLUP_RELATIVE_UNITS = {'m': timedelta(minutes=1), 'h': timedelta(hours=1), 'd': timedelta(days=1)}
+ROLLUP_MAX_BUCKETS = int(os.environ.get('ROLLUP_MAX_BUCKETS', '10080'))
+
+# Streaming export
+EXPORT_FIELDS = ('id', 'session_id', 'role', 'content', 'timestamp', 'intent', 'confidence')
+EXPORT_FETCH_SIZE = int(os.environ.get('EXPORT_FETCH_SIZE', '1000'))
+# Export order, used to merge the rows of several shards
+EXPORT_ORDER_KEY = operator.itemgetter(EXPORT_FIELDS.index('timestamp'), EXPORT_FIELDS.index('id'))
+
+# Retention: `flask archive-sessions` archives sessions idle this long, then deletes them
+RETENTION_IDLE_DAYS = float(os.environ.get('RETENTION_IDLE_DAYS', '30'))  # the session cookie lifetime
+RETENTION_BATCH_SESSIONS = int(os.environ.get('RETENTION_BATCH_SESSIONS', '200'))
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', 'archive')
+
+# Live stats over Server-Sent Events
+SSE_POLL_SECONDS = float(os.environ.get('SSE_POLL_SECONDS', '1'))
+SSE_HEARTBEAT_SECONDS = float(os.environ.get('SSE_HEARTBEAT_SECONDS', '15'))
+SSE_MAX_CONNECTIONS = int(os.environ.get('SSE_MAX_CONNECTIONS', '100'))
+
+# Rule-first, model-fallback classification (off by default)
+CASCADE = os.environ.get('CASCADE', '0') == '1'
+CASCADE_THRESHOLD = float(os.environ.get('CASCADE_THRESHOLD', '0.7'))
+CASCADE_TIMEOUT_MS = int(os.environ.get('CASCADE_TIMEOUT_MS', '300'))
+# Use a running inference_server instead of loading the model in-process
+CASCADE_MODEL_URL = os.environ.get('CASCADE_MODEL_URL', '')
+# Or a nearest-neighbour vector index directory (see vector_index.py)
+CASCADE_KNN_INDEX = os.environ.get('CASCADE_KNN_INDEX', '')
+
+# Opt-in request profiling: on when a sample rate or a token (X-Profile header) is set
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+PROFILE_MODE = os.environ.get('PROFILE_MODE', 'cprofile')  # or 'sample'
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', '5'))
+
+# Exports of other sessions and of all sessions need X-Admin-Token: <ADMIN_TOKEN>; refused while unset
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+
+# Admission control (off by default): concurrent requests, wait queue and what to do when saturated
+ADMISSION_MAX_CONCURRENT = int(os.environ.get('ADMISSION_MAX_CONCURRENT', '0'))
+ADMISSION_MAX_QUEUE = int(os.environ.get('ADMISSION_MAX_QUEUE', '64'))
+ADMISSION_QUEUE_TIMEOUT_MS = int(os.environ.get('ADMISSION_QUEUE_TIMEOUT_MS', '1000'))
+ADMISSION_RETRY_AFTER_SECONDS = int(os.environ.get('ADMISSION_RETRY_AFTER_SECONDS', '1'))
+# Answer shed chat turns from the rules with the write queued instead of returning 503
+ADMISSION_DEGRADE = os.environ.get('ADMISSION_DEGRADE', '1') == '1'
+# Long-lived or operational endpoints never wait for a slot
+ADMISSION_EXEMPT_ENDPOINTS = {'static', 'metrics_endpoint', 'admin_profile', 'api_stats_stream'}
+ADMISSION_DEGRADABLE_ENDPOINTS = {'chat', 'api_message'}
+
+# Batch classification configuration
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', '1000'))
+
+# SQLite tuning (see https://www.sqlite.org/pragma.html)
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', '-20000'))  # negative = KiB
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+SQLITE_POOL_SIZE = int(os.environ.get('SQLITE_POOL_SIZE', '8'))
+
+# Request metrics, exposed in Prometheus format at /metrics
+METRICS_REGISTRY = metrics.Registry()
+REQUEST_SECONDS = METRICS_REGISTRY.histogram(
+    'chat_request_duration_seconds', 'Request latency by route', ('route', 'method'))
+RESPONSES = METRICS_REGISTRY.counter(
+    'chat_responses_total', 'Responses by route and status code', ('route', 'status'))
+STAGE_SECONDS = METRICS_REGISTRY.histogram(
+    'chat_stage_duration_seconds', 'Time spent in each stage of handling a chat request', ('stage',))
+CLASSIFY_SECONDS = METRICS_REGISTRY.histogram(
+    'chat_classification_duration_seconds', 'Classification latency by winning intent and tier', ('intent', 'tier'))
+DB_STATEMENTS = METRICS_REGISTRY.histogram(
+    'chat_db_statements_per_request', 'SQLite statements executed per request, including BEGIN/COMMIT, trigger steps and per-shard fan-out queries',
+    ('route',), metrics.COUNT_BUCKETS)
+ERRORS = METRICS_REGISTRY.counter(
+    'chat_errors_total', 'Errors caught and logged while handling requests', ('stage',))
+ADMISSIONS = METRICS_REGISTRY.counter(
+    'chat_admission_total', 'Admission decisions: accepted, queued, shed_queue_full, shed_timeout, degraded', ('outcome',))
+# Write-behind counters, read from the writers of each shard when scraped
+WRITE_BEHIND_ROWS = METRICS_REGISTRY.callback(
+    'counter', 'chat_write_behind_rows_total', 'Message rows committed (written) or lost (failed) by the write-behind writer',
+    ('shard', 'outcome'), lambda: {
+        (shard, outcome): stats[key]
+        for shard, stats in message_writer_stats().items()
+        for outcome, key in (('written', 'rows_written'), ('failed', 'rows_failed'))
+    })
+WRITE_BEHIND_REJECTED = METRICS_REGISTRY.callback(
+    'counter', 'chat_write_behind_rejected_total', 'Turns refused by a full write-behind queue (written synchronously or shed)', ('shard',),
+    lambda: {(shard,): stats['enqueue_rejected'] for shard, stats in message_writer_stats().items()})
+WRITE_BEHIND_QUEUED = METRICS_REGISTRY.callback(
+    'gauge', 'chat_write_behind_queued_groups', 'Turns waiting in the write-behind queue', ('shard',),
+    lambda: {(shard,): stats['queued_groups'] for shard, stats in message_writer_stats().items()})
+# Session tracker counters, read from the trackers of each shard when scraped
+SESSION_TOUCHES = METRICS_REGISTRY.callback(
+    'counter', 'chat_session_touches_total', 'Session activity updates buffered (recorded) or skipped as repeats (coalesced)',
+    ('shard', 'outcome'), lambda: {
+        (shard, outcome): value
+        for shard, stats in session_tracker_stats().items()
+        for outcome, value in (('recorded', stats['touches'] - stats['touches_coalesced']),
+                               ('coalesced', stats['touches_coalesced']))
+    })
+SESSION_ROWS_FLUSHED = METRICS_REGISTRY.callback(
+    'counter', 'chat_session_rows_flushed_total', 'Session inserts and activity updates written by the tracker', ('shard',),
+    lambda: {(shard,): stats['rows_flushed'] for shard, stats in session_tracker_stats().items()})
+SESSION_BUFFERED = METRICS_REGISTRY.callback(
+    'gauge', 'chat_session_tracker_buffered', 'Session changes waiting for the next tracker flush', ('shard',),
+    lambda: {(shard,): stats['buffered'] for shard, stats in session_tracker_stats().items()})
+_CLASSIFY_STAGE = STAGE_SECONDS.labels('classify')
+_RENDER_STAGE = STAGE_SECONDS.labels('render')
+
+class _StatementCount(threading.local):
+    value = 0
+
+_statement_count = _StatementCount()
+
+def _count_statement(sql):
+    _statement_count.value += 1
+
+def open_connection(db_path):
+    """Open a new tuned SQLite connection in WAL mode"""
+    conn = sqlite3.connect(db_path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+    conn.row_factory = sqlite3.Row  # Enable dict-like access
+    # Lets the retention job hand freed pages back. Only a new file picks it up,
+    # and only before WAL mode writes its header; existing files switch with
+    # `flask archive-sessions --full-vacuum`
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute(f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA cache_size = {SQLITE_CACHE_SIZE}")
+    conn.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+    conn.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+    # Counts statements per thread for the per-request DB metric
+    conn.set_trace_callback(_count_statement)
+    return conn
+
+class ConnectionPool:
+    """Small pool of persistent SQLite connections shared by worker threads
+    
+    A connection is only ever used by one thread at a time: it is checked out
+    for the duration of a request and returned afterwards. Up to ``size`` idle
+    connections are kept open; extra ones are closed on release.
+    """
+    
+    def __init__(self, db_path, size):
+        self.db_path = db_path
+        self.size = size
+        self._idle = queue.LifoQueue()
+    
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return open_connection(self.db_path)
+    
+    def release(self, conn):
+        # Never hand out a connection with a half-finished transaction
+        if conn.in_transaction:
+            conn.rollback()
+        if self._idle.qsize() >= self.size:
+            conn.close()
+        else:
+            self._idle.put(conn)
+    
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+_pools = {}
+_pool_lock = threading.Lock()
+_message_writers = {}
+_message_writer_lock = threading.Lock()
+_session_trackers = {}
+_session_tracker_lock = threading.Lock()
+_shard_executor = None
+_shard_executor_lock = threading.Lock()
+_stats_broadcaster = None
+_stats_broadcaster_lock = threading.Lock()
+_cascade = None
+_cascade_lock = threading.Lock()
+_thread_local = threading.local()
+
+def db_paths():
+    """Database file of every shard for the current DB_PATH and DB_SHARDS"""
+    return shards.shard_paths(DB_PATH, DB_SHARDS)
+
+def session_shard(session_id):
+    """Index of the shard that stores a session"""
+    return shards.shard_index(session_id, DB_SHARDS)
+
+def get_pool(shard=0):
+    """Get the connection pool of a shard of the current DB_PATH"""
+    db_path = db_paths()[shard]
+    pool = _pools.get(db_path)
+    if pool is None:
+        with _pool_lock:
+            pool = _pools.get(db_path)
+            if pool is None:
+                # Pools of a previous DB_PATH are not used again
+                for stale in [path for path in _pools if path not in db_paths()]:
+                    _pools.pop(stale).close_all()
+                pool = _pools[db_path] = ConnectionPool(db_path, SQLITE_POOL_SIZE)
+    return pool
+
+def get_conn(shard=0):
+    """Get database connection with error handling
+    
+    Inside a request the connection is checked out of the pool once per shard
+    and returned by ``release_conn`` at teardown; outside a request each thread
+    keeps its own persistent connection per shard. Callers must not close it.
+    """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row  # Enable dict-like access
+        db_path = db_paths()[shard]
+        if has_app_context():
+            leased = g.get('db_conns')
+            if leased is None:
+                leased = g.db_conns = {}
+            lease = leased.get(db_path)
+            if lease is None:
+                pool = get_pool(shard)
+                lease = leased[db_path] = (pool, pool.acquire())
+            return lease[1]
+        
+        conns = getattr(_thread_local, 'conns', None)
+        if conns is None:
+            conns = _thread_local.conns = {}
+        conn = conns.get(db_path)
+        if conn is None:
+            conn = conns[db_path] = open_connection(db_path)
         return conn
     except sqlite3.Error as e:
         logger.error(f"Database connection error: {e}")
         raise
 
+def get_session_conn(session_id):
+    """Connection to the shard that stores a session"""
+    return get_conn(session_shard(session_id))
+
+def get_shard_executor():
+    """Get the thread pool that runs per-shard queries concurrently"""
+    global _shard_executor
+    if _shard_executor is None:
+        with _shard_executor_lock:
+            if _shard_executor is None:
+                executor = ThreadPoolExecutor(max_workers=DB_SHARDS, thread_name_prefix='shard-query')
+                atexit.register(executor.shutdown)
+                _shard_executor = executor
+    return _shard_executor
+
+def fan_out(function):
+    """Call function(shard) for every shard, concurrently when sharded; returns the results in shard order"""
+    if DB_SHARDS == 1:
+        return [function(0)]
+    
+    def counted(shard):
+        before = _statement_count.value
+        result = function(shard)
+        return result, _statement_count.value - before
+    
+    results = list(get_shard_executor().map(counted, range(DB_SHARDS)))
+    # Statements run on the worker threads count towards the calling thread's request
+    _statement_count.value += sum(statements for _, statements in results)
+    return [result for result, _ in results]
+
+@app.teardown_appcontext
+def release_conn(error):
+    """Return the request's connections to their pools"""
+    leased = g.pop('db_conns', None)
+    if leased:
+        for pool, conn in leased.values():
+            pool.release(conn)
+
+@app.before_request
+def start_request_metrics():
+    """Note the start time and statement count of this thread"""
+    g.metrics_started = time.perf_counter()
+    g.metrics_statements = _statement_count.value
+
+@app.after_request
+def record_request_metrics(response):
+    """Record latency, status and SQLite statements per route (the rule, so ids in paths do not add series)"""
+    started = g.pop('metrics_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        REQUEST_SECONDS.labels(route, request.method).observe(time.perf_counter() - started)
+        RESPONSES.labels(route, response.status_code).inc()
+        DB_STATEMENTS.labels(route).observe(_statement_count.value - g.pop('metrics_statements'))
+    return response
+
 def init_database():
-    """Initialize database with proper schema"""
+    """Initialize every shard database with proper schema"""
     try:
-        conn = get_conn()
-        cur = conn.cursor()
+        for shard in range(DB_SHARDS):
+            init_schema(get_conn(shard), shard)
+        logger.info("Database initialized successfully" + (f" ({DB_SHARDS} shards)" if DB_SHARDS > 1 else ""))
         
-        # Create messages table with better schema
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id TEXT NOT NULL,
-                role TEXT NOT NULL CHECK(role IN ('user', 'bot')),
-                content TEXT NOT NULL,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                intent TEXT,
-                confidence REAL,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    except sqlite3.Error as e:
+        logger.error(f"Database initialization error: {e}")
+        raise
+
+def init_schema(conn, shard=0):
+    """Create the tables, indexes and counters of one database file (shard ``shard``)"""
+    cur = conn.cursor()
+    
+    # Create messages table with better schema
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            role TEXT NOT NULL CHECK(role IN ('user', 'bot')),
+            content TEXT NOT NULL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            intent TEXT,
+            confidence REAL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    # Create sessions table for better session tracking
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id TEXT PRIMARY KEY,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            last_activity DATETIME DEFAULT CURRENT_TIMESTAMP,
+            user_agent TEXT,
+            ip_address TEXT
+        )
+    """)
+    
+    # Create indexes for performance
+    # (session_id, timestamp) serves both history pages and per-session
+    # stats as range scans; it also covers plain session_id lookups
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_session_timestamp ON messages(session_id, timestamp)")
+    cur.execute("DROP INDEX IF EXISTS idx_messages_session_id")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages(timestamp)")
+    
+    conn.commit()
+    
+    # Message ids unique across shards, so merged exports can tie-break on them
+    shards.reserve_id_range(conn, shard)
+    
+    init_counters(conn)
+
+def init_counters(conn):
+    """Create the counter tables and the triggers that keep them current
+    
+    Counters are maintained by triggers, so every writer (chat turns, the
+    write-behind queue, bulk deletes) updates them in the same transaction
+    as the rows themselves. On first creation they are filled from scratch.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS stats_counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0
             )
         """)
-        
-        # Create sessions table for better session tracking
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS sessions (
-                session_id TEXT PRIMARY KEY,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                last_activity DATETIME DEFAULT CURRENT_TIMESTAMP,
-                user_agent TEXT,
-                ip_address TEXT
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS intent_counters (
+                intent TEXT PRIMARY KEY,
+                count INTEGER NOT NULL DEFAULT 0
             )
         """)
         
-        # Create indexes for performance
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_session_id ON messages(session_id)")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages(timestamp)")
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_messages_count_insert AFTER INSERT ON messages
+            BEGIN
+                UPDATE stats_counters SET value = value + 1 WHERE name = 'total_messages';
+                INSERT INTO intent_counters (intent, count)
+                SELECT NEW.intent, 1 WHERE NEW.intent IS NOT NULL
+                ON CONFLICT(intent) DO UPDATE SET count = count + 1;
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_messages_count_delete AFTER DELETE ON messages
+            BEGIN
+                UPDATE stats_counters SET value = value - 1 WHERE name = 'total_messages';
+                UPDATE intent_counters SET count = count - 1 WHERE intent = OLD.intent;
+                DELETE FROM intent_counters WHERE intent = OLD.intent AND count <= 0;
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_sessions_count_insert AFTER INSERT ON sessions
+            BEGIN
+                UPDATE stats_counters SET value = value + 1 WHERE name = 'total_sessions';
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_sessions_count_delete AFTER DELETE ON sessions
+            BEGIN
+                UPDATE stats_counters SET value = value - 1 WHERE name = 'total_sessions';
+            END
+        """)
         
-        conn.commit()
-        conn.close()
-        logger.info("Database initialized successfully")
+        # Per-minute and per-hour intent volume; insert-only, so buckets keep
+        # counting traffic even after sessions are cleared or archived
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS intent_rollups (
+                granularity TEXT NOT NULL,
+                bucket_start TEXT NOT NULL,
+                intent TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                sum_confidence REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (granularity, bucket_start, intent)
+            ) WITHOUT ROWID
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_messages_rollup_insert AFTER INSERT ON messages
+            WHEN NEW.role = 'bot' AND NEW.intent IS NOT NULL
+            BEGIN
+                INSERT INTO intent_rollups (granularity, bucket_start, intent, count, sum_confidence)
+                VALUES ('minute', strftime('%Y-%m-%d %H:%M:00', NEW.timestamp), NEW.intent, 1, COALESCE(NEW.confidence, 0)),
+                       ('hour', strftime('%Y-%m-%d %H:00:00', NEW.timestamp), NEW.intent, 1, COALESCE(NEW.confidence, 0))
+                ON CONFLICT(granularity, bucket_start, intent) DO UPDATE
+                SET count = count + 1, sum_confidence = sum_confidence + excluded.sum_confidence;
+            END
+        """)
         
-    except sqlite3.Error as e:
-        logger.error(f"Database initialization error: {e}")
+        # Per-session totals and intents for the stats panel, so a chat turn
+        # reads two short rows instead of aggregating the session's history
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS session_counters (
+                session_id TEXT PRIMARY KEY,
+                total_messages INTEGER NOT NULL DEFAULT 0,
+                user_messages INTEGER NOT NULL DEFAULT 0,
+                bot_messages INTEGER NOT NULL DEFAULT 0,
+                confidence_sum REAL NOT NULL DEFAULT 0,
+                confidence_count INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS session_intent_counters (
+                session_id TEXT NOT NULL,
+                intent TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (session_id, intent)
+            ) WITHOUT ROWID
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_messages_session_insert AFTER INSERT ON messages
+            BEGIN
+                INSERT INTO session_counters (session_id, total_messages, user_messages, bot_messages,
+                                              confidence_sum, confidence_count)
+                VALUES (NEW.session_id, 1, NEW.role = 'user', NEW.role = 'bot',
+                        COALESCE(NEW.confidence, 0), NEW.confidence IS NOT NULL)
+                ON CONFLICT(session_id) DO UPDATE
+                SET total_messages = total_messages + 1,
+                    user_messages = user_messages + excluded.user_messages,
+                    bot_messages = bot_messages + excluded.bot_messages,
+                    confidence_sum = confidence_sum + excluded.confidence_sum,
+                    confidence_count = confidence_count + excluded.confidence_count;
+                INSERT INTO session_intent_counters (session_id, intent, count)
+                SELECT NEW.session_id, NEW.intent, 1 WHERE NEW.intent IS NOT NULL
+                ON CONFLICT(session_id, intent) DO UPDATE SET count = count + 1;
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_messages_session_delete AFTER DELETE ON messages
+            BEGIN
+                UPDATE session_counters
+                SET total_messages = total_messages - 1,
+                    user_messages = user_messages - (OLD.role = 'user'),
+                    bot_messages = bot_messages - (OLD.role = 'bot'),
+                    confidence_sum = confidence_sum - COALESCE(OLD.confidence, 0),
+                    confidence_count = confidence_count - (OLD.confidence IS NOT NULL)
+                WHERE session_id = OLD.session_id;
+                DELETE FROM session_counters WHERE session_id = OLD.session_id AND total_messages <= 0;
+                UPDATE session_intent_counters SET count = count - 1
+                WHERE session_id = OLD.session_id AND intent = OLD.intent;
+                DELETE FROM session_intent_counters
+                WHERE session_id = OLD.session_id AND intent = OLD.intent AND count <= 0;
+            END
+        """)
+        # Fill from existing rows the first time
+        if not conn.execute("SELECT 1 FROM stats_counters LIMIT 1").fetchone():
+            _recompute_counters(conn)
+        elif (not conn.execute("SELECT 1 FROM session_counters LIMIT 1").fetchone()
+              and conn.execute("SELECT 1 FROM messages LIMIT 1").fetchone()):
+            # Databases from before the per-session counters existed
+            _recompute_session_counters(conn)
+        if not conn.execute("SELECT 1 FROM intent_rollups LIMIT 1").fetchone():
+            _recompute_rollups(conn)
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+
+def _recompute_counters(conn):
+    conn.execute("DELETE FROM stats_counters")
+    conn.execute("""
+        INSERT INTO stats_counters (name, value)
+        SELECT 'total_messages', COUNT(*) FROM messages
+        UNION ALL
+        SELECT 'total_sessions', COUNT(*) FROM sessions
+    """)
+    conn.execute("DELETE FROM intent_counters")
+    conn.execute("""
+        INSERT INTO intent_counters (intent, count)
+        SELECT intent, COUNT(*) FROM messages WHERE intent IS NOT NULL GROUP BY intent
+    """)
+    _recompute_session_counters(conn)
+
+def _recompute_session_counters(conn):
+    conn.execute("DELETE FROM session_counters")
+    conn.execute("""
+        INSERT INTO session_counters (session_id, total_messages, user_messages, bot_messages,
+                                      confidence_sum, confidence_count)
+        SELECT session_id, COUNT(*), SUM(role = 'user'), SUM(role = 'bot'),
+               COALESCE(SUM(confidence), 0), COUNT(confidence)
+        FROM messages GROUP BY session_id
+    """)
+    conn.execute("DELETE FROM session_intent_counters")
+    conn.execute("""
+        INSERT INTO session_intent_counters (session_id, intent, count)
+        SELECT session_id, intent, COUNT(*) FROM messages WHERE intent IS NOT NULL GROUP BY session_id, intent
+    """)
+
+def _recompute_rollups(conn):
+    conn.execute("DELETE FROM intent_rollups")
+    for granularity, bucket_format in ROLLUP_BUCKET_FORMATS.items():
+        conn.execute("""
+            INSERT INTO intent_rollups (granularity, bucket_start, intent, count, sum_confidence)
+            SELECT ?, strftime(?, timestamp), intent, COUNT(*), COALESCE(SUM(confidence), 0)
+            FROM messages
+            WHERE role = 'bot' AND intent IS NOT NULL
+            GROUP BY 2, 3
+        """, (granularity, bucket_format))
+
+def rebuild_counters(conn, rollups=False):
+    """Recompute every counter (and optionally the rollups) from the messages and sessions tables
+    
+    Rebuilding rollups only recovers buckets whose messages still exist.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        _recompute_counters(conn)
+        if rollups:
+            _recompute_rollups(conn)
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
         raise
 
 # Initialize database on module import
 init_database()
 
+def get_session_tracker(shard=0, buffer=False):
+    """Get the buffered session tracker of a shard, or None when activity is written through
+    
+    ``buffer`` returns one even then (flushing every second), for requests
+    that must not wait on SQLite.
+    """
+    if SESSION_ACTIVITY_FLUSH_SECONDS <= 0 and not buffer:
+        return None
+    tracker = _session_trackers.get(shard)
+    if tracker is None:
+        with _session_tracker_lock:
+            tracker = _session_trackers.get(shard)
+            if tracker is None:
+                db_path = db_paths()[shard]
+                tracker = SessionTracker(
+                    lambda: open_connection(db_path),
+                    flush_seconds=SESSION_ACTIVITY_FLUSH_SECONDS if SESSION_ACTIVITY_FLUSH_SECONDS > 0 else 1.0,
+                    known_ttl_seconds=SESSION_KNOWN_TTL_SECONDS
+                )
+                atexit.register(tracker.stop)
+                tracker = _session_trackers[shard] = tracker.start()
+    return tracker
+
+def session_tracker_stats():
+    """Buffer size and counters of every started session tracker, by shard"""
+    return {shard: tracker.stats() for shard, tracker in list(_session_trackers.items())}
+
+def forget_sessions(session_ids):
+    """Drop buffered activity of removed sessions so a later flush cannot write them back"""
+    for session_id in session_ids:
+        tracker = _session_trackers.get(session_shard(session_id))
+        if tracker is not None:
+            tracker.forget(session_id)
+
+@metrics.timed(STAGE_SECONDS.labels('session'))
 def get_session_id():
     """Get or create session ID with tracking"""
     session_id = request.cookies.get("session_id")
@@ -86,23 +663,41 @@ def get_session_id():
     if not session_id:
         session_id = str(uuid.uuid4())
         logger.info(f"New session created: {session_id}")
-        
-        # Track new session
+        track_session(session_id, True, request.headers.get('User-Agent', ''), request.remote_addr)
+    else:
+        track_session(session_id, False)
+    
+    return session_id
+
+def track_session(session_id, is_new, user_agent='', ip_address=None):
+    """Record a new session or bump the last activity of an existing one"""
+    shard = session_shard(session_id)
+    # Turns shed to the degraded path buffer their bookkeeping even when it is written through
+    tracker = get_session_tracker(shard, buffer=has_app_context() and bool(g.get('degraded')))
+    
+    if is_new:
+        # Track new session (buffered and flushed in bulk when enabled)
+        if tracker is not None:
+            tracker.created(session_id, user_agent, ip_address)
+            return
         try:
-            conn = get_conn()
+            conn = get_conn(shard)
             cur = conn.cursor()
             cur.execute("""
                 INSERT INTO sessions (session_id, user_agent, ip_address) 
                 VALUES (?, ?, ?)
-            """, (session_id, request.headers.get('User-Agent', ''), request.remote_addr))
+            """, (session_id, user_agent, ip_address))
             conn.commit()
-            conn.close()
         except sqlite3.Error as e:
             logger.error(f"Error tracking new session: {e}")
+            ERRORS.labels('session').inc()
     else:
         # Update last activity
+        if tracker is not None:
+            tracker.touch(session_id)
+            return
         try:
-            conn = get_conn()
+            conn = get_conn(shard)
             cur = conn.cursor()
             cur.execute("""
                 UPDATE sessions 
@@ -110,221 +705,58 @@ def get_session_id():
                 WHERE session_id = ?
             """, (session_id,))
             conn.commit()
-            conn.close()
         except sqlite3.Error as e:
             logger.error(f"Error updating session activity: {e}")
+            ERRORS.labels('session').inc()
+
+def get_cascade():
+    """Get the rule-first/model-fallback classifier, or None when CASCADE is off"""
+    global _cascade
+    if not CASCADE:
+        return None
+    if _cascade is None:
+        with _cascade_lock:
+            if _cascade is None:
+                if CASCADE_KNN_INDEX:
+                    submit = cascade.knn_model(CASCADE_KNN_INDEX)
+                elif CASCADE_MODEL_URL:
+                    submit = cascade.remote_model(CASCADE_MODEL_URL)
+                else:
+                    submit = cascade.local_model(MODEL_NAME)
+                _cascade = cascade.Cascade(submit, CASCADE_THRESHOLD, CASCADE_TIMEOUT_MS)
+                logger.info(f"Classification cascade enabled (threshold {CASCADE_THRESHOLD}, timeout {CASCADE_TIMEOUT_MS} ms)")
+    return _cascade
+
+def classify_message(user_message, session_id):
+    """Classify a message and render the reply; returns (response, intent, confidence, tier)"""
+    started = time.perf_counter()
+    classifier = get_cascade()
+    if classifier is not None:
+        intent, confidence, template, tier = classifier.classify(user_message)
+    else:
+        # Rules are compiled once in intent_engine and matched in a single pass
+        intent, confidence, template = intent_engine.classify(user_message)
+        tier = cascade.TIER_RULES
+    response = intent_engine.render_response(template, user_message, session_id)
+    record_classification(intent, tier, time.perf_counter() - started)
     
-    return session_id
+    return response, intent, confidence, tier
+
+def record_classification(intent, tier, seconds):
+    """Record one classification in the stage and per-intent latency histograms"""
+    _CLASSIFY_STAGE.observe(seconds)
+    CLASSIFY_SECONDS.labels(intent, tier).observe(seconds)
 
 def simulate_bot_response(user_message, session_id):
     """Simulate bot response with comprehensive airline/travel industry intent detection"""
-    user_message_lower = user_message.lower()
-    
-    # Comprehensive airline/travel industry intent classification with priority order
-    # More specific intents first, then broader ones
-    
-    # Cancellation (high priority - specific action)
-    if any(phrase in user_message_lower for phrase in ['cancel booking', 'cancel flight', 'cancel my', 'cancel reservation']) or \
-       (any(word in user_message_lower for word in ['cancel', 'cancellation']) and 
-        any(word in user_message_lower for word in ['booking', 'flight', 'reservation', 'ticket'])):
-        intent = 'Cancellation'
-        response = "I can assist you with canceling your booking. Please provide your booking reference number."
-        confidence = 0.9
-        
-    # Refund (high priority - specific action)
-    elif any(phrase in user_message_lower for phrase in ['money back', 'refund request', 'want refund', 'need refund']) or \
-         any(word in user_message_lower for word in ['refund', 'reimbursement', 'compensation']):
-        intent = 'Refund'
-        response = "I can help you with refund requests. Please provide your booking details and reason for the refund."
-        confidence = 0.9
-        
-    # Check-in (specific action)
-    elif any(phrase in user_message_lower for phrase in ['check in', 'check-in', 'online check', 'boarding pass']):
-        intent = 'Check-in'
-        response = "I can help with check-in procedures. You can check in online up to 24 hours before your flight."
-        confidence = 0.9
-        
-    # Upgrade (specific action)
-    elif any(phrase in user_message_lower for phrase in ['business class', 'first class', 'premium seat']) or \
-         any(word in user_message_lower for word in ['upgrade', 'premium']):
-        intent = 'Upgrade'
-        response = "I can assist with seat upgrades. Let me check available options for your flight."
-        confidence = 0.9
-        
-    # Reschedule (specific action)
-    elif any(phrase in user_message_lower for phrase in ['reschedule', 'change date', 'change time', 'different flight', 'different time']):
-        intent = 'Reschedule'
-        response = "I can help you reschedule your flight. What new date and time would you prefer?"
-        confidence = 0.85
-        
-    # Seating (specific feature)
-    elif any(phrase in user_message_lower for phrase in ['window seat', 'aisle seat', 'seat selection', 'select seat', 'choose seat']) or \
-         (any(word in user_message_lower for word in ['seat', 'seating']) and 
-          not any(word in user_message_lower for word in ['upgrade', 'premium', 'business', 'first'])):
-        intent = 'Seating'
-        response = "I can help you with seat selection. Would you like to choose your seats now?"
-        confidence = 0.9
-        
-    # Meals (specific feature)
-    elif any(phrase in user_message_lower for phrase in ['meal options', 'food options', 'dietary restrictions', 'special meal']) or \
-         any(word in user_message_lower for word in ['meals', 'food', 'dining', 'dietary']):
-        intent = 'Meals'
-        response = "I can help you with meal options and special dietary requirements for your flight."
-        confidence = 0.85
-        
-    # Boarding (specific process)
-    elif any(phrase in user_message_lower for phrase in ['boarding time', 'boarding start', 'gate number', 'what gate']) or \
-         (any(word in user_message_lower for word in ['boarding', 'board', 'gate']) and 
-          not any(word in user_message_lower for word in ['check', 'pass'])):
-        intent = 'Boarding'
-        response = "Boarding information will be displayed on airport screens and announced at the gate."
-        confidence = 0.85
-        
-    # Amenities (specific features)
-    elif any(phrase in user_message_lower for phrase in ['wi-fi', 'wifi', 'entertainment', 'amenities available']) or \
-         any(word in user_message_lower for word in ['amenities', 'facilities', 'services', 'entertainment']):
-        intent = 'Amenities'
-        response = "Our flights offer various amenities including entertainment, Wi-Fi, and comfort features."
-        confidence = 0.8
-        
-    # Loyalty Programs (specific program)
-    elif any(phrase in user_message_lower for phrase in ['frequent flyer', 'loyalty program', 'join program', 'membership benefits']) or \
-         any(word in user_message_lower for word in ['loyalty', 'membership', 'miles', 'points']) and \
-         any(word in user_message_lower for word in ['program', 'join', 'benefits']):
-        intent = 'Loyalty Programs'
-        response = "I can help you with our loyalty program. Are you interested in joining or have questions about your membership?"
-        confidence = 0.85
-        
-    # Rewards (specific to earning/redeeming)
-    elif any(phrase in user_message_lower for phrase in ['redeem miles', 'earn points', 'redeem points', 'reward redemption']) or \
-         (any(word in user_message_lower for word in ['rewards', 'redeem', 'earn']) and 
-          any(word in user_message_lower for word in ['miles', 'points', 'benefits'])):
-        intent = 'Rewards'
-        response = "Let me help you with reward redemption and earning opportunities."
-        confidence = 0.8
-        
-    # Security (specific procedures)
-    elif any(phrase in user_message_lower for phrase in ['prohibited items', 'carry-on restrictions', 'security procedures', 'tsa', 'screening']):
-        intent = 'Security'
-        response = "I can help you understand security procedures and what items are allowed in carry-on and checked baggage."
-        confidence = 0.85
-        
-    # Safety (specific measures)
-    elif any(phrase in user_message_lower for phrase in ['safety measures', 'safe to fly', 'safety procedures']) or \
-         any(word in user_message_lower for word in ['safety', 'safe', 'emergency', 'health']):
-        intent = 'Safety'
-        response = "Safety is our top priority. I can provide information about our safety measures and procedures."
-        confidence = 0.85
-        
-    # Promotions and Offers (marketing)
-    elif any(phrase in user_message_lower for phrase in ['special deals', 'current promotions', 'special offers']) or \
-         any(word in user_message_lower for word in ['promotion', 'promo', 'deal']):
-        intent = 'Promotions'
-        response = "Check out our current promotions and special offers for great deals on flights."
-        confidence = 0.85
-    elif any(word in user_message_lower for word in ['offers', 'deals', 'bargains', 'sales']):
-        intent = 'Offers'
-        response = "I can show you our latest offers and deals. What type of travel are you planning?"
-        confidence = 0.8
-        
-    # Discounts (price-related)
-    elif any(phrase in user_message_lower for phrase in ['student discount', 'get discount', 'lower price', 'save money']) or \
-         any(word in user_message_lower for word in ['discount', 'cheaper']):
-        intent = 'Discounts'
-        response = "I can help you find discounted fares and ways to save on your booking."
-        confidence = 0.85
-        
-    # Policies (rules and terms)
-    elif any(phrase in user_message_lower for phrase in ['cancellation policy', 'refund policy', 'baggage policy']) or \
-         (any(word in user_message_lower for word in ['policy', 'policies', 'rules', 'terms']) and 
-          not any(word in user_message_lower for word in ['how', 'process', 'procedure'])):
-        intent = 'Policies'
-        response = "I can explain our policies regarding booking, cancellation, and travel requirements."
-        confidence = 0.8
-        
-    # Procedures (how-to processes)
-    elif any(phrase in user_message_lower for phrase in ['how do i', 'what is the process', 'how to']) or \
-         any(word in user_message_lower for word in ['procedure', 'procedures', 'process']):
-        intent = 'Procedures'
-        response = "I can guide you through our procedures step by step. What process do you need help with?"
-        confidence = 0.8
-        
-    # Regulations (travel requirements)
-    elif any(phrase in user_message_lower for phrase in ['travel requirements', 'visa requirements', 'need visa']) or \
-         any(word in user_message_lower for word in ['regulation', 'regulations', 'requirements', 'compliance']):
-        intent = 'Regulations'
-        response = "I can provide information about travel regulations and requirements for your destination."
-        confidence = 0.8
-        
-    # Complaint (negative sentiment)
-    elif any(phrase in user_message_lower for phrase in ['very unhappy', 'not satisfied', 'poor service']) or \
-         any(word in user_message_lower for word in ['complaint', 'complain', 'dissatisfied', 'unhappy', 'problem', 'issue']):
-        intent = 'Complaint'
-        response = "I apologize for any inconvenience. Please describe the issue you're experiencing so I can help resolve it."
-        confidence = 0.85
-        
-    # Feedback (reviews and suggestions)
-    elif any(phrase in user_message_lower for phrase in ['leave feedback', 'share feedback', 'my review']) or \
-         any(word in user_message_lower for word in ['feedback', 'review', 'comment', 'suggestion', 'opinion']):
-        intent = 'Feedback'
-        response = "Thank you for wanting to share your feedback. Your input helps us improve our services."
-        confidence = 0.8
-        
-    # Change (modifications)
-    elif any(phrase in user_message_lower for phrase in ['change booking', 'modify booking', 'update booking']) or \
-         (any(word in user_message_lower for word in ['change', 'modify', 'update', 'alter']) and 
-          any(word in user_message_lower for word in ['booking', 'flight', 'reservation'])):
-        intent = 'Change'
-        response = "I can help you change your booking. What modifications would you like to make?"
-        confidence = 0.85
-        
-    # Booking (reservations and scheduling)
-    elif any(phrase in user_message_lower for phrase in ['book flight', 'book a flight', 'make reservation', 'reserve seat']) or \
-         any(word in user_message_lower for word in ['book', 'booking', 'reserve', 'reservation', 'schedule']) or \
-         'flight' in user_message_lower:
-        intent = 'Booking'
-        response = f"I can help you with booking flights. What destination are you looking for? (Session: {session_id[:8]}...)"
-        confidence = 0.85
-        
-    # Information (general info requests)
-    elif any(phrase in user_message_lower for phrase in ['tell me about', 'information about', 'need information']) or \
-         any(word in user_message_lower for word in ['information', 'info', 'details']):
-        intent = 'Information'
-        response = "I'm happy to provide information. What specific details would you like to know?"
-        confidence = 0.75
-        
-    # Inquiry (questions)
-    elif any(phrase in user_message_lower for phrase in ['i have a question', 'what time', 'how much', 'when does']) or \
-         any(word in user_message_lower for word in ['inquiry', 'inquire', 'question', 'ask']):
-        intent = 'Inquiry'
-        response = "I'm here to answer your questions. What would you like to know?"
-        confidence = 0.8
-        
-    # Support (general help)
-    elif any(word in user_message_lower for word in ['support', 'help', 'assist', 'assistance']):
-        intent = 'Support'
-        response = "I'm here to provide support. How can I assist you today?"
-        confidence = 0.85
-        
-    # Greeting and farewell intents
-    elif any(word in user_message_lower for word in ['hello', 'hi', 'hey', 'good morning', 'good afternoon']):
-        intent = 'Support'
-        response = f"Hello! Welcome to our airline customer service. How can I help you today? (Session: {session_id[:8]}...)"
-        confidence = 0.9
-    elif any(word in user_message_lower for word in ['bye', 'goodbye', 'thank you', 'thanks', 'exit']):
-        intent = 'Support'
-        response = "Thank you for choosing our airline. Have a great day and safe travels!"
-        confidence = 0.85
-    else:
-        intent = 'Inquiry'
-        response = f"I understand you said: '{user_message}'. Could you please provide more details so I can assist you better?"
-        confidence = 0.6
-    
+    response, intent, confidence, _ = classify_message(user_message, session_id)
     return response, intent, confidence
 
+@metrics.timed(STAGE_SECONDS.labels('stats'))
 def get_session_stats(session_id):
     """Get comprehensive session statistics for the management panel"""
-    conn = sqlite3.connect(DB_PATH)
+    shard = session_shard(session_id)
+    conn = get_conn(shard)
     cur = conn.cursor()
     
     # Get session info
@@ -335,37 +767,41 @@ def get_session_stats(session_id):
     """, (session_id,))
     session_info = cur.fetchone()
     
-    # Get message counts
+    # Overlay activity that is still buffered in memory
+    tracker = _session_trackers.get(shard)
+    pending = tracker.pending(session_id) if tracker is not None else None
+    if pending is not None:
+        created_at, last_activity = pending
+        if session_info:
+            created_at = session_info[0]
+        session_info = (created_at, last_activity)
+    
+    # Get message counts (trigger-maintained; no row until the first message)
     cur.execute("""
-        SELECT COUNT(*) as total_messages,
-               SUM(CASE WHEN role = 'user' THEN 1 ELSE 0 END) as user_messages,
-               SUM(CASE WHEN role = 'bot' THEN 1 ELSE 0 END) as bot_messages,
-               AVG(CASE WHEN confidence IS NOT NULL THEN confidence * 100 ELSE NULL END) as avg_confidence
-        FROM messages 
+        SELECT total_messages, user_messages, bot_messages,
+               CASE WHEN confidence_count > 0 THEN confidence_sum * 100 / confidence_count END as avg_confidence
+        FROM session_counters 
         WHERE session_id = ?
     """, (session_id,))
     message_stats = cur.fetchone()
     
     # Get intent distribution for this session
     cur.execute("""
-        SELECT intent, COUNT(*) as count 
-        FROM messages 
-        WHERE session_id = ? AND intent IS NOT NULL 
-        GROUP BY intent 
+        SELECT intent, count 
+        FROM session_intent_counters 
+        WHERE session_id = ? 
         ORDER BY count DESC
     """, (session_id,))
     intent_distribution = cur.fetchall()
     
-    conn.close()
-    
     # Format the data
     stats = {
         'session_id': session_id,
         'created_at': session_info[0] if session_info else 'Unknown',
         'last_activity': session_info[1] if session_info else 'Unknown',
         'message_count': message_stats[0] if message_stats else 0,
-        'user_messages': message_stats[1] if message_stats else 0,
-        'bot_messages': message_stats[2] if message_stats else 0,
+        'user_messages': (message_stats[1] or 0) if message_stats else 0,
+        'bot_messages': (message_stats[2] or 0) if message_stats else 0,
         'avg_confidence': message_stats[3] if message_stats else None,
         'intent_distribution': [
             {'intent': intent, 'count': count} 
@@ -375,6 +811,210 @@ def get_session_stats(session_id):
     
     return stats
 
+def get_session_markers(session_ids):
+    """Cheap per-session change markers for the stats broadcaster
+    
+    A session's marker changes whenever anything get_session_stats reports
+    for it does: its counters row, its sessions row or its buffered activity.
+    """
+    by_shard = {}
+    for session_id in session_ids:
+        by_shard.setdefault(session_shard(session_id), []).append(session_id)
+    
+    markers = {}
+    for shard, ids in by_shard.items():
+        conn = get_conn(shard)
+        placeholders = ', '.join('?' * len(ids))
+        counters = {row[0]: tuple(row[1:]) for row in conn.execute(f"""
+            SELECT session_id, total_messages, confidence_count FROM session_counters
+            WHERE session_id IN ({placeholders})
+        """, ids)}
+        sessions = {row[0]: tuple(row[1:]) for row in conn.execute(f"""
+            SELECT session_id, created_at, last_activity FROM sessions
+            WHERE session_id IN ({placeholders})
+        """, ids)}
+        tracker = _session_trackers.get(shard)
+        for session_id in ids:
+            pending = tracker.pending(session_id) if tracker is not None else None
+            markers[session_id] = (counters.get(session_id), sessions.get(session_id), pending)
+    return markers
+
+def get_message_writer(shard=0):
+    """Get the background message writer of a shard, starting it on first use"""
+    writer = _message_writers.get(shard)
+    if writer is None:
+        with _message_writer_lock:
+            writer = _message_writers.get(shard)
+            if writer is None:
+                db_path = db_paths()[shard]
+                writer = MessageWriter(
+                    lambda: open_connection(db_path),
+                    batch_rows=WRITE_BEHIND_BATCH_ROWS,
+                    flush_ms=WRITE_BEHIND_FLUSH_MS,
+                    queue_size=WRITE_BEHIND_QUEUE_SIZE,
+                    enqueue_timeout_ms=WRITE_BEHIND_ENQUEUE_TIMEOUT_MS
+                )
+                atexit.register(writer.stop)
+                writer = _message_writers[shard] = writer.start()
+                logger.info(f"Write-behind message writer started for {db_path}")
+    return writer
+
+def message_writer_stats():
+    """Queue depth and write counters of every started writer, by shard"""
+    return {shard: writer.stats() for shard, writer in list(_message_writers.items())}
+
+def wait_for_session_writes(session_id):
+    """Read-your-writes: wait until queued messages of this session are committed"""
+    writer = _message_writers.get(session_shard(session_id))
+    if writer is not None:
+        if not writer.wait_for_session(session_id, WRITE_BEHIND_READ_TIMEOUT_MS / 1000):
+            logger.warning(f"Queued messages of session {session_id} timed out or were lost")
+
+@metrics.timed(STAGE_SECONDS.labels('insert'))
+def save_chat_turn(session_id, user_message, bot_reply, intent, confidence):
+    """Persist a user message and the bot reply"""
+    shard = session_shard(session_id)
+    if WRITE_BEHIND:
+        timestamp = utc_timestamp()
+        rows = [
+            (session_id, 'user', user_message, None, None, timestamp),
+            (session_id, 'bot', bot_reply, intent, confidence, timestamp)
+        ]
+        if get_message_writer(shard).enqueue(rows):
+            return
+        logger.warning(f"Write-behind queue unavailable, writing synchronously for {session_id}")
+    
+    conn = get_conn(shard)
+    cur = conn.cursor()
+    
+    # Insert user message
+    cur.execute("""
+        INSERT INTO messages (session_id, role, content) 
+        VALUES (?, 'user', ?)
+    """, (session_id, user_message))
+    
+    # Insert bot response with intent data
+    cur.execute("""
+        INSERT INTO messages (session_id, role, content, intent, confidence) 
+        VALUES (?, 'bot', ?, ?, ?)
+    """, (session_id, bot_reply, intent, confidence))
+    
+    conn.commit()
+
+def encode_cursor(row):
+    """Keyset cursor pointing just before the given message row"""
+    return f"{row['timestamp']}|{row['id']}"
+
+def decode_cursor(cursor):
+    """Parse a cursor from encode_cursor; raises ValueError if malformed"""
+    timestamp, _, message_id = cursor.rpartition('|')
+    if not timestamp:
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    return timestamp, int(message_id)
+
+@metrics.timed(STAGE_SECONDS.labels('history'))
+def fetch_history(conn, session_id, limit, before=None):
+    """Fetch up to ``limit`` messages older than ``before`` (newest page when None)
+    
+    Returns the messages oldest-first and a cursor for the next older page, or
+    None when there is nothing older. Walks idx_messages_session_timestamp
+    backwards, so the cost depends on the page size rather than the history.
+    """
+    if before is None:
+        rows = conn.execute("""
+            SELECT id, role, content, timestamp, intent, confidence 
+            FROM messages 
+            WHERE session_id = ? 
+            ORDER BY timestamp DESC, id DESC 
+            LIMIT ?
+        """, (session_id, limit + 1)).fetchall()
+    else:
+        timestamp, message_id = decode_cursor(before)
+        rows = conn.execute("""
+            SELECT id, role, content, timestamp, intent, confidence 
+            FROM messages 
+            WHERE session_id = ? AND (timestamp, id) < (?, ?) 
+            ORDER BY timestamp DESC, id DESC 
+            LIMIT ?
+        """, (session_id, timestamp, message_id, limit + 1)).fetchall()
+    
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1]) if has_more else None
+    
+    messages = [
+        {
+            'id': row['id'],
+            'role': row['role'],
+            'content': row['content'],
+            'timestamp': row['timestamp'],
+            'intent': row['intent'],
+            'confidence': row['confidence']
+        }
+        for row in reversed(rows)
+    ]
+    return messages, next_cursor
+
+def handle_chat_turn(session_id, user_message):
+    """Classify a user message, store the turn and return (bot_reply, intent, confidence, tier)"""
+    started = time.perf_counter()
+    
+    # Generate bot response
+    bot_reply, intent, confidence, tier = classify_message(user_message, session_id)
+    
+    # Store both messages (queued when write-behind is enabled)
+    save_chat_turn(session_id, user_message, bot_reply, intent, confidence)
+    
+    chat_turn_log.log(session_id, user_message, bot_reply, intent, confidence, tier,
+                      (time.perf_counter() - started) * 1000)
+    
+    return bot_reply, intent, confidence, tier
+
+def handle_degraded_turn(session_id, user_message):
+    """Rules-only reply with the write queued, for chat turns shed by admission control
+    
+    Nothing here waits on SQLite or the model tier; raises admission.Overloaded
+    when the write queue is full too.
+    """
+    started = time.perf_counter()
+    intent, confidence, template = intent_engine.classify(user_message)
+    bot_reply = intent_engine.render_response(template, user_message, session_id)
+    record_classification(intent, cascade.TIER_RULES, time.perf_counter() - started)
+    timestamp = utc_timestamp()
+    rows = [
+        (session_id, 'user', user_message, None, None, timestamp),
+        (session_id, 'bot', bot_reply, intent, confidence, timestamp)
+    ]
+    if not get_message_writer(session_shard(session_id)).enqueue(rows, timeout=0):
+        raise admission.Overloaded("Message write queue is full")
+    
+    admission_controller.record_degraded()
+    ADMISSIONS.labels(admission.DEGRADED).inc()
+    chat_turn_log.log(session_id, user_message, bot_reply, intent, confidence, cascade.TIER_RULES,
+                      (time.perf_counter() - started) * 1000)
+    return bot_reply, intent, confidence, cascade.TIER_RULES
+
+def load_chat_page(session_id):
+    """Fetch the latest page of messages and the panel stats for the chat page"""
+    try:
+        wait_for_session_writes(session_id)
+        conn = get_session_conn(session_id)
+        
+        # Only the most recent page; older pages are loaded via /api/history
+        message_list, next_cursor = fetch_history(conn, session_id, HISTORY_PAGE_SIZE)
+        
+        # Session stats for the management panel
+        session_stats = get_session_stats(session_id)
+        session_stats['next_cursor'] = next_cursor
+        
+    except Exception as e:
+        logger.error(f"Error retrieving messages: {e}")
+        ERRORS.labels('history').inc()
+        message_list = []
+        session_stats = {'session_id': session_id, 'message_count': 0, 'next_cursor': None}
+    
+    return message_list, session_stats
+
 @app.route("/", methods=["GET", "POST"])
 def chat():
     """Main chat interface"""
@@ -388,151 +1028,698 @@ def chat():
                 logger.warning(f"Empty message received from session {session_id}")
                 return redirect("/")
             
-            logger.info(f"Message received from {session_id}: {user_message}")
-            
-            conn = get_conn()
-            cur = conn.cursor()
-            
-            # Insert user message
-            cur.execute("""
-                INSERT INTO messages (session_id, role, content) 
-                VALUES (?, 'user', ?)
-            """, (session_id, user_message))
-            
-            # Generate bot response
-            bot_reply, intent, confidence = simulate_bot_response(user_message, session_id)
-            
-            # Insert bot response with intent data
-            cur.execute("""
-                INSERT INTO messages (session_id, role, content, intent, confidence) 
-                VALUES (?, 'bot', ?, ?, ?)
-            """, (session_id, bot_reply, intent, confidence))
-            
-            conn.commit()
-            conn.close()
-            
-            logger.info(f"Bot response sent to {session_id}: {bot_reply} (Intent: {intent}, Confidence: {confidence})")
+            if g.get('degraded'):
+                handle_degraded_turn(session_id, user_message)
+            else:
+                handle_chat_turn(session_id, user_message)
             
+        except admission.Overloaded:
+            return busy_response()
         except Exception as e:
             logger.error(f"Error processing message: {e}")
+            ERRORS.labels('chat_turn').inc()
         
         return redirect("/")
     
     # GET request - display chat history
+    message_list, session_stats = load_chat_page(session_id)
+    
+    started = time.perf_counter()
+    page = render_template("enhanced_chat.html", messages=message_list, stats=session_stats)
+    _RENDER_STAGE.observe(time.perf_counter() - started)
+    
+    resp = make_response(page)
+    resp.set_cookie("session_id", session_id, max_age=30*24*60*60)  # 30 days
+    return resp
+
+@app.route("/api/message", methods=["POST"])
+def api_message():
+    """Send one chat message and get the reply and updated session stats in one round-trip"""
+    session_id = get_session_id()
+    payload = request.get_json(silent=True)
+    user_message = payload.get('message', '') if isinstance(payload, dict) else None
+    
+    if not isinstance(user_message, str):
+        return jsonify({'error': "Body must be a JSON object with a string 'message'"}), 400
+    user_message = user_message.strip()
+    if not user_message:
+        logger.warning(f"Empty message received from session {session_id}")
+        return jsonify({'error': 'Message is empty'}), 400
+    
+    degraded = bool(g.get('degraded'))
     try:
-        conn = get_conn()
-        cur = conn.cursor()
+        if degraded:
+            # Shed by admission control: no DB reads, the stats panel keeps its last values
+            bot_reply, intent, confidence, tier = handle_degraded_turn(session_id, user_message)
+            stats = None
+        else:
+            bot_reply, intent, confidence, tier = handle_chat_turn(session_id, user_message)
+            
+            # Read-your-writes so the counters include this turn
+            wait_for_session_writes(session_id)
+            stats = get_session_stats(session_id)
+        timestamp = utc_timestamp()
         
-        # Get messages with intent data
-        cur.execute("""
-            SELECT role, content, timestamp, intent, confidence 
-            FROM messages 
-            WHERE session_id = ? 
-            ORDER BY timestamp ASC
-        """, (session_id,))
+    except admission.Overloaded:
+        return busy_response()
+    except Exception as e:
+        logger.error(f"Error processing message: {e}")
+        ERRORS.labels('chat_turn').inc()
+        return jsonify({'error': 'Failed to process message'}), 500
+    
+    resp = jsonify({
+        'response': bot_reply,
+        'intent': intent,
+        'confidence': confidence,
+        'tier': tier,
+        'degraded': degraded,
+        'messages': [
+            {'role': 'user', 'content': user_message, 'timestamp': timestamp, 'intent': None, 'confidence': None},
+            {'role': 'bot', 'content': bot_reply, 'timestamp': timestamp, 'intent': intent, 'confidence': confidence}
+        ],
+        'stats': stats
+    })
+    resp.set_cookie("session_id", session_id, max_age=30*24*60*60)  # 30 days
+    return resp
+
+@app.route("/api/history")
+def api_history():
+    """API endpoint for older pages of the current session's messages"""
+    session_id = get_session_id()
+    
+    try:
+        limit = min(int(request.args.get('limit', HISTORY_PAGE_SIZE)), HISTORY_MAX_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError("limit must be positive")
+        before = request.args.get('before') or None
+        if before is not None:
+            decode_cursor(before)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        wait_for_session_writes(session_id)
+        messages, next_cursor = fetch_history(get_session_conn(session_id), session_id, limit, before)
+        return jsonify({'messages': messages, 'next_cursor': next_cursor})
         
-        messages = cur.fetchall()
+    except Exception as e:
+        logger.error(f"Error getting history: {e}")
+        ERRORS.labels('history').inc()
+        return jsonify({'error': 'Failed to retrieve history'}), 500
+
+def parse_time_arg(value, now):
+    """Parse an absolute UTC time or a relative duration like '90m', '24h', '7d'"""
+    value = value.strip()
+    unit = ROLLUP_RELATIVE_UNITS.get(value[-1:])
+    if unit is not None and value[:-1].isdigit():
+        try:
+            return now - int(value[:-1]) * unit
+        except OverflowError:
+            raise ValueError(f"Invalid time: {value!r} reaches before year 1") from None
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"Invalid time: {value!r} (use 'YYYY-MM-DD HH:MM:SS' or a duration like '24h')")
+
+def query_rollups(since, until, granularity):
+    """Intent counts and average confidence per bucket in [since, until), summed over the shards"""
+    if granularity not in ROLLUP_GRANULARITIES:
+        raise ValueError(f"Invalid granularity: {granularity!r} (use one of {', '.join(ROLLUP_GRANULARITIES)})")
+    
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    start = parse_time_arg(since, now)
+    end = parse_time_arg(until, now) if until else now
+    if end <= start:
+        raise ValueError("'until' must be after 'since'")
+    
+    bucket_count = (end - start) / ROLLUP_GRANULARITIES[granularity]
+    if bucket_count > ROLLUP_MAX_BUCKETS:
+        raise ValueError(f"Range spans {int(bucket_count)} {granularity} buckets (max {ROLLUP_MAX_BUCKETS})")
+    
+    # Days are summed from hour buckets
+    source = 'hour' if granularity == 'day' else granularity
+    bucket = "substr(bucket_start, 1, 10) || ' 00:00:00'" if granularity == 'day' else 'bucket_start'
+    floor_format = '%Y-%m-%d 00:00:00' if granularity == 'day' else ROLLUP_BUCKET_FORMATS[granularity]
+    start_key = start.strftime(floor_format)
+    
+    def shard_rows(shard):
+        return get_conn(shard).execute(f"""
+            SELECT {bucket} as bucket_start, intent, SUM(count) as count, SUM(sum_confidence) as sum_confidence
+            FROM intent_rollups
+            WHERE granularity = ? AND bucket_start >= ? AND bucket_start < ?
+            GROUP BY 1, 2
+        """, (source, start_key, end.strftime('%Y-%m-%d %H:%M:%S'))).fetchall()
+    
+    merged = {}
+    for rows in fan_out(shard_rows):
+        for row in rows:
+            key = (row['bucket_start'], row['intent'])
+            count, sum_confidence = merged.get(key, (0, 0.0))
+            merged[key] = (count + row['count'], sum_confidence + row['sum_confidence'])
+    # Buckets in time order, the busiest intent first within each
+    ordered = sorted(merged.items(), key=lambda item: (item[0][0], -item[1][0]))
+    
+    return {
+        'since': start.strftime('%Y-%m-%d %H:%M:%S'),
+        'until': end.strftime('%Y-%m-%d %H:%M:%S'),
+        'granularity': granularity,
+        'buckets': [
+            {
+                'bucket_start': bucket_start,
+                'intent': intent,
+                'count': count,
+                'avg_confidence': round(sum_confidence / count, 4) if count else None
+            }
+            for (bucket_start, intent), (count, sum_confidence) in ordered
+        ]
+    }
+
+def iter_message_batches(query, params, shard_ids=None):
+    """Yield batches of rows from server-side cursors on pooled connections
+    
+    Reads every shard unless ``shard_ids`` narrows it down. Rows of several
+    shards are merged on (timestamp, id), the order the export queries use.
+    """
+    leased = []
+    try:
+        cursors = []
+        for shard in range(DB_SHARDS) if shard_ids is None else shard_ids:
+            pool = get_pool(shard)
+            conn = pool.acquire()
+            leased.append((pool, conn))
+            cursors.append(conn.execute(query, params))
         
-        # Get session stats
-        cur.execute("""
-            SELECT COUNT(*) as message_count,
-                   MIN(timestamp) as first_message,
-                   MAX(timestamp) as last_message
+        if len(cursors) == 1:
+            cur = cursors[0]
+            while True:
+                rows = cur.fetchmany(EXPORT_FETCH_SIZE)
+                if not rows:
+                    break
+                yield rows
+        else:
+            merged = heapq.merge(*cursors, key=EXPORT_ORDER_KEY)
+            while True:
+                rows = list(itertools.islice(merged, EXPORT_FETCH_SIZE))
+                if not rows:
+                    break
+                yield rows
+        for cur in cursors:
+            cur.close()
+    finally:
+        for pool, conn in leased:
+            pool.release(conn)
+
+def encode_ndjson(batches):
+    """One JSON object per message, one line each"""
+    for rows in batches:
+        yield ''.join(json.dumps(dict(zip(EXPORT_FIELDS, row))) + '\n' for row in rows)
+
+def encode_csv(batches):
+    """CSV with a header row"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for rows in batches:
+        writer.writerows(tuple(row) for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def gzip_stream(chunks):
+    """Compress a stream of text chunks into a single gzip member"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+@app.route("/api/export")
+def api_export():
+    """Stream one session, or all sessions in a time range, as NDJSON or CSV"""
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({'error': "format must be 'ndjson' or 'csv'"}), 400
+    compress = request.args.get('gzip', '0') == '1'
+    columns = ', '.join(EXPORT_FIELDS)
+    
+    if request.args.get('scope') == 'all':
+        if not admin_access_allowed():
+            return jsonify({'error': 'Forbidden'}), 403
+        try:
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            start = parse_time_arg(request.args.get('since', '24h'), now)
+            # Without 'until' the export runs up to the newest message
+            until = request.args.get('until')
+            end = parse_time_arg(until, now) if until else datetime.max
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        query = f"""
+            SELECT {columns} 
             FROM messages 
-            WHERE session_id = ?
-        """, (session_id,))
-        
-        stats = cur.fetchone()
-        conn.close()
-        
-        # Prepare data for template
-        message_list = []
-        for msg in messages:
-            message_list.append({
-                'role': msg['role'],
-                'content': msg['content'],
-                'timestamp': msg['timestamp'],
-                'intent': msg['intent'],
-                'confidence': msg['confidence']
-            })
-        
-        session_stats = {
-            'session_id': session_id,
-            'message_count': stats['message_count'] if stats else 0,
-            'first_message': stats['first_message'] if stats else None,
-            'last_message': stats['last_message'] if stats else None
-        }
-        
-    except Exception as e:
-        logger.error(f"Error retrieving messages: {e}")
-        message_list = []
-        session_stats = {'session_id': session_id, 'message_count': 0}
+            WHERE timestamp >= ? AND timestamp < ? 
+            ORDER BY timestamp ASC, id ASC
+        """
+        params = (start.strftime('%Y-%m-%d %H:%M:%S'), end.strftime('%Y-%m-%d %H:%M:%S'))
+        shard_ids = None
+        filename = f"messages_{start:%Y%m%d%H%M}_{(end if until else now):%Y%m%d%H%M}"
+    else:
+        # Callers get their own cookie session; any other one is admin-only
+        requested = request.args.get('session_id')
+        if requested and requested != request.cookies.get('session_id'):
+            if not admin_access_allowed():
+                return jsonify({'error': 'Forbidden'}), 403
+            session_id = requested
+        else:
+            session_id = get_session_id()
+        wait_for_session_writes(session_id)
+        query = f"""
+            SELECT {columns} 
+            FROM messages 
+            WHERE session_id = ? 
+            ORDER BY timestamp ASC, id ASC
+        """
+        params = (session_id,)
+        shard_ids = [session_shard(session_id)]
+        filename = f"session_{session_id[:8]}"
     
-    resp = make_response(render_template("enhanced_chat.html", 
-                                       messages=message_list, 
-                                       stats=session_stats))
-    resp.set_cookie("session_id", session_id, max_age=30*24*60*60)  # 30 days
+    encode = encode_ndjson if export_format == 'ndjson' else encode_csv
+    body = encode(iter_message_batches(query, params, shard_ids))
+    filename += '.ndjson' if export_format == 'ndjson' else '.csv'
+    mimetype = 'application/x-ndjson' if export_format == 'ndjson' else 'text/csv'
+    if compress:
+        body = gzip_stream(body)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    
+    logger.info(f"Streaming export {filename}")
+    return Response(body, mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+def get_global_stats():
+    """Overall totals, read from the trigger-maintained counters of every shard"""
+    def shard_counters(shard):
+        conn = get_conn(shard)
+        return (
+            conn.execute("SELECT name, value FROM stats_counters").fetchall(),
+            conn.execute("SELECT intent, count FROM intent_counters").fetchall()
+        )
+    
+    counters = {}
+    intent_counts = {}
+    for counter_rows, intent_rows in fan_out(shard_counters):
+        for row in counter_rows:
+            counters[row['name']] = counters.get(row['name'], 0) + row['value']
+        for row in intent_rows:
+            intent_counts[row['intent']] = intent_counts.get(row['intent'], 0) + row['count']
+    
+    return {
+        'total_sessions': counters.get('total_sessions', 0),
+        'total_messages': counters.get('total_messages', 0),
+        'intent_distribution': [
+            {'intent': intent, 'count': count}
+            for intent, count in sorted(intent_counts.items(), key=lambda item: item[1], reverse=True)
+        ]
+    }
+
+def get_stats_broadcaster():
+    """Get the shared live-stats producer, starting it on first use"""
+    global _stats_broadcaster
+    if _stats_broadcaster is None:
+        with _stats_broadcaster_lock:
+            if _stats_broadcaster is None:
+                paths = db_paths()
+                broadcaster = StatsBroadcaster(
+                    lambda: [open_connection(path) for path in paths],
+                    get_global_stats,
+                    get_session_stats,
+                    session_markers=get_session_markers,
+                    interval=SSE_POLL_SECONDS,
+                    heartbeat=SSE_HEARTBEAT_SECONDS,
+                    max_subscribers=SSE_MAX_CONNECTIONS
+                )
+                atexit.register(broadcaster.stop)
+                _stats_broadcaster = broadcaster.start()
+    return _stats_broadcaster
+
+@app.route("/api/stats/stream")
+def api_stats_stream():
+    """Server-Sent Events stream of session and global stats as they change"""
+    session_id = get_session_id()
+    broadcaster = get_stats_broadcaster()
+    
+    subscription = broadcaster.subscribe(session_id)
+    if subscription is None:
+        logger.warning(f"Stats stream refused for {session_id}: {SSE_MAX_CONNECTIONS} connections open")
+        resp = jsonify({'error': 'Too many live stats connections'})
+        resp.status_code = 503
+        resp.headers['Retry-After'] = str(int(SSE_HEARTBEAT_SECONDS))
+        return resp
+    
+    resp = Response(broadcaster.stream(*subscription), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'  # Let nginx pass events through immediately
     return resp
 
+def collect_stats(args):
+    """Build the /api/stats payload; raises ValueError for bad time range arguments"""
+    result = get_global_stats()
+    result['classifier_cache'] = intent_engine.cache_info()
+    if get_cascade() is not None:
+        result['cascade'] = get_cascade().stats()
+    if admission_controller is not None:
+        result['admission'] = admission_controller.stats()
+    if _session_trackers:
+        result['session_tracker'] = {str(shard): stats for shard, stats in session_tracker_stats().items()}
+    if _message_writers:
+        # rows_failed are chat rows lost; rejected turns were written synchronously or shed
+        result['write_behind'] = {str(shard): stats for shard, stats in message_writer_stats().items()}
+    
+    # Intent volume over time, read from the rollup buckets
+    if any(arg in args for arg in ('since', 'until', 'granularity')):
+        result['timeseries'] = query_rollups(
+            args.get('since', '24h'),
+            args.get('until'),
+            args.get('granularity', 'hour')
+        )
+    
+    return result
+
 @app.route("/api/stats")
 def api_stats():
     """API endpoint for chat statistics"""
     try:
-        conn = get_conn()
-        cur = conn.cursor()
-        
-        # Overall stats
-        cur.execute("SELECT COUNT(DISTINCT session_id) as total_sessions FROM sessions")
-        total_sessions = cur.fetchone()['total_sessions']
+        return jsonify(collect_stats(request.args))
         
-        cur.execute("SELECT COUNT(*) as total_messages FROM messages")
-        total_messages = cur.fetchone()['total_messages']
-        
-        cur.execute("""
-            SELECT intent, COUNT(*) as count 
-            FROM messages 
-            WHERE intent IS NOT NULL 
-            GROUP BY intent 
-            ORDER BY count DESC
-        """)
-        intent_distribution = cur.fetchall()
-        
-        conn.close()
-        
-        return jsonify({
-            'total_sessions': total_sessions,
-            'total_messages': total_messages,
-            'intent_distribution': [dict(row) for row in intent_distribution]
-        })
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
         
     except Exception as e:
         logger.error(f"Error getting stats: {e}")
+        ERRORS.labels('stats').inc()
         return jsonify({'error': 'Failed to retrieve stats'}), 500
 
-@app.route("/api/clear_session")
-def clear_session():
-    """Clear current session for testing"""
-    session_id = get_session_id()
-    
+def delete_session_messages(session_id):
+    """Delete every stored message of a session"""
     try:
-        conn = get_conn()
+        # Queued rows must land before the delete or they would reappear
+        wait_for_session_writes(session_id)
+        conn = get_session_conn(session_id)
         cur = conn.cursor()
         cur.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
         conn.commit()
-        conn.close()
+        # The cookie is cleared too; the session will not be touched again
+        forget_sessions([session_id])
         
         logger.info(f"Cleared session: {session_id}")
         
     except Exception as e:
         logger.error(f"Error clearing session: {e}")
+        ERRORS.labels('clear_session').inc()
+
+@app.route("/api/clear_session")
+def clear_session():
+    """Clear current session for testing"""
+    session_id = get_session_id()
+    
+    delete_session_messages(session_id)
     
     resp = make_response(redirect("/"))
     resp.set_cookie("session_id", "", expires=0)  # Clear cookie
     return resp
 
+@app.route("/api/classify_batch", methods=["POST"])
+def api_classify_batch():
+    """Classify a batch of messages without persisting anything"""
+    payload = request.get_json(silent=True)
+    messages = payload.get('messages') if isinstance(payload, dict) else None
+    
+    if not isinstance(messages, list) or not all(isinstance(m, str) for m in messages):
+        return jsonify({'error': "'messages' must be a list of strings"}), 400
+    
+    if len(messages) > MAX_BATCH_SIZE:
+        return jsonify({'error': f"Batch too large: {len(messages)} messages (max {MAX_BATCH_SIZE})"}), 413
+    
+    # Session-specific reply text only; no session row is created
+    session_id = str(payload.get('session_id') or request.cookies.get("session_id", ""))
+    
+    start = time.perf_counter()
+    stripped = [m.strip() for m in messages]
+    classified = intent_engine.classify_batch(stripped)
+    results = [
+        {
+            'intent': intent,
+            'confidence': confidence,
+            'response': intent_engine.render_response(template, message, session_id)
+        }
+        for message, (intent, confidence, template) in zip(stripped, classified)
+    ]
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    
+    logger.info(f"Classified batch of {len(results)} messages in {elapsed_ms:.2f} ms")
+    
+    return jsonify({
+        'results': results,
+        'count': len(results),
+        'elapsed_ms': round(elapsed_ms, 3)
+    })
+
+request_profiler = None
+if PROFILE_SAMPLE_RATE > 0 or PROFILE_TOKEN:
+    request_profiler = RequestProfiler(PROFILE_MODE, PROFILE_SAMPLE_RATE, PROFILE_TOKEN, PROFILE_INTERVAL_MS)
+    logger.info(f"Request profiling enabled ({PROFILE_MODE}, sample rate {PROFILE_SAMPLE_RATE})")
+
+def start_request_profile():
+    """Profile this request if it is sampled or asks for it"""
+    if request.url_rule is None or request.endpoint == 'admin_profile':
+        return
+    if request_profiler.wants(request.headers.get('X-Profile')):
+        g.profile = request_profiler.start(request.url_rule.rule)
+
+def stop_request_profile(error):
+    handle = g.pop('profile', None)
+    if handle is not None:
+        request_profiler.stop(handle)
+
+# Only registered when profiling is on, so it costs nothing otherwise
+if request_profiler is not None:
+    app.before_request(start_request_profile)
+    app.teardown_request(stop_request_profile)
+
+admission_controller = None
+if ADMISSION_MAX_CONCURRENT > 0:
+    admission_controller = admission.AdmissionController(
+        ADMISSION_MAX_CONCURRENT, ADMISSION_MAX_QUEUE, ADMISSION_QUEUE_TIMEOUT_MS)
+    logger.info(f"Admission control enabled ({ADMISSION_MAX_CONCURRENT} concurrent, queue {ADMISSION_MAX_QUEUE})")
+
+def busy_response():
+    """503 with Retry-After for requests shed by admission control"""
+    if request.path.startswith('/api/'):
+        resp = jsonify({'error': 'Server busy, please retry'})
+    else:
+        resp = make_response(render_template('error.html', error="Server busy, please retry in a moment"))
+    resp.status_code = 503
+    resp.headers['Retry-After'] = str(ADMISSION_RETRY_AFTER_SECONDS)
+    return resp
+
+def admit_request():
+    """Take a slot; when saturated, mark chat turns for the degraded path or shed with 503"""
+    if request.endpoint is None or request.endpoint in ADMISSION_EXEMPT_ENDPOINTS:
+        return None
+    outcome = admission_controller.acquire()
+    ADMISSIONS.labels(outcome).inc()
+    if outcome in (admission.ACCEPTED, admission.QUEUED):
+        g.admitted = True
+        return None
+    if ADMISSION_DEGRADE and request.method == "POST" and request.endpoint in ADMISSION_DEGRADABLE_ENDPOINTS:
+        g.degraded = True
+        return None
+    logger.warning(f"Shedding {request.method} {request.path}: {outcome}")
+    return busy_response()
+
+def release_admission(error):
+    if g.pop('admitted', False):
+        admission_controller.release()
+
+if admission_controller is not None:
+    app.before_request(admit_request)
+    app.teardown_request(release_admission)
+
+def tokens_match(supplied, expected):
+    """Constant-time token comparison; compares bytes so non-ASCII header values cannot raise"""
+    return hmac.compare_digest(supplied.encode('utf-8', 'surrogateescape'), expected.encode('utf-8', 'surrogateescape'))
+
+def profile_access_allowed():
+    """The profile endpoint needs the token when one is set, otherwise a local client"""
+    if PROFILE_TOKEN:
+        return tokens_match(request.headers.get('X-Profile-Token', ''), PROFILE_TOKEN)
+    return request.remote_addr in ('127.0.0.1', '::1')
+
+def admin_access_allowed():
+    """Exports beyond the caller's own session need ADMIN_TOKEN; nobody gets them while it is unset
+    
+    Unlike the profile check there is no loopback fallback: behind a local
+    reverse proxy every request comes from 127.0.0.1.
+    """
+    if not ADMIN_TOKEN:
+        return False
+    return tokens_match(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN)
+
+@app.route("/admin/profile", methods=["GET", "DELETE"])
+def admin_profile():
+    """Profiled routes and their top functions, or one route's profile as a file"""
+    if request_profiler is None:
+        return jsonify({'error': 'Profiling is off; set PROFILE_SAMPLE_RATE or PROFILE_TOKEN'}), 404
+    if not profile_access_allowed():
+        return jsonify({'error': 'Forbidden'}), 403
+    
+    if request.method == "DELETE":
+        request_profiler.reset()
+        return jsonify({'reset': True})
+    
+    route = request.args.get('route')
+    output = request.args.get('format', 'top')
+    limit = request.args.get('limit', 20, type=int)
+    sort = request.args.get('sort', 'cumulative')
+    
+    if output == 'top':
+        routes = [route] if route else sorted(request_profiler.routes())
+        return jsonify({
+            'mode': request_profiler.mode,
+            'sample_rate': request_profiler.sample_rate,
+            'routes': {
+                name: {
+                    'requests': request_profiler.routes().get(name, 0),
+                    'top': request_profiler.top(name, limit, sort)
+                }
+                for name in routes
+            }
+        })
+    
+    if not route:
+        return jsonify({'error': "'route' is required for file downloads"}), 400
+    filename = 'profile_' + (route.strip('/').replace('/', '_') or 'root')
+    
+    if output == 'pstats':
+        if request_profiler.mode != 'cprofile':
+            return jsonify({'error': "pstats files need PROFILE_MODE=cprofile"}), 400
+        data = request_profiler.pstats_bytes(route)
+        if data is None:
+            return jsonify({'error': f"No profiles for {route}"}), 404
+        resp = Response(data, mimetype='application/octet-stream')
+        resp.headers['Content-Disposition'] = f'attachment; filename="{filename}.pstats"'
+        return resp
+    
+    if output == 'collapsed':
+        if request_profiler.mode != 'sample':
+            return jsonify({'error': "Collapsed stacks need PROFILE_MODE=sample"}), 400
+        resp = Response(request_profiler.collapsed(route), mimetype='text/plain')
+        resp.headers['Content-Disposition'] = f'attachment; filename="{filename}.collapsed"'
+        return resp
+    
+    return jsonify({'error': "format must be 'top', 'pstats' or 'collapsed'"}), 400
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Request, stage, classification and error metrics in Prometheus text format"""
+    return Response(METRICS_REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.cli.command("rebuild-counters")
+@click.option("--rollups", is_flag=True, help="Also rebuild intent_rollups from the messages still stored")
+def rebuild_counters_command(rollups):
+    """Recompute the /api/stats counters from scratch"""
+    for shard in range(DB_SHARDS):
+        rebuild_counters(get_conn(shard), rollups=rollups)
+    logger.info(f"Stats counters rebuilt{' (including rollups)' if rollups else ''}")
+
+@app.cli.command("split-shards")
+@click.option("--shards", "shard_count", type=int, required=True, help="Number of shard files to create")
+@click.option("--source", default=None, help="Database to split (default: DB_PATH)")
+def split_shards_command(shard_count, source):
+    """Copy an unsharded database into shard files for DB_SHARDS; the source is left as is"""
+    if shard_count < 2:
+        raise click.BadParameter("at least 2 shards are needed", param_hint='--shards')
+    source = source or DB_PATH
+    started = time.perf_counter()
+    report = shards.split_database(source, shards.shard_paths(DB_PATH, shard_count), open_connection, init_schema)
+    for entry in report:
+        click.echo(f"{entry['path']}: {entry['sessions']} sessions, {entry['messages']} messages")
+    click.echo(f"Split {source} into {shard_count} shards in {time.perf_counter() - started:.1f}s; "
+               f"start the app with DB_SHARDS={shard_count} to use them")
+
+@app.cli.command("archive-sessions")
+@click.option("--idle-days", type=float, default=RETENTION_IDLE_DAYS, show_default=True,
+              help="Archive sessions without activity for this many days")
+@click.option("--archive-dir", default=ARCHIVE_DIR, show_default=True, help="Root of the YYYY-MM-DD archive folders")
+@click.option("--batch-sessions", type=int, default=RETENTION_BATCH_SESSIONS, show_default=True,
+              help="Sessions per chunk (one delete transaction each)")
+@click.option("--vacuum-pages", type=int, default=0, help="Pages to reclaim per database (default: all free pages)")
+@click.option("--full-vacuum", is_flag=True,
+              help="First switch databases without incremental auto-vacuum over with a full VACUUM (locks them meanwhile)")
+@click.option("--dry-run", is_flag=True, help="Only report what would be archived")
+def archive_sessions_command(idle_days, archive_dir, batch_sessions, vacuum_pages, full_vacuum, dry_run):
+    """Move idle sessions to gzipped NDJSON archives, delete them and reclaim the space"""
+    if not 1 <= batch_sessions <= 10000:
+        raise click.BadParameter("must be between 1 and 10000", param_hint='--batch-sessions')
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=idle_days)).strftime('%Y-%m-%d %H:%M:%S')
+    run_id = time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())
+    click.echo(f"Sessions idle since before {cutoff} UTC{' (dry run)' if dry_run else ''}")
+    
+    totals = {'sessions': 0, 'messages': 0, 'archive_bytes': 0, 'seconds': 0.0}
+    for path in db_paths():
+        conn = open_connection(path)
+        # Trigger statements would otherwise each call the request metrics hook
+        conn.set_trace_callback(None)
+        try:
+            if dry_run:
+                planned = retention.plan(conn, cutoff)
+                free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                mode = retention.AUTO_VACUUM_MODES.get(conn.execute("PRAGMA auto_vacuum").fetchone()[0])
+                click.echo(f"{path}: would archive {planned['sessions']} sessions, {planned['messages']} messages "
+                           f"({planned['content_bytes'] / 1024:.1f} KiB of text, last seen "
+                           f"{planned['oldest']} .. {planned['newest']}); {free_pages} free pages, "
+                           f"auto_vacuum={mode}")
+                continue
+            
+            if full_vacuum and conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                started = time.perf_counter()
+                retention.enable_incremental_vacuum(conn)
+                click.echo(f"{path}: switched to incremental auto-vacuum in {time.perf_counter() - started:.1f}s")
+            
+            size_before = os.path.getsize(path)
+            label = os.path.splitext(os.path.basename(path))[0]
+            report = retention.archive_idle_sessions(conn, cutoff, archive_dir, EXPORT_FIELDS,
+                                                     batch_sessions, label, run_id)
+            reclaimed = retention.reclaim(conn, vacuum_pages)
+            click.echo(f"{path}: archived {report['sessions']} sessions, {report['messages']} messages "
+                       f"({report['archive_bytes'] / 1024:.1f} KiB gzipped, {len(report['files'])} files) "
+                       f"in {report['seconds']:.2f}s = {report['sessions_per_second']} sessions/s, "
+                       f"{report['messages_per_second']} messages/s; {report['chunks']} chunks, "
+                       f"write lock held at most {report['max_lock_ms']} ms; "
+                       f"{report['kept']} came back and stay live")
+            click.echo(f"{path}: reclaimed {reclaimed['reclaimed_pages']} pages "
+                       f"({reclaimed['reclaimed_bytes'] / 1024:.1f} KiB), {reclaimed['free_pages']} still free, "
+                       f"auto_vacuum={reclaimed['auto_vacuum']}; file {size_before / 1024:.1f} -> "
+                       f"{os.path.getsize(path) / 1024:.1f} KiB")
+            if reclaimed['auto_vacuum'] != 'incremental':
+                click.echo(f"{path}: run once with --full-vacuum to make the space reclaimable")
+            for key in totals:
+                totals[key] += report[key]
+        finally:
+            conn.close()
+    
+    if not dry_run:
+        logger.info(f"Archived {totals['sessions']} sessions and {totals['messages']} messages idle since "
+                    f"{cutoff} to {archive_dir} in {totals['seconds']:.2f}s")
+
 @app.errorhandler(500)
 def internal_error(error):
     logger.error(f"Internal server error: {error}")
+    ERRORS.labels('unhandled').inc()
     return render_template('error.html', error="Internal server error"), 500
 
 @app.errorhandler(404)
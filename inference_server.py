@@ -0,0 +1,253 @@
+"""
+Micro-batching inference service for the zero-shot intent classifier.
+
+Each zero-shot call runs one premise/hypothesis forward pass per candidate
+label, which is slow on CPU when requests arrive one at a time. Requests are
+put on a queue instead; a single worker thread waits for the first one, then
+keeps collecting until ``max_batch_size`` requests are queued or
+``max_wait_ms`` has passed since the first arrived. Every request in the
+batch that uses the same label set goes through the pipeline in one call, so
+the model sees all their pairs as one padded batch.
+
+Run standalone::
+
+    python inference_server.py --port 5001
+    python inference_server.py --tiny-model /tmp/tiny-mnli   # random CPU model for testing
+    python inference_server.py --quantize                    # int8 variant, see zero_shot.py
+
+``POST /classify`` takes ``{"text": "...", "labels": [...]}`` and returns the
+label scores; ``GET /stats`` reports batch-size and queue-wait histograms.
+"""
+
+import argparse
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from flask import Flask, jsonify, request
+
+from metrics import BATCH_SIZE_BUCKETS, WAIT_MS_BUCKETS, Histogram
+from zero_shot import LABELS, MODEL_NAME, QUANTIZE, build_tiny_model, load_pipeline, warm_up
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class _Pending:
+    __slots__ = ('text', 'labels', 'enqueued', 'future')
+
+    def __init__(self, text, labels):
+        self.text = text
+        self.labels = labels
+        self.enqueued = time.monotonic()
+        self.future = Future()
+
+
+class MicroBatcher:
+    """Collects concurrent classification requests into dynamic batches
+
+    ``predict(texts, labels)`` must return one ``{'labels': [...], 'scores': [...]}``
+    per text, in order; ``pipeline_predict`` adapts a transformers pipeline.
+    """
+
+    def __init__(self, predict, max_batch_size=16, max_wait_ms=10, queue_size=1024):
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.requests = 0
+        self.batches = 0
+        self.failures = 0
+        self.rejected = 0
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_wait_ms = Histogram(WAIT_MS_BUCKETS)
+        self.inference_ms = Histogram(WAIT_MS_BUCKETS)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+
+    def start(self):
+        """Start the batching worker thread"""
+        self._thread.start()
+        return self
+
+    def submit(self, text, labels):
+        """Queue one request; returns a Future, raises queue.Full when the backlog is full"""
+        pending = _Pending(text, tuple(labels))
+        try:
+            self._queue.put_nowait(pending)
+        except queue.Full:
+            self.rejected += 1
+            raise
+        self.requests += 1
+        return pending.future
+
+    def classify(self, text, labels=LABELS, timeout=None):
+        """Blocking convenience wrapper around submit()"""
+        return self.submit(text, labels).result(timeout)
+
+    def stop(self, timeout=10.0):
+        """Finish queued requests and stop the worker"""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def stats(self):
+        """Return counters and histograms"""
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+            'queued': self._queue.qsize(),
+            'requests': self.requests,
+            'batches': self.batches,
+            'failures': self.failures,
+            'rejected': self.rejected,
+            'batch_size': self.batch_sizes.snapshot(),
+            'queue_wait_ms': self.queue_wait_ms.snapshot(),
+            'inference_ms': self.inference_ms.snapshot()
+        }
+
+    def _collect(self):
+        """Wait for the first request, then gather more until the batch is full or the wait expires"""
+        item = self._queue.get()
+        if item is _STOP:
+            return [], True
+
+        batch = [item]
+        deadline = item.enqueued + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._collect()
+            if batch:
+                self._process(batch)
+        # Requests that raced with stop() still get answered
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                self._process([item])
+
+    def _process(self, batch):
+        started = time.monotonic()
+        self.batches += 1
+        self.batch_sizes.observe(len(batch))
+        for item in batch:
+            self.queue_wait_ms.observe((started - item.enqueued) * 1000)
+
+        groups = {}
+        for item in batch:
+            groups.setdefault(item.labels, []).append(item)
+
+        for labels, items in groups.items():
+            try:
+                results = self.predict([item.text for item in items], list(labels))
+            except Exception as e:
+                self.failures += len(items)
+                logger.error(f"Batch of {len(items)} failed: {e}")
+                for item in items:
+                    item.future.set_exception(e)
+                continue
+            for item, result in zip(items, results):
+                item.future.set_result(result)
+
+        self.inference_ms.observe((time.monotonic() - started) * 1000)
+
+
+def pipeline_predict(classifier):
+    """Adapt a zero-shot pipeline to MicroBatcher's predict(texts, labels) signature"""
+    def predict(texts, labels):
+        # One pipeline call; every premise/hypothesis pair goes through the model together
+        results = classifier(texts, labels, batch_size=len(texts) * len(labels))
+        if isinstance(results, dict):
+            results = [results]
+        return [{'labels': result['labels'], 'scores': result['scores']} for result in results]
+    return predict
+
+
+def create_app(batcher, timeout=30.0):
+    """Flask app exposing the batcher over HTTP"""
+    app = Flask(__name__)
+
+    @app.route("/classify", methods=["POST"])
+    def classify():
+        payload = request.get_json(silent=True) or {}
+        text = payload.get('text')
+        labels = payload.get('labels') or LABELS
+        if not isinstance(text, str) or not text.strip():
+            return jsonify({'error': "'text' must be a non-empty string"}), 400
+        if not isinstance(labels, list) or not all(isinstance(label, str) for label in labels):
+            return jsonify({'error': "'labels' must be a list of strings"}), 400
+
+        try:
+            future = batcher.submit(text.strip(), labels)
+        except queue.Full:
+            return jsonify({'error': 'Inference queue full'}), 503, {'Retry-After': '1'}
+
+        try:
+            result = future.result(timeout)
+        except Exception as e:
+            logger.error(f"Classification failed: {e}")
+            return jsonify({'error': 'Classification failed'}), 500
+        return jsonify(result)
+
+    @app.route("/stats")
+    def stats():
+        return jsonify(batcher.stats())
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-batching zero-shot inference server")
+    parser.add_argument("--model", default=MODEL_NAME, help="Model name or local directory")
+    parser.add_argument("--tiny-model", metavar="DIR",
+                        help="Build (if missing) and serve a tiny random model from DIR for CPU testing")
+    parser.add_argument("--quantize", action="store_true", default=QUANTIZE,
+                        help="Serve the int8 dynamically quantized variant (ZERO_SHOT_QUANTIZE=1)")
+    parser.add_argument("--max-batch-size", type=int, default=int(os.environ.get('INFERENCE_MAX_BATCH_SIZE', '16')))
+    parser.add_argument("--max-wait-ms", type=float, default=float(os.environ.get('INFERENCE_MAX_WAIT_MS', '10')))
+    parser.add_argument("--queue-size", type=int, default=int(os.environ.get('INFERENCE_QUEUE_SIZE', '1024')))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5001)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    model = args.model
+    if args.tiny_model:
+        if not os.path.isdir(args.tiny_model):
+            build_tiny_model(args.tiny_model)
+        model = args.tiny_model
+
+    classifier = load_pipeline(model, args.quantize)
+    logger.info(f"Warm-up took {warm_up(classifier):.1f} ms")
+    batcher = MicroBatcher(
+        pipeline_predict(classifier),
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        queue_size=args.queue_size
+    ).start()
+    logger.info(f"Serving {model} (max batch {args.max_batch_size}, max wait {args.max_wait_ms} ms)")
+
+    create_app(batcher).run(host=args.host, port=args.port, threaded=True)
+    batcher.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,22 @@
+import time
+
 import streamlit as st
-from transformers import pipeline
+
+# transformers/torch are only imported inside load_pipeline
+from zero_shot import LABELS, MODEL_NAME, QUANTIZE, WARMUP, load_pipeline, warm_up
 
 # Caching the model to avoid reloading every run
 @st.cache_resource
 def load_model():
-    return pipeline(
-        "zero-shot-classification",
-        model="facebook/bart-large-mnli"
-    )
-
-classifier = load_model()
+    started = time.perf_counter()
+    classifier = load_pipeline(MODEL_NAME, QUANTIZE)
+    load_s = time.perf_counter() - started
+    # One throwaway pass so the first real query is not slowed by lazy initialisation
+    warmup_ms = warm_up(classifier, LABELS) if WARMUP else None
+    return classifier, load_s, warmup_ms
 
 # Labels to classify
-labels = ["faq", "sentiment", "escalation"]
+labels = LABELS
 
 # Page config
 st.set_page_config(
@@ -21,10 +25,16 @@ st.set_page_config(
     layout="centered",
 )
 
+# The page renders first; the model loads (once) behind a spinner
+with st.spinner("Loading model..."):
+    classifier, load_seconds, warmup_ms = load_model()
+
 # Sidebar
 st.sidebar.title("⚙️ Model Information")
-st.sidebar.markdown("""
-**Model:** facebook/bart-large-mnli  
+st.sidebar.markdown(f"""
+**Model:** {MODEL_NAME}  
+**Precision:** {'int8 (dynamic quantization)' if QUANTIZE else 'fp32'}  
+**Load time:** {load_seconds:.1f} s{f' (+{warmup_ms:.0f} ms warm-up)' if warmup_ms is not None else ''}  
 **Technique:** Zero-shot learning  
 **Library:** 🤗 Transformers  
 **Purpose:** Classify customer support queries  
@@ -0,0 +1,560 @@
+"""
+Compiled rule engine for airline intent classification.
+
+The rule table below mirrors the priority-ordered keyword rules that used to
+live inline in ``enhanced_ui.simulate_bot_response``. Every keyword and phrase
+is compiled once into an Aho-Corasick automaton, so a message is scanned a
+single time regardless of how many rules exist. The scan yields a bitmask of
+the keyword groups that were hit, and each rule is then a couple of integer
+tests against that mask.
+
+Matching keeps the original substring semantics (``'hi'`` matches ``'this'``),
+so results are identical to the old ``any(phrase in message ...)`` cascade.
+"""
+
+from collections import OrderedDict, deque
+import os
+import threading
+
+
+def hit(*groups, unless=()):
+    """Clause that fires when every group has a hit and the unless group has none"""
+    return (tuple(tuple(group) for group in groups), tuple(unless))
+
+
+# Comprehensive airline/travel industry intent classification with priority order
+# More specific intents first, then broader ones
+RULES = [
+    # Cancellation (high priority - specific action)
+    {
+        'intent': 'Cancellation',
+        'confidence': 0.9,
+        'response': "I can assist you with canceling your booking. Please provide your booking reference number.",
+        'when': [
+            hit(['cancel booking', 'cancel flight', 'cancel my', 'cancel reservation']),
+            hit(['cancel', 'cancellation'], ['booking', 'flight', 'reservation', 'ticket']),
+        ],
+    },
+    # Refund (high priority - specific action)
+    {
+        'intent': 'Refund',
+        'confidence': 0.9,
+        'response': "I can help you with refund requests. Please provide your booking details and reason for the refund.",
+        'when': [
+            hit(['money back', 'refund request', 'want refund', 'need refund']),
+            hit(['refund', 'reimbursement', 'compensation']),
+        ],
+    },
+    # Check-in (specific action)
+    {
+        'intent': 'Check-in',
+        'confidence': 0.9,
+        'response': "I can help with check-in procedures. You can check in online up to 24 hours before your flight.",
+        'when': [
+            hit(['check in', 'check-in', 'online check', 'boarding pass']),
+        ],
+    },
+    # Upgrade (specific action)
+    {
+        'intent': 'Upgrade',
+        'confidence': 0.9,
+        'response': "I can assist with seat upgrades. Let me check available options for your flight.",
+        'when': [
+            hit(['business class', 'first class', 'premium seat']),
+            hit(['upgrade', 'premium']),
+        ],
+    },
+    # Reschedule (specific action)
+    {
+        'intent': 'Reschedule',
+        'confidence': 0.85,
+        'response': "I can help you reschedule your flight. What new date and time would you prefer?",
+        'when': [
+            hit(['reschedule', 'change date', 'change time', 'different flight', 'different time']),
+        ],
+    },
+    # Seating (specific feature)
+    {
+        'intent': 'Seating',
+        'confidence': 0.9,
+        'response': "I can help you with seat selection. Would you like to choose your seats now?",
+        'when': [
+            hit(['window seat', 'aisle seat', 'seat selection', 'select seat', 'choose seat']),
+            hit(['seat', 'seating'], unless=['upgrade', 'premium', 'business', 'first']),
+        ],
+    },
+    # Meals (specific feature)
+    {
+        'intent': 'Meals',
+        'confidence': 0.85,
+        'response': "I can help you with meal options and special dietary requirements for your flight.",
+        'when': [
+            hit(['meal options', 'food options', 'dietary restrictions', 'special meal']),
+            hit(['meals', 'food', 'dining', 'dietary']),
+        ],
+    },
+    # Boarding (specific process)
+    {
+        'intent': 'Boarding',
+        'confidence': 0.85,
+        'response': "Boarding information will be displayed on airport screens and announced at the gate.",
+        'when': [
+            hit(['boarding time', 'boarding start', 'gate number', 'what gate']),
+            hit(['boarding', 'board', 'gate'], unless=['check', 'pass']),
+        ],
+    },
+    # Amenities (specific features)
+    {
+        'intent': 'Amenities',
+        'confidence': 0.8,
+        'response': "Our flights offer various amenities including entertainment, Wi-Fi, and comfort features.",
+        'when': [
+            hit(['wi-fi', 'wifi', 'entertainment', 'amenities available']),
+            hit(['amenities', 'facilities', 'services', 'entertainment']),
+        ],
+    },
+    # Loyalty Programs (specific program)
+    {
+        'intent': 'Loyalty Programs',
+        'confidence': 0.85,
+        'response': "I can help you with our loyalty program. Are you interested in joining or have questions about your membership?",
+        'when': [
+            hit(['frequent flyer', 'loyalty program', 'join program', 'membership benefits']),
+            hit(['loyalty', 'membership', 'miles', 'points'], ['program', 'join', 'benefits']),
+        ],
+    },
+    # Rewards (specific to earning/redeeming)
+    {
+        'intent': 'Rewards',
+        'confidence': 0.8,
+        'response': "Let me help you with reward redemption and earning opportunities.",
+        'when': [
+            hit(['redeem miles', 'earn points', 'redeem points', 'reward redemption']),
+            hit(['rewards', 'redeem', 'earn'], ['miles', 'points', 'benefits']),
+        ],
+    },
+    # Security (specific procedures)
+    {
+        'intent': 'Security',
+        'confidence': 0.85,
+        'response': "I can help you understand security procedures and what items are allowed in carry-on and checked baggage.",
+        'when': [
+            hit(['prohibited items', 'carry-on restrictions', 'security procedures', 'tsa', 'screening']),
+        ],
+    },
+    # Safety (specific measures)
+    {
+        'intent': 'Safety',
+        'confidence': 0.85,
+        'response': "Safety is our top priority. I can provide information about our safety measures and procedures.",
+        'when': [
+            hit(['safety measures', 'safe to fly', 'safety procedures']),
+            hit(['safety', 'safe', 'emergency', 'health']),
+        ],
+    },
+    # Promotions and Offers (marketing)
+    {
+        'intent': 'Promotions',
+        'confidence': 0.85,
+        'response': "Check out our current promotions and special offers for great deals on flights.",
+        'when': [
+            hit(['special deals', 'current promotions', 'special offers']),
+            hit(['promotion', 'promo', 'deal']),
+        ],
+    },
+    {
+        'intent': 'Offers',
+        'confidence': 0.8,
+        'response': "I can show you our latest offers and deals. What type of travel are you planning?",
+        'when': [
+            hit(['offers', 'deals', 'bargains', 'sales']),
+        ],
+    },
+    # Discounts (price-related)
+    {
+        'intent': 'Discounts',
+        'confidence': 0.85,
+        'response': "I can help you find discounted fares and ways to save on your booking.",
+        'when': [
+            hit(['student discount', 'get discount', 'lower price', 'save money']),
+            hit(['discount', 'cheaper']),
+        ],
+    },
+    # Policies (rules and terms)
+    {
+        'intent': 'Policies',
+        'confidence': 0.8,
+        'response': "I can explain our policies regarding booking, cancellation, and travel requirements.",
+        'when': [
+            hit(['cancellation policy', 'refund policy', 'baggage policy']),
+            hit(['policy', 'policies', 'rules', 'terms'], unless=['how', 'process', 'procedure']),
+        ],
+    },
+    # Procedures (how-to processes)
+    {
+        'intent': 'Procedures',
+        'confidence': 0.8,
+        'response': "I can guide you through our procedures step by step. What process do you need help with?",
+        'when': [
+            hit(['how do i', 'what is the process', 'how to']),
+            hit(['procedure', 'procedures', 'process']),
+        ],
+    },
+    # Regulations (travel requirements)
+    {
+        'intent': 'Regulations',
+        'confidence': 0.8,
+        'response': "I can provide information about travel regulations and requirements for your destination.",
+        'when': [
+            hit(['travel requirements', 'visa requirements', 'need visa']),
+            hit(['regulation', 'regulations', 'requirements', 'compliance']),
+        ],
+    },
+    # Complaint (negative sentiment)
+    {
+        'intent': 'Complaint',
+        'confidence': 0.85,
+        'response': "I apologize for any inconvenience. Please describe the issue you're experiencing so I can help resolve it.",
+        'when': [
+            hit(['very unhappy', 'not satisfied', 'poor service']),
+            hit(['complaint', 'complain', 'dissatisfied', 'unhappy', 'problem', 'issue']),
+        ],
+    },
+    # Feedback (reviews and suggestions)
+    {
+        'intent': 'Feedback',
+        'confidence': 0.8,
+        'response': "Thank you for wanting to share your feedback. Your input helps us improve our services.",
+        'when': [
+            hit(['leave feedback', 'share feedback', 'my review']),
+            hit(['feedback', 'review', 'comment', 'suggestion', 'opinion']),
+        ],
+    },
+    # Change (modifications)
+    {
+        'intent': 'Change',
+        'confidence': 0.85,
+        'response': "I can help you change your booking. What modifications would you like to make?",
+        'when': [
+            hit(['change booking', 'modify booking', 'update booking']),
+            hit(['change', 'modify', 'update', 'alter'], ['booking', 'flight', 'reservation']),
+        ],
+    },
+    # Booking (reservations and scheduling)
+    {
+        'intent': 'Booking',
+        'confidence': 0.85,
+        'response': "I can help you with booking flights. What destination are you looking for? (Session: {session}...)",
+        'when': [
+            hit(['book flight', 'book a flight', 'make reservation', 'reserve seat']),
+            hit(['book', 'booking', 'reserve', 'reservation', 'schedule']),
+            hit(['flight']),
+        ],
+    },
+    # Information (general info requests)
+    {
+        'intent': 'Information',
+        'confidence': 0.75,
+        'response': "I'm happy to provide information. What specific details would you like to know?",
+        'when': [
+            hit(['tell me about', 'information about', 'need information']),
+            hit(['information', 'info', 'details']),
+        ],
+    },
+    # Inquiry (questions)
+    {
+        'intent': 'Inquiry',
+        'confidence': 0.8,
+        'response': "I'm here to answer your questions. What would you like to know?",
+        'when': [
+            hit(['i have a question', 'what time', 'how much', 'when does']),
+            hit(['inquiry', 'inquire', 'question', 'ask']),
+        ],
+    },
+    # Support (general help)
+    {
+        'intent': 'Support',
+        'confidence': 0.85,
+        'response': "I'm here to provide support. How can I assist you today?",
+        'when': [
+            hit(['support', 'help', 'assist', 'assistance']),
+        ],
+    },
+    # Greeting and farewell intents
+    {
+        'intent': 'Support',
+        'confidence': 0.9,
+        'response': "Hello! Welcome to our airline customer service. How can I help you today? (Session: {session}...)",
+        'when': [
+            hit(['hello', 'hi', 'hey', 'good morning', 'good afternoon']),
+        ],
+    },
+    {
+        'intent': 'Support',
+        'confidence': 0.85,
+        'response': "Thank you for choosing our airline. Have a great day and safe travels!",
+        'when': [
+            hit(['bye', 'goodbye', 'thank you', 'thanks', 'exit']),
+        ],
+    },
+]
+
+# Used when no rule fires
+FALLBACK = {
+    'intent': 'Inquiry',
+    'confidence': 0.6,
+    'response': "I understand you said: '{message}'. Could you please provide more details so I can assist you better?",
+}
+
+
+class IntentMatcher:
+    """Rule table compiled into a single-pass Aho-Corasick keyword scanner"""
+
+    def __init__(self, rules, fallback=FALLBACK):
+        self.rules = rules
+        self.fallback = fallback
+
+        # Give every distinct keyword group its own bit
+        group_bits = {}
+        term_bits = {}
+
+        def bit_for(group):
+            if group not in group_bits:
+                group_bits[group] = 1 << len(group_bits)
+                for term in group:
+                    term_bits[term] = term_bits.get(term, 0) | group_bits[group]
+            return group_bits[group]
+
+        # Each clause becomes (required bits, forbidden bits)
+        self._compiled = []
+        for rule in rules:
+            clauses = []
+            for groups, unless in rule['when']:
+                required = 0
+                for group in groups:
+                    required |= bit_for(group)
+                forbidden = bit_for(unless) if unless else 0
+                clauses.append((required, forbidden))
+            self._compiled.append((tuple(clauses), rule))
+
+        self._delta, self._out = self._build_automaton(term_bits)
+        self.term_count = len(term_bits)
+        self.group_count = len(group_bits)
+
+        # First response template of each intent, in priority order; lets
+        # another classifier answer with the rule table's wording
+        self.responses = {}
+        for rule in list(rules) + [fallback]:
+            self.responses.setdefault(rule['intent'], rule['response'])
+
+    @staticmethod
+    def _build_automaton(term_bits):
+        """Build a complete transition table so scanning never follows failure links"""
+        goto = [{}]
+        out = [0]
+        for term, bits in term_bits.items():
+            state = 0
+            for ch in term:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto.append({})
+                    out.append(0)
+                    goto[state][ch] = nxt
+                state = nxt
+            out[state] |= bits
+
+        fail = [0] * len(goto)
+        delta = [None] * len(goto)
+        delta[0] = dict(goto[0])
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            out[state] |= out[fail[state]]
+            transitions = dict(delta[fail[state]])
+            transitions.update(goto[state])
+            delta[state] = transitions
+            for ch, child in goto[state].items():
+                fail[child] = delta[fail[state]].get(ch, 0)
+                queue.append(child)
+        return delta, out
+
+    def scan(self, text):
+        """Return the bitmask of keyword groups that occur in lowercased text"""
+        delta = self._delta
+        out = self._out
+        state = 0
+        mask = 0
+        for ch in text:
+            state = delta[state].get(ch, 0)
+            mask |= out[state]
+        return mask
+
+    def select(self, mask):
+        """Pick the first rule (in priority order) whose conditions hold for mask"""
+        for clauses, rule in self._compiled:
+            for required, forbidden in clauses:
+                if mask & required == required and not mask & forbidden:
+                    return rule
+        return self.fallback
+
+    def match(self, text):
+        """Return the winning rule for lowercased text"""
+        return self.select(self.scan(text))
+
+
+class ResultCache:
+    """Bounded LRU cache of classification results keyed on lowercased message text
+
+    Cached values are (intent, confidence, response template), so the
+    session- and message-specific parts of a reply are filled in after lookup.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached result for key, or None"""
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self._data.move_to_end(key)
+                self.hits += 1
+            return value
+
+    def put(self, key, value, generation):
+        """Store a result computed while the cache was at the given generation"""
+        with self._lock:
+            # Drop results computed against a rule set that has since been replaced
+            if generation != self.generation or self.maxsize <= 0:
+                return
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop every entry and reject results computed before the clear"""
+        with self._lock:
+            self._data.clear()
+            self.generation += 1
+            self.invalidations += 1
+
+    def info(self):
+        """Return size and hit/miss/eviction counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+# Boundary marker used when scanning a batch of messages as one string
+BATCH_SEPARATOR = '\x00'
+
+# Result cache configuration; long messages rarely repeat so they skip the cache
+CACHE_SIZE = int(os.environ.get('INTENT_CACHE_SIZE', '4096'))
+CACHE_MAX_MESSAGE_LENGTH = int(os.environ.get('INTENT_CACHE_MAX_MESSAGE_LENGTH', '256'))
+
+_matcher = IntentMatcher(RULES)
+_cache = ResultCache(CACHE_SIZE)
+_rules_lock = threading.Lock()
+rules_version = 0
+
+
+def get_matcher():
+    """Return the currently active compiled matcher"""
+    return _matcher
+
+
+def set_rules(rules, fallback=FALLBACK):
+    """Compile and activate a new rule table"""
+    global _matcher, rules_version
+    matcher = IntentMatcher(rules, fallback)
+    with _rules_lock:
+        _matcher = matcher
+        rules_version += 1
+        _cache.clear()
+    return matcher
+
+
+def cache_info():
+    """Return hit/miss/eviction counters for the result cache"""
+    return _cache.info()
+
+
+def classify(user_message):
+    """Classify a message, returning (intent, confidence, response template)"""
+    key = user_message.lower()
+    if len(key) > CACHE_MAX_MESSAGE_LENGTH:
+        rule = _matcher.match(key)
+        return rule['intent'], rule['confidence'], rule['response']
+
+    generation = _cache.generation
+    result = _cache.get(key)
+    if result is None:
+        rule = _matcher.match(key)
+        result = (rule['intent'], rule['confidence'], rule['response'])
+        _cache.put(key, result, generation)
+    return result
+
+
+def classify_batch(user_messages):
+    """Classify many messages in one scan, returning a list of (intent, confidence, response template)"""
+    matcher = _matcher
+    if not user_messages:
+        return []
+
+    # Lowercase the whole batch at once and scan it as one string. The
+    # separator never appears in a keyword, so the automaton falls back to its
+    # root at every boundary; stray separators inside messages are swapped for
+    # another non-keyword character so matching is unaffected.
+    text = BATCH_SEPARATOR.join(
+        message.replace(BATCH_SEPARATOR, '\x01') for message in user_messages
+    ).lower()
+
+    delta = matcher._delta
+    out = matcher._out
+    masks = []
+    state = 0
+    mask = 0
+    for ch in text:
+        if ch == BATCH_SEPARATOR:
+            masks.append(mask)
+            state = 0
+            mask = 0
+            continue
+        state = delta[state].get(ch, 0)
+        mask |= out[state]
+    masks.append(mask)
+
+    # Evaluate the rules once per distinct hit pattern
+    selected = {}
+    results = []
+    for mask in masks:
+        rule = selected.get(mask)
+        if rule is None:
+            rule = selected[mask] = matcher.select(mask)
+        results.append((rule['intent'], rule['confidence'], rule['response']))
+    return results
+
+
+def render_response(template, user_message, session_id):
+    """Fill the session and message placeholders of a response template"""
+    return template.format(session=session_id[:8], message=user_message)
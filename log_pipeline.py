@@ -0,0 +1,90 @@
+"""
+Non-blocking logging for the chat app.
+
+Request threads only put log records on an in-memory queue; a background
+``QueueListener`` thread formats them and writes them to the console and a
+size-rotated log file. The queue handler hands records over untouched, so
+``%``-style arguments are interpolated on the listener thread rather than
+while a request is being served.
+
+Per-turn records go through ``ChatTurnLog``: one ``key=value`` line per turn,
+kept with probability ``sample_rate`` (the rate is written into each line so
+counts can be scaled back up), and with the message and reply bodies only when
+``bodies`` is on.
+"""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import random
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener
+
+    The stock ``prepare`` formats every record on the calling thread so the
+    record can be pickled; the queue here never leaves the process.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(log_file='chat_app.log', level=logging.INFO, max_bytes=10 * 1024 * 1024,
+                  backup_count=5, console=True):
+    """Route the root logger through a queue to a rotating file (and the console); returns the listener"""
+    root = logging.getLogger()
+    for handler in root.handlers:
+        if isinstance(handler, DeferredQueueHandler):
+            return handler.listener
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count)]
+    if console:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    queue_handler = DeferredQueueHandler(records)
+    queue_handler.listener = listener
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener.start()
+    # Drains whatever is still queued before the interpreter exits
+    atexit.register(listener.stop)
+    return listener
+
+
+class ChatTurnLog:
+    """Sampled, structured INFO record per chat turn"""
+
+    def __init__(self, logger, sample_rate=1.0, bodies=False):
+        self.logger = logger
+        self.sample_rate = sample_rate
+        self.bodies = bodies
+
+    def log(self, session_id, user_message, bot_reply, intent, confidence, tier, elapsed_ms):
+        """Queue one record for this turn unless it is sampled out or INFO is disabled"""
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+        if self.bodies:
+            self.logger.info(
+                "chat_turn session=%s intent=%s confidence=%s tier=%s elapsed_ms=%.2f sample_rate=%s "
+                "message=%r reply=%r",
+                session_id, intent, confidence, tier, elapsed_ms, self.sample_rate, user_message, bot_reply
+            )
+        else:
+            self.logger.info(
+                "chat_turn session=%s intent=%s confidence=%s tier=%s elapsed_ms=%.2f sample_rate=%s "
+                "message_chars=%d reply_chars=%d",
+                session_id, intent, confidence, tier, elapsed_ms, self.sample_rate,
+                len(user_message), len(bot_reply)
+            )
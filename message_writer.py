@@ -0,0 +1,214 @@
+"""
+Write-behind persistence for chat messages.
+
+Rows are put on a bounded in-process queue and a background thread commits
+them with ``executemany`` in one transaction every ``batch_rows`` rows or
+``flush_ms`` milliseconds, whichever comes first. A full queue blocks the
+producer for up to ``enqueue_timeout_ms`` (backpressure) and then reports
+failure so the caller can write synchronously instead.
+
+A batch that fails to commit (e.g. SQLITE_BUSY after ``busy_timeout``) is
+retried ``retries`` times with doubling backoff, then written one turn per
+transaction, so one bad turn cannot take other sessions' rows with it. Only
+turns that still fail are discarded.
+
+Readers that need to see their own writes call ``wait_for_session`` before
+querying; it returns True as soon as every queued row of that session has
+been committed, and False on timeout or when rows of the session were
+discarded.
+"""
+
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+INSERT_MESSAGE_SQL = """
+    INSERT INTO messages (session_id, role, content, intent, confidence, timestamp)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+_STOP = object()
+
+
+def utc_timestamp():
+    """Current UTC time in the same format as SQLite's CURRENT_TIMESTAMP"""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+
+
+class MessageWriter:
+    """Background group-commit writer for message rows
+
+    Each queued item is a list of row tuples matching ``INSERT_MESSAGE_SQL``
+    (session_id first). Rows of one item are always committed together.
+    """
+
+    def __init__(self, connect, batch_rows=200, flush_ms=50, queue_size=10000,
+                 enqueue_timeout_ms=1000, retries=3, retry_backoff_ms=50):
+        self.connect = connect
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_ms / 1000
+        self.enqueue_timeout = enqueue_timeout_ms / 1000
+        self.retries = retries
+        self.retry_backoff = retry_backoff_ms / 1000
+        self.rows_written = 0
+        self.batches_written = 0
+        self.batch_retries = 0
+        self.rows_failed = 0
+        self.enqueue_rejected = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._pending = {}
+        # Sessions with discarded rows, reported by the next wait_for_session
+        self._lost = set()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='message-writer', daemon=True)
+
+    def start(self):
+        """Start the background writer thread"""
+        self._thread.start()
+        return self
+
+    def enqueue(self, rows, timeout=None):
+        """Queue rows for writing; returns False if the writer is closed or stays full
+
+        ``timeout`` overrides ``enqueue_timeout_ms`` (0 fails at once when full).
+        """
+        if self._closed:
+            return False
+
+        with self._cond:
+            for row in rows:
+                self._pending[row[0]] = self._pending.get(row[0], 0) + 1
+
+        try:
+            self._queue.put(rows, timeout=self.enqueue_timeout if timeout is None else timeout)
+            return True
+        except queue.Full:
+            self.enqueue_rejected += 1
+            self._done(rows)
+            return False
+
+    def wait_for_session(self, session_id, timeout=5.0):
+        """Block until every queued row of session_id is settled; False on timeout or lost rows"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: session_id not in self._pending, timeout):
+                return False
+            if session_id in self._lost:
+                self._lost.discard(session_id)
+                return False
+            return True
+
+    def stop(self, timeout=10.0):
+        """Stop accepting rows, write out everything queued and stop the thread"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def stats(self):
+        """Return queue depth and write counters"""
+        return {
+            'queued_groups': self._queue.qsize(),
+            'rows_written': self.rows_written,
+            'batches_written': self.batches_written,
+            'batch_retries': self.batch_retries,
+            'rows_failed': self.rows_failed,
+            'enqueue_rejected': self.enqueue_rejected
+        }
+
+    def _done(self, rows, lost=False):
+        with self._cond:
+            if lost:
+                self._lost.update(row[0] for row in rows)
+            for row in rows:
+                remaining = self._pending.get(row[0], 0) - 1
+                if remaining > 0:
+                    self._pending[row[0]] = remaining
+                else:
+                    self._pending.pop(row[0], None)
+            self._cond.notify_all()
+
+    def _collect(self):
+        """Wait for the first item, then gather more until the batch is full or the interval passes
+
+        Returns the batch as its list of items (turns), so a failed batch can
+        be retried turn by turn.
+        """
+        item = self._queue.get()
+        if item is _STOP:
+            return [], True
+
+        batch = [item]
+        rows = len(item)
+        deadline = time.monotonic() + self.flush_interval
+        while rows < self.batch_rows:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+            rows += len(item)
+        return batch, False
+
+    def _run(self):
+        conn = self.connect()
+        stopping = False
+        while not stopping:
+            batch, stopping = self._collect()
+            if batch:
+                self._write(conn, batch)
+
+        # Rows that raced with stop() are still written before closing
+        leftovers = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                leftovers.append(item)
+        if leftovers:
+            self._write(conn, leftovers)
+        conn.close()
+        logger.info(f"Message writer stopped after {self.rows_written} rows in {self.batches_written} batches")
+
+    def _commit(self, conn, rows):
+        with conn:
+            conn.executemany(INSERT_MESSAGE_SQL, rows)
+        self.rows_written += len(rows)
+        self.batches_written += 1
+
+    def _write(self, conn, batch):
+        """Commit a batch of items, retrying with backoff, then item by item"""
+        rows = [row for item in batch for row in item]
+        for attempt in range(self.retries + 1):
+            try:
+                self._commit(conn, rows)
+                self._done(rows)
+                return
+            except Exception as e:
+                if attempt == self.retries:
+                    logger.warning(f"Write-behind flush of {len(rows)} rows failed {attempt + 1} times ({e}); "
+                                   f"writing its {len(batch)} turns one by one")
+                    break
+                self.batch_retries += 1
+                time.sleep(self.retry_backoff * 2 ** attempt)
+
+        for item in batch:
+            try:
+                self._commit(conn, item)
+                self._done(item)
+            except Exception as e:
+                self.rows_failed += len(item)
+                logger.error(f"Write-behind lost {len(item)} rows of session {item[0][0]}: {e}")
+                self._done(item, lost=True)
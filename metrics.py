@@ -0,0 +1,206 @@
+"""
+In-process metrics with Prometheus text exposition.
+
+Histograms and counters are plain Python objects updated under a lock; a
+sample is a bisect plus a few additions, so recording costs a fraction of a
+microsecond and nothing at all happens in the background. Labelled metrics
+hand out one child per label combination (``labels(...)``); resolve children
+once, at import time, on hot paths. Components that already keep their own
+counters are exported with ``Registry.callback``, which reads them only at
+scrape time. ``Registry.render()`` produces the Prometheus text format
+(version 0.0.4) when something scrapes it.
+"""
+
+import bisect
+import functools
+import threading
+import time
+
+# Seconds, for request and stage latencies
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Statements executed per request
+COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128)
+# Milliseconds, for model queue waits and inference
+WAIT_MS_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+# Requests per model batch
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    """Cumulative-bucket histogram with count and sum"""
+
+    __slots__ = ('buckets', 'counts', 'sum', '_lock')
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        # bisect raises for non-numbers before the lock is taken, and nothing
+        # below can raise, so the cheaper acquire/release pair is safe here
+        index = bisect.bisect_left(self.buckets, value)
+        self._lock.acquire()
+        self.counts[index] += 1
+        self.sum += value
+        self._lock.release()
+
+    def read(self):
+        """Return (per-bucket counts, sum) as one consistent pair"""
+        with self._lock:
+            return list(self.counts), self.sum
+
+    def snapshot(self):
+        """Return {'buckets': {upper_bound: cumulative count}, 'count', 'sum', 'mean'}"""
+        counts, total = self.read()
+        count = sum(counts)
+        cumulative = {}
+        running = 0
+        for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+            running += bucket_count
+            cumulative[str(bound)] = running
+        return {
+            'buckets': cumulative,
+            'count': count,
+            'sum': round(total, 3),
+            'mean': round(total / count, 3) if count else None
+        }
+
+
+class Counter:
+    """Monotonic counter"""
+
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        self._lock.acquire()
+        self.value += amount
+        self._lock.release()
+
+
+class Family:
+    """A named metric with one child (Histogram or Counter) per combination of label values"""
+
+    def __init__(self, kind, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = buckets
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """Child for these label values, created on first use"""
+        child = self._children.get(values)
+        if child is None:
+            values = tuple(str(value) for value in values)
+            child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = Histogram(self.buckets) if self.kind == 'histogram' else Counter()
+                    self._children[values] = child
+        return child
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, values)]
+            if self.kind == 'counter':
+                lines.append(f"{self.name}{_labels(pairs)} {child.value}")
+                continue
+            counts, total = child.read()
+            running = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                running += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                bucket_pairs = pairs + [f'le="{le}"']
+                lines.append(f"{self.name}_bucket{_labels(bucket_pairs)} {running}")
+            lines.append(f"{self.name}_sum{_labels(pairs)} {total!r}")
+            lines.append(f"{self.name}_count{_labels(pairs)} {running}")
+        return lines
+
+
+class CallbackFamily:
+    """A named metric whose values are read from ``function()`` at render time
+
+    ``function`` returns {label values tuple: value}; used for counters and
+    gauges that a background component already keeps.
+    """
+
+    def __init__(self, kind, name, documentation, labelnames, function):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, value in sorted(self.function().items()):
+            pairs = [f'{name}="{_escape(str(label))}"' for name, label in zip(self.labelnames, values)]
+            lines.append(f"{self.name}{_labels(pairs)} {value}")
+        return lines
+
+
+class Registry:
+    """Collection of metric families rendered together"""
+
+    def __init__(self):
+        self._families = []
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Family('histogram', name, documentation, labelnames, buckets))
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Family('counter', name, documentation, labelnames))
+
+    def callback(self, kind, name, documentation, labelnames, function):
+        """Counter or gauge family read from function() on every render"""
+        return self._add(CallbackFamily(kind, name, documentation, labelnames, function))
+
+    def _add(self, family):
+        if any(existing.name == family.name for existing in self._families):
+            raise ValueError(f"Metric {family.name} is already registered")
+        self._families.append(family)
+        return family
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for family in self._families:
+            lines.extend(family.render())
+        return '\n'.join(lines) + '\n'
+
+
+def timed(histogram):
+    """Decorator recording each call's duration in seconds, including calls that raise"""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started)
+        return wrapper
+    return decorate
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs):
+    return '{' + ','.join(pairs) + '}' if pairs else ''
@@ -0,0 +1,12 @@
+"""
+Settings of the zero-shot intent model.
+
+Kept apart from ``zero_shot`` so the chat app can read them without importing
+the model loader or the inference server.
+"""
+
+import os
+
+MODEL_NAME = os.environ.get('ZERO_SHOT_MODEL', 'facebook/bart-large-mnli')
+QUANTIZE = os.environ.get('ZERO_SHOT_QUANTIZE', '0') == '1'
+WARMUP = os.environ.get('ZERO_SHOT_WARMUP', '1') == '1'
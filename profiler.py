@@ -0,0 +1,202 @@
+"""
+Opt-in per-request profiling, aggregated per route.
+
+A request is profiled when it is picked by ``sample_rate`` or carries the
+configured token in its ``X-Profile`` header. Two modes:
+
+- ``cprofile``: the request runs under ``cProfile``; profiles are merged into
+  one ``pstats.Stats`` per route, downloadable as a ``.pstats`` file (open it
+  with ``python -m pstats`` or snakeviz) or summarised as top functions.
+- ``sample``: a background thread walks the profiled threads' stacks every
+  ``interval_ms`` and counts them, which costs the request itself almost
+  nothing. Results are top functions by samples or collapsed stacks
+  (``frame;frame;frame count`` lines) for flamegraph.pl / speedscope.
+
+Requests that are not picked pay for one ``random()`` call and a header lookup.
+"""
+
+import cProfile
+import hmac
+import io
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+
+MODES = ('cprofile', 'sample')
+
+
+class RequestProfiler:
+    """Profiles a fraction of requests and keeps the results per route"""
+
+    def __init__(self, mode='cprofile', sample_rate=0.0, token='', interval_ms=5):
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode {mode!r}; expected one of {MODES}")
+        self.mode = mode
+        self.sample_rate = sample_rate
+        self.token = token
+        self.interval = interval_ms / 1000
+        self._lock = threading.Lock()
+        self._requests = {}
+        # cprofile: route -> pstats.Stats; sample: route -> {collapsed stack: samples}
+        self._results = {}
+        self._active = {}
+        self._wake = threading.Event()
+        self._sampler = None
+
+    def wants(self, header_value):
+        """Whether to profile a request carrying this X-Profile header value (may be None)"""
+        # Constant-time, so response times do not reveal how much of the token matched
+        if self.token and header_value is not None and hmac.compare_digest(
+                header_value.encode('utf-8', 'surrogateescape'), self.token.encode('utf-8', 'surrogateescape')):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self, route):
+        """Start profiling the current thread's request; returns a handle for stop(), or None"""
+        if self.mode == 'sample':
+            self._ensure_sampler()
+            with self._lock:
+                self._active[threading.get_ident()] = route
+            self._wake.set()
+            return route, None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is active (Python 3.12+ allows only one at a time)
+            return None
+        return route, profile
+
+    def stop(self, handle):
+        route, profile = handle
+        if profile is None:
+            with self._lock:
+                self._active.pop(threading.get_ident(), None)
+                self._requests[route] = self._requests.get(route, 0) + 1
+            return
+        profile.disable()
+        stats = pstats.Stats(profile)
+        with self._lock:
+            self._requests[route] = self._requests.get(route, 0) + 1
+            if route in self._results:
+                self._results[route].add(stats)
+            else:
+                self._results[route] = stats
+
+    def routes(self):
+        """{route: number of profiled requests}"""
+        with self._lock:
+            return dict(self._requests)
+
+    def reset(self):
+        with self._lock:
+            self._requests.clear()
+            self._results.clear()
+
+    def top(self, route, limit=20, sort='cumulative'):
+        """Most expensive functions for a route, as dicts sorted by cumulative or own time (samples)"""
+        with self._lock:
+            result = self._results.get(route)
+            if result is None:
+                return []
+            if self.mode == 'sample':
+                stacks = dict(result)
+            else:
+                entries = [(function, values[:4]) for function, values in result.stats.items()]
+
+        if self.mode == 'sample':
+            total, own = {}, {}
+            for stack, count in stacks.items():
+                frames = stack.split(';')
+                for frame in set(frames):
+                    total[frame] = total.get(frame, 0) + count
+                own[frames[-1]] = own.get(frames[-1], 0) + count
+            samples = sum(stacks.values())
+            ranked = own if sort == 'tottime' else total
+            return [
+                {
+                    'function': frame,
+                    'samples': total[frame],
+                    'own_samples': own.get(frame, 0),
+                    'share': round(total[frame] / samples, 4)
+                }
+                for frame in sorted(ranked, key=ranked.get, reverse=True)[:limit]
+            ]
+
+        index = 2 if sort == 'tottime' else 3
+        entries.sort(key=lambda entry: entry[1][index], reverse=True)
+        return [
+            {
+                'function': _label(function),
+                'calls': calls,
+                'tottime_ms': round(tottime * 1000, 3),
+                'cumtime_ms': round(cumtime * 1000, 3)
+            }
+            for function, (_, calls, tottime, cumtime) in entries[:limit]
+        ]
+
+    def pstats_bytes(self, route):
+        """The merged profile of a route in the .pstats file format (cprofile mode)"""
+        with self._lock:
+            stats = self._results.get(route)
+            return marshal.dumps(stats.stats) if stats is not None else None
+
+    def collapsed(self, route):
+        """Collapsed stacks of a route, one 'frame;frame count' line each (sample mode)"""
+        with self._lock:
+            stacks = dict(self._results.get(route) or {})
+        buffer = io.StringIO()
+        for stack, count in sorted(stacks.items()):
+            buffer.write(f"{stack} {count}\n")
+        return buffer.getvalue()
+
+    def _ensure_sampler(self):
+        if self._sampler is None:
+            with self._lock:
+                if self._sampler is None:
+                    self._sampler = threading.Thread(target=self._sample_loop, name='request-profiler', daemon=True)
+                    self._sampler.start()
+
+    def _sample_loop(self):
+        while True:
+            if not self._active:
+                # Sleep until a profiled request starts
+                self._wake.wait()
+                self._wake.clear()
+            time.sleep(self.interval)
+            with self._lock:
+                active = dict(self._active)
+            if not active:
+                continue
+            frames = sys._current_frames()
+            samples = []
+            for ident, route in active.items():
+                frame = frames.get(ident)
+                if frame is not None:
+                    samples.append((route, _collapse(frame)))
+            del frames
+            with self._lock:
+                for route, stack in samples:
+                    stacks = self._results.setdefault(route, {})
+                    stacks[stack] = stacks.get(stack, 0) + 1
+
+
+def _collapse(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def _label(function):
+    filename, line, name = function
+    if filename == '~':
+        # Built-ins are recorded as ('~', 0, '<built-in method ...>')
+        return name
+    return f"{name} ({os.path.basename(filename)}:{line})"
@@ -0,0 +1,199 @@
+"""
+Retention for chat history: archive idle sessions, delete them, reclaim space.
+
+A session is idle when neither its ``last_activity`` nor any of its messages
+is newer than the cutoff; messages whose session row is gone count as a
+session too. Idle sessions are processed in chunks. A chunk's rows are read
+from one snapshot, appended to gzipped NDJSON files under
+``archive_dir/YYYY-MM-DD/`` (by the session's last activity) and synced to
+disk without holding the write lock. Only then does a short write
+transaction delete the sessions that are still idle. A session that came
+back in between, or a crash before the delete, leaves rows both archived and
+live; a later run archives them again, so the archive may hold duplicates
+but never misses a row.
+
+Deleted rows leave free pages behind; with ``auto_vacuum = INCREMENTAL``
+``reclaim`` returns them to the filesystem. Databases created before that
+setting need one full ``VACUUM`` to switch (``enable_incremental_vacuum``).
+"""
+
+import gzip
+import json
+import os
+import time
+
+SESSION_FIELDS = ('session_id', 'created_at', 'last_activity', 'user_agent', 'ip_address')
+AUTO_VACUUM_MODES = {0: 'none', 1: 'full', 2: 'incremental'}
+
+
+def find_idle_sessions(conn, cutoff):
+    """(session_id, last seen) of every idle session, oldest first"""
+    return conn.execute("""
+        SELECT session_id, last_activity AS last_seen FROM sessions s
+        WHERE last_activity < :cutoff
+          AND NOT EXISTS (
+              SELECT 1 FROM messages m WHERE m.session_id = s.session_id AND m.timestamp >= :cutoff
+          )
+        UNION ALL
+        SELECT session_id, MAX(timestamp) FROM messages
+        WHERE session_id NOT IN (SELECT session_id FROM sessions)
+        GROUP BY session_id
+        HAVING MAX(timestamp) < :cutoff
+        ORDER BY last_seen
+    """, {'cutoff': cutoff}).fetchall()
+
+
+def plan(conn, cutoff):
+    """What a run would archive, without writing anything"""
+    idle = find_idle_sessions(conn, cutoff)
+    messages = content_bytes = 0
+    for chunk in _chunks([session_id for session_id, _ in idle], 500):
+        count, size = conn.execute(f"""
+            SELECT COUNT(*), COALESCE(SUM(LENGTH(content)), 0) FROM messages
+            WHERE session_id IN ({_placeholders(chunk)})
+        """, chunk).fetchone()
+        messages += count
+        content_bytes += size
+    return {
+        'sessions': len(idle),
+        'messages': messages,
+        'content_bytes': content_bytes,
+        'oldest': idle[0][1] if idle else None,
+        'newest': idle[-1][1] if idle else None
+    }
+
+
+def archive_idle_sessions(conn, cutoff, archive_dir, message_fields, batch_sessions=200, label='chat',
+                          run_id=None):
+    """Archive and delete every idle session; returns counts, throughput and the longest write lock
+
+    ``message_fields`` are the message columns written to the archive (the
+    export format), ``label`` names this database in the file names and
+    ``run_id`` keeps the files of separate runs apart.
+    """
+    run_id = run_id or time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())
+    message_columns = ', '.join(message_fields)
+    session_columns = ', '.join(SESSION_FIELDS)
+    started = time.perf_counter()
+    idle = find_idle_sessions(conn, cutoff)
+    report = {
+        'sessions': 0, 'messages': 0, 'kept': 0, 'chunks': 0,
+        'archive_bytes': 0, 'files': set(), 'max_lock_ms': 0.0
+    }
+
+    for chunk in _chunks(idle, batch_sessions):
+        last_seen = dict(chunk)
+        ids = list(last_seen)
+
+        # Read the chunk from one snapshot
+        conn.execute("BEGIN")
+        try:
+            sessions = conn.execute(f"""
+                SELECT {session_columns} FROM sessions WHERE session_id IN ({_placeholders(ids)})
+            """, ids).fetchall()
+            messages = conn.execute(f"""
+                SELECT {message_columns} FROM messages WHERE session_id IN ({_placeholders(ids)})
+                ORDER BY session_id, timestamp, id
+            """, ids).fetchall()
+        finally:
+            conn.rollback()
+
+        partitions = {}
+        for fields, kind, rows in ((SESSION_FIELDS, 'sessions', sessions), (message_fields, 'messages', messages)):
+            for row in rows:
+                record = dict(zip(fields, row))
+                partitions.setdefault((_day(last_seen[record['session_id']]), kind), []).append(record)
+        for (day, kind), records in partitions.items():
+            path = os.path.join(archive_dir, day, f"{kind}-{run_id}-{label}.ndjson.gz")
+            report['archive_bytes'] += _append_gzip(path, records)
+            report['files'].add(path)
+
+        # Delete what is archived, unless the session came back meanwhile
+        lock_started = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            active = {row[0] for row in conn.execute(f"""
+                SELECT session_id FROM sessions
+                WHERE session_id IN ({_placeholders(ids)}) AND last_activity >= ?
+                UNION
+                SELECT session_id FROM messages
+                WHERE session_id IN ({_placeholders(ids)}) AND timestamp >= ?
+            """, ids + [cutoff] + ids + [cutoff])}
+            idle_ids = [session_id for session_id in ids if session_id not in active]
+            deleted = 0
+            if idle_ids:
+                deleted = conn.execute(
+                    f"DELETE FROM messages WHERE session_id IN ({_placeholders(idle_ids)})", idle_ids
+                ).rowcount
+                conn.execute(f"DELETE FROM sessions WHERE session_id IN ({_placeholders(idle_ids)})", idle_ids)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        report['sessions'] += len(idle_ids)
+        report['messages'] += deleted
+        report['kept'] += len(active)
+        report['chunks'] += 1
+        report['max_lock_ms'] = max(report['max_lock_ms'], (time.perf_counter() - lock_started) * 1000)
+
+    seconds = time.perf_counter() - started
+    report['files'] = sorted(report['files'])
+    report['max_lock_ms'] = round(report['max_lock_ms'], 2)
+    report['seconds'] = round(seconds, 3)
+    report['sessions_per_second'] = round(report['sessions'] / seconds, 1) if seconds else None
+    report['messages_per_second'] = round(report['messages'] / seconds, 1) if seconds else None
+    return report
+
+
+def reclaim(conn, max_pages=0):
+    """Return free pages to the filesystem with incremental vacuum (all of them when max_pages is 0)"""
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    free_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    if mode == 2 and free_before:
+        # The pragma frees one page per step; execute() steps it only once,
+        # executescript() runs it to completion
+        conn.executescript(f"PRAGMA incremental_vacuum({int(max_pages)})" if max_pages else "PRAGMA incremental_vacuum")
+        # Pages dropped from the end of the file reach the disk at checkpoint
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    free_after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return {
+        'auto_vacuum': AUTO_VACUUM_MODES.get(mode, mode),
+        'free_pages': free_after,
+        'reclaimed_pages': free_before - free_after,
+        'reclaimed_bytes': (free_before - free_after) * page_size
+    }
+
+
+def enable_incremental_vacuum(conn):
+    """Switch an existing database to incremental auto-vacuum; rewrites the whole file once"""
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+
+
+def _append_gzip(path, records):
+    """Append records as a new gzip member (zcat reads all members); returns the bytes written"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'ab') as raw:
+        offset = raw.tell()
+        with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as archive:
+            archive.write(''.join(json.dumps(record) + '\n' for record in records).encode('utf-8'))
+        raw.flush()
+        # On disk before the rows are deleted
+        os.fsync(raw.fileno())
+        return raw.tell() - offset
+
+
+def _day(timestamp):
+    return (timestamp or 'unknown')[:10]
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _placeholders(values):
+    return ', '.join('?' * len(values))
@@ -0,0 +1,148 @@
+"""
+Coalesced session bookkeeping.
+
+Instead of an INSERT for every new session and an UPDATE of
+``sessions.last_activity`` on every request, requests only record the session
+in memory. A background thread writes everything recorded since the previous
+flush in one transaction every ``flush_seconds``: new sessions with
+``INSERT OR IGNORE`` and the latest activity time per session with one
+``UPDATE`` each, no matter how many requests the session made in between.
+"""
+
+import logging
+import threading
+import time
+
+from message_writer import utc_timestamp
+
+logger = logging.getLogger(__name__)
+
+
+class SessionTracker:
+    """Buffers session creation and last-activity timestamps for bulk flushing"""
+
+    def __init__(self, connect, flush_seconds=5.0, known_ttl_seconds=300.0):
+        self.connect = connect
+        self.flush_seconds = flush_seconds
+        self.known_ttl = known_ttl_seconds
+        self.sessions_created = 0
+        self.touches = 0
+        self.touches_coalesced = 0
+        self.rows_flushed = 0
+        self.flushes = 0
+        self._new = {}
+        self._activity = {}
+        # session_id -> (timestamp last recorded, monotonic expiry); lets
+        # repeat hits within the same second skip the buffer update
+        self._known = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='session-tracker', daemon=True)
+
+    def start(self):
+        """Start the background flush thread"""
+        self._thread.start()
+        return self
+
+    def created(self, session_id, user_agent, ip_address):
+        """Record a brand-new session"""
+        timestamp = utc_timestamp()
+        with self._lock:
+            self._new[session_id] = (session_id, timestamp, timestamp, user_agent, ip_address)
+            self._known[session_id] = (timestamp, time.monotonic() + self.known_ttl)
+            self.sessions_created += 1
+
+    def touch(self, session_id):
+        """Record activity for an existing session"""
+        timestamp = utc_timestamp()
+        known = self._known.get(session_id)
+        if known is not None and known[0] == timestamp:
+            with self._lock:
+                self.touches += 1
+                self.touches_coalesced += 1
+            return
+        with self._lock:
+            self.touches += 1
+            self._activity[session_id] = timestamp
+            self._known[session_id] = (timestamp, time.monotonic() + self.known_ttl)
+
+    def pending(self, session_id):
+        """Return (created_at, last_activity) not yet flushed for session_id, or None"""
+        with self._lock:
+            new = self._new.get(session_id)
+            activity = self._activity.get(session_id)
+        if new is None and activity is None:
+            return None
+        return (new[1] if new else None, activity or new[2])
+
+    def forget(self, session_id):
+        """Drop buffered state for a session that is being removed"""
+        with self._lock:
+            self._new.pop(session_id, None)
+            self._activity.pop(session_id, None)
+            self._known.pop(session_id, None)
+
+    def flush(self):
+        """Write all buffered sessions and activity in one transaction"""
+        with self._flush_lock:
+            with self._lock:
+                new, self._new = self._new, {}
+                activity, self._activity = self._activity, {}
+                now = time.monotonic()
+                self._known = {k: v for k, v in self._known.items() if v[1] > now}
+            if not new and not activity:
+                return 0
+
+            conn = self.connect()
+            try:
+                with conn:
+                    conn.executemany("""
+                        INSERT OR IGNORE INTO sessions (session_id, created_at, last_activity, user_agent, ip_address)
+                        VALUES (?, ?, ?, ?, ?)
+                    """, list(new.values()))
+                    conn.executemany("""
+                        UPDATE sessions
+                        SET last_activity = ?
+                        WHERE session_id = ? AND last_activity < ?
+                    """, [(ts, sid, ts) for sid, ts in activity.items()])
+            except Exception as e:
+                logger.error(f"Session activity flush failed: {e}")
+                # Put the rows back so the next flush retries them
+                with self._lock:
+                    for sid, row in new.items():
+                        self._new.setdefault(sid, row)
+                    for sid, ts in activity.items():
+                        self._activity.setdefault(sid, ts)
+                return 0
+            finally:
+                conn.close()
+
+            flushed = len(new) + len(activity)
+            self.rows_flushed += flushed
+            self.flushes += 1
+            return flushed
+
+    def stop(self):
+        """Stop the background thread and flush whatever is buffered"""
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(self.flush_seconds + 5)
+        self.flush()
+
+    def stats(self):
+        """Return buffer sizes and counters"""
+        with self._lock:
+            buffered = len(self._new) + len(self._activity)
+        return {
+            'buffered': buffered,
+            'sessions_created': self.sessions_created,
+            'touches': self.touches,
+            'touches_coalesced': self.touches_coalesced,
+            'rows_flushed': self.rows_flushed,
+            'flushes': self.flushes
+        }
+
+    def _run(self):
+        while not self._stop.wait(self.flush_seconds):
+            self.flush()
@@ -0,0 +1,182 @@
+"""
+Session-sharded SQLite storage.
+
+Every session lives in exactly one of ``shard_count`` database files, chosen
+by a CRC32 of its id, so sessions on different shards never contend for the
+same write lock and several worker processes can write in parallel. With one
+shard the only file is the configured database path itself, so an unsharded
+deployment keeps using ``chat.db`` unchanged.
+
+``split_database`` is the one-off migration: it copies an existing database
+into shard files, sessions and messages by session. Intent rollups follow
+their messages; the part left over from cleared history goes to shard 0, so
+the cross-shard sum still matches the source.
+
+Message ids come from each file's own AUTOINCREMENT sequence, so
+``reserve_id_range`` starts shard N's sequence at ``N * SHARD_ID_STRIDE``;
+ids then stay unique across shards and can break ties when shards are merged.
+"""
+
+import functools
+import os
+import zlib
+
+# 2**40 ids per shard before ranges would meet
+SHARD_ID_STRIDE = 1 << 40
+
+
+def shard_index(session_id, shard_count):
+    """Shard of a session; stable across processes and restarts"""
+    if shard_count <= 1:
+        return 0
+    return zlib.crc32(session_id.encode('utf-8')) % shard_count
+
+
+def reserve_id_range(conn, index, table='messages', base=0):
+    """Move the AUTOINCREMENT sequence of ``table`` up to the start of shard ``index``'s id range
+
+    ``base`` raises the start further (the split passes the source's last id,
+    which other shards may hold). Never moves a sequence down, so it is safe
+    to run on every start.
+    """
+    floor = max(index * SHARD_ID_STRIDE, base)
+    if not floor:
+        return
+    with conn:
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+        if row is None:
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, floor))
+        elif row[0] < floor:
+            conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = ?", (floor, table))
+
+
+@functools.lru_cache(maxsize=None)
+def shard_paths(db_path, shard_count):
+    """Database file of each shard: db_path itself for one shard, else chat.shard0.db, chat.shard1.db, ..."""
+    if shard_count <= 1:
+        return (db_path,)
+    root, ext = os.path.splitext(db_path)
+    return tuple(f"{root}.shard{index}{ext or '.db'}" for index in range(shard_count))
+
+
+def split_database(source, targets, connect, init_schema):
+    """Copy the sessions, messages and rollups of ``source`` into new shard databases
+
+    ``targets`` are the shard files (missing or still empty), ``connect(path)``
+    opens a connection and ``init_schema(conn)`` creates tables, indexes and
+    counter triggers, so the counters and rollups of each shard are built as
+    rows arrive. Copied messages keep their ids; new ones continue in the
+    shard's own id range. Returns one {'path', 'sessions', 'messages'} dict
+    per shard.
+    """
+    for path in targets:
+        if os.path.exists(path) and _has_rows(connect, path):
+            raise FileExistsError(f"Shard file {path} already holds sessions or messages")
+
+    shard_count = len(targets)
+    report = []
+    for index, path in enumerate(targets):
+        conn = connect(path)
+        try:
+            init_schema(conn)
+            conn.create_function(
+                'shard_of', 1, lambda session_id: shard_index(session_id, shard_count), deterministic=True
+            )
+            conn.execute("ATTACH DATABASE ? AS src", (source,))
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("""
+                INSERT INTO sessions (session_id, created_at, last_activity, user_agent, ip_address)
+                SELECT session_id, created_at, last_activity, user_agent, ip_address
+                FROM src.sessions WHERE shard_of(session_id) = ?
+            """, (index,))
+            conn.execute("""
+                INSERT INTO messages (id, session_id, role, content, timestamp, intent, confidence, created_at)
+                SELECT id, session_id, role, content, timestamp, intent, confidence, created_at
+                FROM src.messages WHERE shard_of(session_id) = ?
+                ORDER BY id
+            """, (index,))
+            conn.commit()
+            # Ids up to the source's last one may be on any shard, so none starts below it
+            last_id = conn.execute("""
+                SELECT MAX(seq) FROM (
+                    SELECT seq FROM src.sqlite_sequence WHERE name = 'messages'
+                    UNION ALL SELECT MAX(id) FROM src.messages
+                )
+            """).fetchone()[0] or 0
+            conn.execute("DETACH DATABASE src")
+            reserve_id_range(conn, index, base=last_id)
+
+            report.append({
+                'path': path,
+                'sessions': conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0],
+                'messages': conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+            })
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    _carry_over_rollups(source, targets, connect)
+    return report
+
+
+def _carry_over_rollups(source, targets, connect):
+    """Add the source rollups not explained by the copied messages to shard 0
+
+    The insert trigger built each shard's rollups from its own messages; the
+    source buckets also count messages that were cleared since, and that
+    remainder has no session to follow, so shard 0 keeps it. Cross-shard
+    queries sum every shard, which adds up to the source's totals again.
+    """
+    conn = connect(source)
+    try:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if 'intent_rollups' not in tables:
+            return
+        remainder = {
+            tuple(row[:3]): [row[3], row[4]]
+            for row in conn.execute(
+                "SELECT granularity, bucket_start, intent, count, sum_confidence FROM intent_rollups"
+            )
+        }
+    finally:
+        conn.close()
+
+    for path in targets:
+        conn = connect(path)
+        try:
+            for row in conn.execute(
+                "SELECT granularity, bucket_start, intent, count, sum_confidence FROM intent_rollups"
+            ):
+                bucket = remainder.get(tuple(row[:3]))
+                if bucket is not None:
+                    bucket[0] -= row[3]
+                    bucket[1] -= row[4]
+        finally:
+            conn.close()
+
+    conn = connect(targets[0])
+    try:
+        with conn:
+            conn.executemany("""
+                INSERT INTO intent_rollups (granularity, bucket_start, intent, count, sum_confidence)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(granularity, bucket_start, intent) DO UPDATE
+                SET count = count + excluded.count, sum_confidence = sum_confidence + excluded.sum_confidence
+            """, [key + tuple(values) for key, values in remainder.items() if values[0] > 0])
+    finally:
+        conn.close()
+
+
+def _has_rows(connect, path):
+    conn = connect(path)
+    try:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        return any(
+            conn.execute(f"SELECT EXISTS (SELECT 1 FROM {table})").fetchone()[0]
+            for table in ('sessions', 'messages') if table in tables
+        )
+    finally:
+        conn.close()
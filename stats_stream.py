@@ -0,0 +1,287 @@
+"""
+Shared producer for live stats pushed over Server-Sent Events.
+
+One background thread serves every open dashboard. Each tick it asks SQLite
+for ``PRAGMA data_version``, which only changes when another connection has
+committed. Idle ticks therefore cost a single pragma (one per shard file when
+storage is sharded), however many clients are connected. When something did
+change, global stats are computed once. A commit anywhere bumps the version,
+so with a ``session_markers`` callback each watched session's stats are only
+recomputed when its marker moved; without one every watched session is
+recomputed. Only the keys that differ from what each session was last sent
+are pushed to its subscribers.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def format_event(event, data):
+    """Encode one SSE message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def diff(previous, current):
+    """Keys of current whose values differ from previous"""
+    if previous is None:
+        return dict(current)
+    return {key: value for key, value in current.items() if previous.get(key) != value}
+
+
+class SubscriberQueue(queue.Queue):
+    """Event queue of a thread-based (WSGI) subscriber"""
+
+    def clear(self):
+        with self.mutex:
+            self.queue.clear()
+
+
+class AsyncSubscriberQueue:
+    """Event queue of an asyncio subscriber
+
+    The producer thread never touches the asyncio queue directly; it schedules
+    puts on the subscriber's event loop and tracks the backlog itself so a
+    full queue is still reported synchronously with ``queue.Full``.
+    """
+
+    def __init__(self, loop, maxsize):
+        self.loop = loop
+        self.maxsize = maxsize
+        self._queue = asyncio.Queue()
+        self._backlog = 0
+        self._lock = threading.Lock()
+
+    def put_nowait(self, message):
+        with self._lock:
+            if message is not None and self._backlog >= self.maxsize:
+                raise queue.Full
+            self._backlog += 1
+        self.loop.call_soon_threadsafe(self._queue.put_nowait, message)
+
+    def clear(self):
+        self.loop.call_soon_threadsafe(self._drain)
+
+    async def get(self, timeout):
+        """Next message; raises asyncio.TimeoutError after ``timeout`` seconds"""
+        message = await asyncio.wait_for(self._queue.get(), timeout)
+        with self._lock:
+            self._backlog -= 1
+        return message
+
+    def _drain(self):
+        while not self._queue.empty():
+            self._queue.get_nowait()
+            with self._lock:
+                self._backlog -= 1
+
+
+class StatsBroadcaster:
+    """Polls for changes once and fans stat deltas out to every subscriber"""
+
+    def __init__(self, connect, global_stats, session_stats, session_markers=None, interval=1.0,
+                 heartbeat=15.0, max_subscribers=100, subscriber_queue_size=50):
+        self.connect = connect
+        self.global_stats = global_stats
+        self.session_stats = session_stats
+        # session_markers(session_ids) -> {session_id: marker}; a marker changes
+        # whenever that session's stats do
+        self.session_markers = session_markers
+        self.interval = interval
+        self.heartbeat = heartbeat
+        self.max_subscribers = max_subscribers
+        self.subscriber_queue_size = subscriber_queue_size
+        self.ticks = 0
+        self.recomputes = 0
+        self.session_recomputes = 0
+        self.dropped = 0
+        self._ids = itertools.count(1)
+        self._subscribers = {}
+        self._fresh = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stats-broadcaster', daemon=True)
+
+    def start(self):
+        """Start the producer thread"""
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the producer and end every open stream"""
+        self._stop.set()
+        self._wake.set()
+        with self._lock:
+            for _, events in self._subscribers.values():
+                self._offer(events, None)
+
+    def subscribe(self, session_id, events=None):
+        """Register a subscriber; returns (subscriber id, event queue) or None when at capacity
+
+        ``events`` defaults to a blocking SubscriberQueue; asyncio callers pass
+        an AsyncSubscriberQueue bound to their loop.
+        """
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            subscriber_id = next(self._ids)
+            if events is None:
+                events = SubscriberQueue(maxsize=self.subscriber_queue_size)
+            self._subscribers[subscriber_id] = (session_id, events)
+            self._fresh.add(subscriber_id)
+        # New subscribers get a full snapshot on the next tick, which we run now
+        self._wake.set()
+        return subscriber_id, events
+
+    def unsubscribe(self, subscriber_id):
+        """Remove a subscriber"""
+        with self._lock:
+            self._subscribers.pop(subscriber_id, None)
+            self._fresh.discard(subscriber_id)
+
+    def subscriber_count(self):
+        """Number of open streams"""
+        return len(self._subscribers)
+
+    def stream(self, subscriber_id, events):
+        """Generator of SSE text for one subscriber, with heartbeats while idle"""
+        try:
+            yield f"retry: {int(self.interval * 1000) * 3}\n\n"
+            while True:
+                try:
+                    message = events.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    yield ": heartbeat\n\n"
+                    continue
+                if message is None:
+                    break
+                yield message
+        finally:
+            self.unsubscribe(subscriber_id)
+
+    async def stream_async(self, subscriber_id, events):
+        """Async counterpart of stream() for an AsyncSubscriberQueue"""
+        try:
+            yield f"retry: {int(self.interval * 1000) * 3}\n\n"
+            while True:
+                try:
+                    message = await events.get(self.heartbeat)
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+                    continue
+                if message is None:
+                    break
+                yield message
+        finally:
+            self.unsubscribe(subscriber_id)
+
+    def stats(self):
+        """Return subscriber and producer counters"""
+        return {
+            'subscribers': len(self._subscribers),
+            'max_subscribers': self.max_subscribers,
+            'ticks': self.ticks,
+            'recomputes': self.recomputes,
+            'session_recomputes': self.session_recomputes,
+            'dropped': self.dropped
+        }
+
+    def _offer(self, events, message):
+        """Non-blocking put; False when the subscriber's queue is full"""
+        try:
+            events.put_nowait(message)
+            return True
+        except queue.Full:
+            return False
+
+    def _run(self):
+        # connect() returns one connection, or a list with one per shard file
+        conns = self.connect()
+        if not isinstance(conns, (list, tuple)):
+            conns = [conns]
+        last_version = None
+        last_global = None
+        last_sessions = {}
+        last_markers = {}
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            self.ticks += 1
+
+            with self._lock:
+                subscribers = dict(self._subscribers)
+                fresh, self._fresh = self._fresh, set()
+            if not subscribers:
+                last_sessions = {}
+                last_markers = {}
+                continue
+
+            try:
+                version = tuple(conn.execute("PRAGMA data_version").fetchone()[0] for conn in conns)
+                changed = version != last_version
+                last_version = version
+
+                if changed or last_global is None:
+                    self.recomputes += 1
+                    current_global = self.global_stats()
+                    session_ids = {session_id for session_id, _ in subscribers.values()}
+                    markers = self.session_markers(session_ids) if self.session_markers else {}
+                    current_sessions = {}
+                    for sid in session_ids:
+                        if sid in last_sessions and sid in markers and markers[sid] == last_markers.get(sid):
+                            current_sessions[sid] = last_sessions[sid]
+                        else:
+                            self.session_recomputes += 1
+                            current_sessions[sid] = self.session_stats(sid)
+                    last_markers = markers
+                else:
+                    current_global = last_global
+                    current_sessions = dict(last_sessions)
+                    # Sessions nobody was watching at the last recompute
+                    for session_id, _ in subscribers.values():
+                        if session_id not in current_sessions:
+                            self.session_recomputes += 1
+                            current_sessions[session_id] = self.session_stats(session_id)
+            except Exception as e:
+                logger.error(f"Stats broadcaster failed to compute stats: {e}")
+                continue
+
+            global_delta = diff(last_global, current_global)
+            session_deltas = {
+                sid: diff(last_sessions.get(sid), stats) for sid, stats in current_sessions.items()
+            }
+
+            for subscriber_id, (session_id, events) in subscribers.items():
+                if subscriber_id in fresh:
+                    messages = [
+                        format_event('global', current_global),
+                        format_event('session', current_sessions[session_id])
+                    ]
+                else:
+                    messages = []
+                    if global_delta:
+                        messages.append(format_event('global', global_delta))
+                    if session_deltas.get(session_id):
+                        messages.append(format_event('session', session_deltas[session_id]))
+
+                for message in messages:
+                    if not self._offer(events, message):
+                        # A client this far behind is dropped; the browser reconnects
+                        self.dropped += 1
+                        self.unsubscribe(subscriber_id)
+                        events.clear()
+                        self._offer(events, None)
+                        break
+
+            last_global = current_global
+            last_sessions = current_sessions
+        for conn in conns:
+            conn.close()
@@ -0,0 +1,312 @@
+"""
+Example-based intent classifier over an in-memory vector index.
+
+Labelled utterances are embedded once and stored as rows of a float32 matrix
+of L2-normalised vectors. A query costs one encode plus one matrix-vector
+product: the dot products are the cosine similarities, the top ``k`` rows are
+picked with ``argpartition`` and their labels vote, weighted by similarity.
+
+An index is a directory::
+
+    meta.json       encoder spec, dimension, label names and committed row count
+    vectors.f32     row-major float32 matrix
+    labels.i32      label id of each row
+    offsets.u64     byte offset of each row's line in examples.jsonl
+    examples.jsonl  one {"label", "text"} line per row
+
+Opening an index maps the three binary files with ``numpy.memmap`` instead of
+reading them, so it is usable immediately whatever its size; example texts
+are only read for the neighbours a query returns. ``add`` appends to the end
+of every file and then rewrites ``meta.json`` atomically, so existing rows are
+never re-encoded and a crash mid-append leaves the previous index intact.
+
+The default ``hashing`` encoder needs nothing beyond NumPy but only captures
+word overlap; pass a sentence-embedding model (e.g.
+``--encoder sentence-transformers/all-MiniLM-L6-v2``) for paraphrase-level
+matching.
+
+    python vector_index.py build /tmp/intents            # from airline_test.TEST_CASES
+    python vector_index.py add /tmp/intents Refund "Where is my money?"
+    python vector_index.py query /tmp/intents "I want my money back" -k 5
+"""
+
+import argparse
+import json
+import os
+import re
+import zlib
+
+import numpy as np
+
+DEFAULT_ENCODER = os.environ.get('VECTOR_ENCODER', 'hashing:512')
+
+META_FILE = 'meta.json'
+VECTORS_FILE = 'vectors.f32'
+LABELS_FILE = 'labels.i32'
+OFFSETS_FILE = 'offsets.u64'
+EXAMPLES_FILE = 'examples.jsonl'
+
+_WORD = re.compile(r"[a-z0-9']+")
+# Function words carry no intent and would otherwise dominate short utterances
+_STOPWORDS = frozenset(
+    "a about an any are can do for get have how i in is it me my need of on "
+    "the there this to want what with you your".split()
+)
+
+
+class HashingEncoder:
+    """Dependency-free encoder: signed feature hashing of words, word pairs and character trigrams"""
+
+    def __init__(self, dim=512):
+        self.dim = dim
+        self.spec = f"hashing:{dim}"
+
+    def features(self, text):
+        words = [word for word in _WORD.findall(text.lower()) if word not in _STOPWORDS]
+        features = list(words)
+        features += [f"{a} {b}" for a, b in zip(words, words[1:])]
+        for word in words:
+            padded = f"<{word}>"
+            features += [padded[i:i + 3] for i in range(len(padded) - 2)]
+        return features
+
+    def encode(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self.features(text):
+                digest = zlib.crc32(feature.encode('utf-8'))
+                vectors[row, digest % self.dim] += 1.0 if digest & 0x80000000 else -1.0
+        return normalize(vectors)
+
+
+class TransformerEncoder:
+    """Mean-pooled sentence embeddings from a Hugging Face encoder model (loaded lazily)"""
+
+    def __init__(self, model):
+        self.spec = model
+        self._tokenizer = None
+        self._model = None
+        self.dim = None
+
+    def _load(self):
+        from transformers import AutoModel, AutoTokenizer
+
+        local = os.path.isdir(self.spec)
+        self._tokenizer = AutoTokenizer.from_pretrained(self.spec, local_files_only=local)
+        self._model = AutoModel.from_pretrained(self.spec, local_files_only=local).eval()
+        self.dim = self._model.config.hidden_size
+
+    def encode(self, texts):
+        import torch
+
+        if self._model is None:
+            self._load()
+        batch = self._tokenizer(list(texts), padding=True, truncation=True, return_tensors='pt')
+        with torch.no_grad():
+            hidden = self._model(**batch).last_hidden_state
+        mask = batch['attention_mask'].unsqueeze(-1).to(hidden.dtype)
+        pooled = (hidden * mask).sum(1) / mask.sum(1).clamp(min=1)
+        return normalize(pooled.numpy().astype(np.float32))
+
+
+def get_encoder(spec=DEFAULT_ENCODER):
+    """Encoder from a spec: 'hashing[:dim]' or a model name/directory"""
+    if spec.startswith('hashing'):
+        _, _, dim = spec.partition(':')
+        return HashingEncoder(int(dim) if dim else 512)
+    return TransformerEncoder(spec)
+
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class VectorIndex:
+    """Append-only, memory-mapped matrix of labelled example embeddings"""
+
+    def __init__(self, path, encoder=None):
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as f:
+            self.meta = json.load(f)
+        self.encoder = encoder or get_encoder(self.meta['encoder'])
+        self.dim = self.meta['dim']
+        self._load()
+
+    @classmethod
+    def create(cls, path, encoder_spec=DEFAULT_ENCODER):
+        """Create an empty index directory"""
+        encoder = get_encoder(encoder_spec)
+        dim = encoder.dim
+        if dim is None:
+            # Model encoders only know their width once loaded
+            dim = encoder.encode(["dimension probe"]).shape[1]
+        os.makedirs(path, exist_ok=True)
+        for name in (VECTORS_FILE, LABELS_FILE, OFFSETS_FILE, EXAMPLES_FILE):
+            open(os.path.join(path, name), 'wb').close()
+        _write_meta(path, {'encoder': encoder.spec, 'dim': dim, 'count': 0, 'labels': []})
+        return cls(path, encoder)
+
+    def __len__(self):
+        return self.meta['count']
+
+    def _load(self):
+        count = self.meta['count']
+        self.label_names = list(self.meta['labels'])
+        self.vectors = self._map(VECTORS_FILE, np.float32, (count, self.dim))
+        self.label_ids = self._map(LABELS_FILE, np.int32, (count,))
+        self.offsets = self._map(OFFSETS_FILE, np.uint64, (count,))
+
+    def _map(self, name, dtype, shape):
+        if not shape[0]:
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(os.path.join(self.path, name), dtype=dtype, mode='r', shape=shape)
+
+    def label(self, row):
+        return self.label_names[self.label_ids[row]]
+
+    def text(self, row):
+        """Read one example's text from examples.jsonl"""
+        with open(os.path.join(self.path, EXAMPLES_FILE), 'rb') as f:
+            f.seek(int(self.offsets[row]))
+            return json.loads(f.readline())['text']
+
+    def add(self, texts, labels):
+        """Embed and append examples; only the new rows are encoded"""
+        if len(texts) != len(labels):
+            raise ValueError("texts and labels must have the same length")
+        if not texts:
+            return 0
+        vectors = self.encoder.encode(texts).astype(np.float32)
+        count = self.meta['count']
+        label_names = list(self.meta['labels'])
+        label_index = {name: index for index, name in enumerate(label_names)}
+        for label in labels:
+            if label not in label_index:
+                label_index[label] = len(label_names)
+                label_names.append(label)
+        label_ids = np.array([label_index[label] for label in labels], dtype=np.int32)
+
+        # Lines go after the last committed one, dropping any tail left by an interrupted append
+        lines_end = 0
+        if count:
+            lines_end = int(self.offsets[-1]) + len(self._line_at(int(self.offsets[-1])))
+        offsets = []
+        with open(os.path.join(self.path, EXAMPLES_FILE), 'r+b') as f:
+            f.seek(lines_end)
+            f.truncate()
+            for text, label in zip(texts, labels):
+                offsets.append(f.tell())
+                f.write((json.dumps({'label': label, 'text': text}) + '\n').encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+
+        self._append(VECTORS_FILE, count * self.dim * 4, vectors)
+        self._append(LABELS_FILE, count * 4, label_ids)
+        self._append(OFFSETS_FILE, count * 8, np.array(offsets, dtype=np.uint64))
+
+        # Committing the new count is what makes the rows visible
+        self.meta['count'] = count + len(texts)
+        self.meta['labels'] = label_names
+        _write_meta(self.path, self.meta)
+        self._load()
+        return len(texts)
+
+    def _line_at(self, offset):
+        with open(os.path.join(self.path, EXAMPLES_FILE), 'rb') as f:
+            f.seek(offset)
+            return f.readline()
+
+    def _append(self, name, committed_bytes, array):
+        with open(os.path.join(self.path, name), 'r+b') as f:
+            f.seek(committed_bytes)
+            f.truncate()
+            f.write(array.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def search(self, query_vectors, k=5):
+        """Top-k rows for each query vector: (indices, similarities), best first"""
+        similarities = np.asarray(query_vectors, dtype=np.float32) @ self.vectors.T
+        k = min(k, len(self))
+        top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(similarities, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+    def classify_batch(self, texts, k=5, neighbors=True):
+        """Classify texts; each result has labels/scores ranked by similarity-weighted votes and the neighbours"""
+        if not len(self):
+            raise ValueError("Index is empty")
+        indices, similarities = self.search(self.encoder.encode(texts), k)
+        results = []
+        for row_indices, row_scores in zip(indices, similarities):
+            votes = {}
+            for index, score in zip(row_indices, row_scores):
+                label = self.label(index)
+                votes[label] = votes.get(label, 0.0) + max(float(score), 0.0)
+            ranked = sorted(votes.items(), key=lambda item: item[1], reverse=True)
+            total = sum(votes.values()) or 1.0
+            results.append({
+                'labels': [label for label, _ in ranked],
+                'scores': [round(vote / total, 4) for _, vote in ranked],
+                'similarity': round(float(row_scores[0]), 4),
+                'neighbors': [
+                    {'label': self.label(index), 'text': self.text(index), 'similarity': round(float(score), 4)}
+                    for index, score in zip(row_indices, row_scores)
+                ] if neighbors else []
+            })
+        return results
+
+    def classify(self, text, k=5, neighbors=True):
+        return self.classify_batch([text], k, neighbors)[0]
+
+
+def _write_meta(path, meta):
+    temp = os.path.join(path, META_FILE + '.tmp')
+    with open(temp, 'w') as f:
+        json.dump(meta, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, os.path.join(path, META_FILE))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedding nearest-neighbour intent index")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help="Create an index from the airline_test.py corpus")
+    build.add_argument('path')
+    build.add_argument('--encoder', default=DEFAULT_ENCODER, help="'hashing[:dim]' or a model name/directory")
+
+    add = commands.add_parser('add', help="Append labelled examples")
+    add.add_argument('path')
+    add.add_argument('label')
+    add.add_argument('texts', nargs='+')
+
+    query = commands.add_parser('query', help="Classify texts")
+    query.add_argument('path')
+    query.add_argument('texts', nargs='+')
+    query.add_argument('-k', type=int, default=5)
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        from airline_test import TEST_CASES
+
+        index = VectorIndex.create(args.path, args.encoder)
+        index.add([text for text, _ in TEST_CASES], [label for _, label in TEST_CASES])
+        print(f"Indexed {len(index)} examples ({index.encoder.spec}, dim {index.dim}) in {args.path}")
+    elif args.command == 'add':
+        index = VectorIndex(args.path)
+        index.add(args.texts, [args.label] * len(args.texts))
+        print(f"Index now holds {len(index)} examples")
+    else:
+        index = VectorIndex(args.path)
+        for text, result in zip(args.texts, index.classify_batch(args.texts, args.k)):
+            print(f"{text!r} -> {result['labels'][0]} ({result['scores'][0]:.2f}, nearest {result['similarity']:.2f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""
+Loading of the zero-shot intent model, with a fast-start CPU mode.
+
+Nothing heavy is imported at module level: ``transformers`` (and ``torch``)
+are only imported when a model is actually loaded, so importing this module
+costs milliseconds. The model can come from the Hugging Face hub or from a
+local directory (``ZERO_SHOT_MODEL=/path/to/dir``, see ``--download``), in
+which case no network access is attempted. With ``ZERO_SHOT_QUANTIZE=1`` the
+model's ``Linear`` layers are converted to int8 with dynamic quantization,
+which shrinks them about 4x and speeds up CPU inference; ``warm_up`` runs one
+throwaway classification so the first real query does not pay for lazy
+initialisation.
+
+Compare the fp32 and int8 variants side by side (each measured in a fresh
+process)::
+
+    python zero_shot.py --model facebook/bart-large-mnli
+    python zero_shot.py --tiny-model /tmp/tiny-mnli     # quick run on a random tiny model
+"""
+
+import argparse
+import functools
+import io
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+
+from model_config import MODEL_NAME, QUANTIZE, WARMUP
+
+logger = logging.getLogger(__name__)
+
+LABELS = ["faq", "sentiment", "escalation"]
+
+WARMUP_TEXT = "Where is my refund?"
+SAMPLE_QUERIES = [
+    "I am still waiting for my refund!",
+    "How do I change my flight date?",
+    "The crew was wonderful, thank you",
+    "This is the third time I am calling, I want to speak to a manager",
+    "What is the baggage allowance for economy?",
+    "My flight was cancelled and nobody is helping me",
+    "Do you have vegetarian meals?",
+    "Great service on my last trip"
+]
+
+
+@functools.lru_cache(maxsize=None)
+def load_pipeline(model=MODEL_NAME, quantize=QUANTIZE):
+    """Load (once per model and variant) the zero-shot classification pipeline"""
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer, pipeline
+
+    local = os.path.isdir(model)
+    logger.info(f"Loading zero-shot model {model}{' (int8 dynamic quantization)' if quantize else ''}")
+    tokenizer = AutoTokenizer.from_pretrained(model, local_files_only=local)
+    network = AutoModelForSequenceClassification.from_pretrained(model, local_files_only=local)
+    network.eval()
+    if quantize:
+        network = quantize_dynamic(network)
+    return pipeline("zero-shot-classification", model=network, tokenizer=tokenizer, device=-1)
+
+
+def quantize_dynamic(network):
+    """Return network with its Linear layers replaced by int8 dynamically quantized ones"""
+    import torch
+
+    return torch.quantization.quantize_dynamic(network, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def warm_up(classifier, labels=LABELS):
+    """Run one throwaway classification; returns how long it took in ms"""
+    started = time.perf_counter()
+    classifier(WARMUP_TEXT, labels)
+    return (time.perf_counter() - started) * 1000
+
+
+def download(model, path):
+    """Save model and tokenizer to a local directory for offline, hub-free loading"""
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    AutoTokenizer.from_pretrained(model).save_pretrained(path)
+    AutoModelForSequenceClassification.from_pretrained(model).save_pretrained(path)
+    return path
+
+
+def build_tiny_model(path, vocab_words=None):
+    """Save a tiny randomly initialised MNLI-style BART model and tokenizer to path
+
+    Scores are meaningless but the shapes and code paths match the real model,
+    so batching can be exercised on CPU in seconds.
+    """
+    from tokenizers import Tokenizer, models, normalizers, pre_tokenizers, processors
+    from transformers import BartConfig, BartForSequenceClassification, PreTrainedTokenizerFast
+
+    specials = ["<pad>", "<s>", "</s>", "<unk>", "<mask>"]
+    words = vocab_words or (
+        "this example is faq sentiment escalation about a the my i want to where refund flight "
+        "still waiting for am very angry how do what when can you help please"
+    ).split()
+    vocab = {token: index for index, token in enumerate(specials + sorted(set(words)))}
+
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+    tokenizer.normalizer = normalizers.Lowercase()
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    # BART's classification head reads the hidden state at the final </s>
+    tokenizer.post_processor = processors.TemplateProcessing(
+        single="<s> $A </s>",
+        pair="<s> $A </s> </s> $B </s>",
+        special_tokens=[("<s>", vocab["<s>"]), ("</s>", vocab["</s>"])]
+    )
+    fast_tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer,
+        bos_token="<s>", eos_token="</s>", unk_token="<unk>",
+        pad_token="<pad>", mask_token="<mask>", sep_token="</s>", cls_token="<s>"
+    )
+
+    config = BartConfig(
+        vocab_size=len(vocab),
+        d_model=16,
+        encoder_layers=1,
+        decoder_layers=1,
+        encoder_attention_heads=2,
+        decoder_attention_heads=2,
+        encoder_ffn_dim=32,
+        decoder_ffn_dim=32,
+        max_position_embeddings=128,
+        pad_token_id=vocab["<pad>"],
+        bos_token_id=vocab["<s>"],
+        eos_token_id=vocab["</s>"],
+        decoder_start_token_id=vocab["</s>"],
+        id2label={0: "contradiction", 1: "neutral", 2: "entailment"},
+        label2id={"contradiction": 0, "neutral": 1, "entailment": 2}
+    )
+    BartForSequenceClassification(config).save_pretrained(path)
+    fast_tokenizer.save_pretrained(path)
+    return path
+
+
+def rss_mb():
+    """Current resident set size of this process in MB"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except OSError:
+        # Peak rather than current outside Linux (KiB on Linux, bytes on macOS);
+        # resource is POSIX-only
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def weights_mb(network):
+    """Serialized size of the model's weights in MB"""
+    import torch
+
+    buffer = io.BytesIO()
+    torch.save(network.state_dict(), buffer)
+    return buffer.tell() / 1024 / 1024
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def measure(model, quantize, queries=SAMPLE_QUERIES, labels=LABELS, repeat=3):
+    """Load one variant in this process and return load time, memory and latency figures"""
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    classifier = load_pipeline(model, quantize)
+    load_s = time.perf_counter() - started
+    warmup_ms = warm_up(classifier, labels)
+
+    latencies = []
+    for _ in range(repeat):
+        for query in queries:
+            started = time.perf_counter()
+            classifier(query, labels)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    return {
+        'variant': 'int8' if quantize else 'fp32',
+        'model': model,
+        'load_s': round(load_s, 3),
+        'rss_mb': round(rss_mb() - rss_before, 1),
+        'weights_mb': round(weights_mb(classifier.model), 1),
+        'warmup_ms': round(warmup_ms, 2),
+        'queries': len(latencies),
+        'p50_ms': round(percentile(latencies, 0.50), 2),
+        'p95_ms': round(percentile(latencies, 0.95), 2),
+        'mean_ms': round(sum(latencies) / len(latencies), 2)
+    }
+
+
+def compare(model, repeat=3):
+    """Measure fp32 and int8 each in a fresh interpreter so load time and memory are not shared"""
+    results = []
+    for quantize in (False, True):
+        command = [sys.executable, os.path.abspath(__file__), '--model', model,
+                   '--variant', 'int8' if quantize else 'fp32', '--repeat', str(repeat)]
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return results
+
+
+def format_report(results):
+    columns = ('variant', 'load_s', 'rss_mb', 'weights_mb', 'warmup_ms', 'p50_ms', 'p95_ms', 'mean_ms')
+    lines = ['  '.join(f"{column:>10}" for column in columns)]
+    for result in results:
+        lines.append('  '.join(f"{result[column]:>10}" for column in columns))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare fp32 and int8 zero-shot model variants on CPU")
+    parser.add_argument("--model", default=MODEL_NAME, help="Model name or local directory")
+    parser.add_argument("--tiny-model", metavar="DIR", help="Build (if missing) and measure a tiny random model")
+    parser.add_argument("--download", metavar="DIR", help="Save --model to DIR for offline loading and exit")
+    parser.add_argument("--variant", choices=("fp32", "int8"), help="Measure one variant in this process")
+    parser.add_argument("--repeat", type=int, default=3, help="Passes over the sample queries")
+    parser.add_argument("--json", action="store_true", help="Print JSON instead of a table")
+    args = parser.parse_args()
+
+    if args.download:
+        print(download(args.model, args.download))
+        return
+
+    model = args.model
+    if args.tiny_model:
+        if not os.path.isdir(args.tiny_model):
+            build_tiny_model(args.tiny_model)
+        model = args.tiny_model
+
+    if args.variant:
+        print(json.dumps(measure(model, args.variant == 'int8', repeat=args.repeat)))
+        return
+
+    results = compare(model, args.repeat)
+    print(json.dumps(results, indent=2) if args.json else format_report(results))
+
+
+if __name__ == "__main__":
+    main()